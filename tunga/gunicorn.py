@@ -0,0 +1,17 @@
+"""
+Gunicorn config for tunga project.
+
+Workers are threaded so that an open event stream (tunga_messages.events) holds a thread rather than a process
+while it waits on Redis.
+
+command to run: gunicorn -c tunga/gunicorn.py tunga.wsgi
+"""
+
+import multiprocessing
+
+bind = '127.0.0.1:8000'
+worker_class = 'gthread'
+workers = multiprocessing.cpu_count() * 2 + 1
+# Concurrent requests, including open event streams, per worker
+threads = 100
+keepalive = 5
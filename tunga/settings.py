@@ -232,6 +232,14 @@ RQ_QUEUES = {
     'default': {
         'USE_REDIS_CACHE': 'default',
     },
+    # Periodic commands dispatched by tunga_scheduler
+    'scheduler': {
+        'USE_REDIS_CACHE': 'default',
+    },
+    # Participant payouts, see tunga_tasks.payouts
+    'payouts': {
+        'USE_REDIS_CACHE': 'default',
+    },
 }
 
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-17 04:28
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tunga_activity', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activityreadlog',
+            name='last_activity',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='activityreadlog',
+            name='last_email_action',
+            field=models.IntegerField(default=0),
+        ),
+    ]
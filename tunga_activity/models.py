@@ -16,6 +16,10 @@ class ActivityReadLog(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     last_read = models.IntegerField(default=0)
     last_email_at = models.DateTimeField(blank=True, null=True)
+    # Latest activity by others on the object, maintained by the task activity emails scan
+    last_activity = models.IntegerField(default=0)
+    # Last activity included in an activity email
+    last_email_action = models.IntegerField(default=0)
 
     def __unicode__(self):
         return '%s - %s #%s' % (self.user.get_short_name() or self.user.username, self.content_type, self.object_id)
@@ -1,3 +1,108 @@
+import datetime
+import json
+
+from actstream.models import Action
+from actstream.signals import action
+from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from tunga_activity.serializers import ActivitySerializer, SimpleActivitySerializer
+from tunga_activity.utils import prefetch_activity_objects
+from tunga_comments.models import Comment
+from tunga_messages.models import Channel, ChannelUser, Message
+from tunga_messages.utils import prefetch_channel_attachments
+from tunga_tasks.models import Task, Participation, ProgressEvent, ProgressReport, Application
+from tunga_utils.constants import USER_TYPE_DEVELOPER, USER_TYPE_PROJECT_OWNER, PROGRESS_EVENT_TYPE_MILESTONE, \
+    PROGRESS_REPORT_STATUS_ON_SCHEDULE, RATING_CRITERIA_CODING
+from tunga_utils.models import Rating, Upload
+
+
+class ActivitySerializerTestCase(TestCase):
+
+    def setUp(self):
+        self.project_owner = get_user_model().objects.create_user(
+            'project_owner', 'po@example.com', 'secret', **{'type': USER_TYPE_PROJECT_OWNER})
+        self.developer = get_user_model().objects.create_user(
+            'developer', 'developer@example.com', 'secret', **{'type': USER_TYPE_DEVELOPER})
+
+    def test_prefetch_activity_objects(self):
+        """
+        Batched generic relations render the same activity in a number of queries that doesn't grow with the page
+        """
+        self.create_activity()
+        self.count_queries()  # Warm up content type cache
+        single_counts = self.count_queries()
+
+        self.create_activity()
+        self.create_activity()
+        for serializer_class, fields in [
+            (SimpleActivitySerializer, ['action_object']), (ActivitySerializer, ['actor', 'action_object', 'target'])
+        ]:
+            actions = list(Action.objects.all().order_by('-id'))
+            expected_data = self.render(serializer_class, actions)
+
+            actions = list(Action.objects.all().order_by('-id'))
+            prefetch_activity_objects(actions, fields=fields)
+            self.assertEqual(self.render(serializer_class, actions), expected_data)
+        self.assertEqual(self.count_queries(), single_counts)
+
+        channel = Channel.objects.first()
+        Upload.objects.create(file='uploads/channel.txt', user=self.developer, content_object=channel)
+        Upload.objects.create(file='uploads/message.txt', user=self.developer, content_object=channel.messages.first())
+        channels = prefetch_channel_attachments(list(Channel.objects.all()))
+        self.assertEqual(
+            [[upload.id for upload in item.all_attachments] for item in channels],
+            [[upload.id for upload in Channel.objects.get(id=item.id).all_attachments] for item in channels]
+        )
+
+    def create_activity(self):
+        task = Task.objects.create(title='Task', fee=15, user=self.project_owner)
+        comment = Comment.objects.create(user=self.developer, body='Comment', content_object=task)
+        participation = Participation.objects.create(
+            task=task, user=self.developer, accepted=True, responded=True, created_by=self.project_owner
+        )
+        event = ProgressEvent.objects.create(
+            task=task, type=PROGRESS_EVENT_TYPE_MILESTONE, due_at=datetime.datetime.now(), created_by=self.project_owner
+        )
+        report = ProgressReport.objects.create(
+            event=event, user=self.developer, status=PROGRESS_REPORT_STATUS_ON_SCHEDULE, percentage=50,
+            accomplished='Some work'
+        )
+        # Applicants are rendered with their task stats
+        application = Application.objects.create(
+            task=task, user=self.developer, pitch='Pitch', hours_needed=10, deliver_at=datetime.datetime.now()
+        )
+        closed_task = Task.objects.create(title='Closed task', fee=15, user=self.project_owner, closed=True, satisfaction=8)
+        Participation.objects.create(
+            task=closed_task, user=self.developer, accepted=True, responded=True, created_by=self.project_owner
+        )
+        Rating.objects.create(
+            content_object=closed_task, score=8, criteria=RATING_CRITERIA_CODING, created_by=self.project_owner
+        )
+        for action_object in [task, comment, participation, event, report, application]:
+            action.send(self.developer, verb='updated', action_object=action_object, target=task)
+
+        # Channels are rendered with the current user's counters
+        channel = Channel.objects.create(subject='Channel', created_by=self.project_owner)
+        ChannelUser.objects.create(channel=channel, user=self.developer)
+        message = Message.objects.create(channel=channel, user=self.developer, body='Message')
+        action.send(self.developer, verb='updated', action_object=message, target=channel)
+
+    def render(self, serializer_class, actions):
+        request = RequestFactory().get('/')
+        request.user = self.developer
+        return json.loads(JSONRenderer().render(serializer_class(actions, many=True, context={'request': request}).data))
 
-# Create your tests here.
+    def count_queries(self):
+        counts = []
+        for serializer_class in [SimpleActivitySerializer, ActivitySerializer]:
+            with CaptureQueriesContext(connection) as queries:
+                actions = list(Action.objects.filter(verb='updated').order_by('-id'))
+                prefetch_activity_objects(actions)
+                self.render(serializer_class, actions)
+            counts.append(len(queries))
+        return counts
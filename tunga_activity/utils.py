@@ -0,0 +1,128 @@
+from collections import defaultdict
+
+from actstream.models import Action
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Prefetch
+
+from tunga_comments.models import Comment
+from tunga_messages.models import Message, Channel, ChannelUser
+from tunga_messages.utils import prefetch_channel_attachments
+from tunga_profiles.models import Connection
+from tunga_tasks.models import Task, Application, Participation, ProgressEvent, ProgressReport, \
+    IntegrationActivity, Estimate, Quote, WorkActivity, WorkPlan
+from tunga_tasks.utils import get_user_prefetch_lookups, prefetch_user_stats
+from tunga_utils.models import Upload
+
+ACTIVITY_OBJECT_FIELDS = ('actor', 'action_object', 'target')
+
+
+def get_upload_prefetch(lookup):
+    return [
+        Prefetch(lookup, queryset=Upload.objects.select_related('user__userprofile')),
+        '%s__user__socialaccount_set' % lookup
+    ]
+
+
+def get_activity_object_lookups():
+    """
+    Select and prefetch lookups needed to render each type of activity object with the activity serializers
+    """
+    estimate_users = ('user__userprofile', 'moderated_by__userprofile', 'reviewed_by__userprofile')
+    estimate_prefetches = [
+        Prefetch('activities', queryset=WorkActivity.objects.select_related('user__userprofile')),
+        'activities__user__socialaccount_set'
+    ] + get_user_prefetch_lookups('user', 'moderated_by', 'reviewed_by')
+
+    return {
+        get_user_model(): (('userprofile',), ['socialaccount_set']),
+        Channel: (
+            ('created_by__userprofile',),
+            [
+                Prefetch('participants', queryset=get_user_model().objects.select_related('userprofile')),
+                # The receiver and the current user's counters are read from the channel users
+                Prefetch('channeluser_set', queryset=ChannelUser.objects.select_related('user__userprofile'))
+            ] + get_user_prefetch_lookups('created_by', 'participants', 'channeluser_set__user')
+        ),
+        ChannelUser: (
+            ('channel__created_by__userprofile', 'user__userprofile'),
+            get_user_prefetch_lookups('channel__created_by', 'user')
+        ),
+        Message: (
+            ('user__userprofile', 'channel'),
+            get_user_prefetch_lookups('user') + get_upload_prefetch('attachments')
+        ),
+        Comment: (('user__userprofile',), get_user_prefetch_lookups('user') + get_upload_prefetch('uploads')),
+        Upload: (('user__userprofile',), get_user_prefetch_lookups('user')),
+        Connection: (
+            ('from_user__userprofile', 'to_user__userprofile'), get_user_prefetch_lookups('from_user', 'to_user')
+        ),
+        Task: (('user__userprofile',), get_user_prefetch_lookups('user')),
+        Application: (
+            ('user__userprofile__city', 'user__userprofile__btc_wallet', 'task__user__userprofile'),
+            [
+                'user__userprofile__skills', 'user__work_set', 'user__education_set'
+            ] + get_user_prefetch_lookups('user', 'task__user')
+        ),
+        Participation: (
+            ('user__userprofile', 'created_by__userprofile', 'task__user__userprofile'),
+            get_user_prefetch_lookups('user', 'created_by', 'task__user')
+        ),
+        Estimate: (estimate_users, estimate_prefetches),
+        Quote: (
+            estimate_users,
+            estimate_prefetches + [
+                Prefetch('plan', queryset=WorkPlan.objects.select_related('user__userprofile')),
+                'plan__user__socialaccount_set'
+            ]
+        ),
+        ProgressEvent: (
+            ('created_by__userprofile', 'progressreport__user__userprofile'),
+            get_user_prefetch_lookups('created_by', 'progressreport__user')
+        ),
+        ProgressReport: (
+            ('user__userprofile', 'event__created_by__userprofile'),
+            get_user_prefetch_lookups('user', 'event__created_by') + get_upload_prefetch('uploads')
+        ),
+        IntegrationActivity: (('integration', 'event'), [])
+    }
+
+
+def prefetch_activity_objects(actions, fields=ACTIVITY_OBJECT_FIELDS):
+    """
+    Resolves the generic relations of a page of actions with one batch of queries per content type
+    and caches the objects on the actions so the activity serializers don't load them one row at a time.
+    Applicants' task stats and channel attachments are memoized for the whole page as well
+    """
+    object_ids = defaultdict(set)
+    for action in actions:
+        for field in fields:
+            content_type_id = getattr(action, '%s_content_type_id' % field)
+            object_id = getattr(action, '%s_object_id' % field)
+            if content_type_id and object_id:
+                object_ids[content_type_id].add(object_id)
+
+    lookups = get_activity_object_lookups()
+    objects = dict()
+    for content_type_id, ids in object_ids.iteritems():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if not model:
+            continue
+        select_related, prefetch_related = lookups.get(model, ((), []))
+        for instance in model._default_manager.filter(pk__in=ids).select_related(
+                *select_related
+        ).prefetch_related(*prefetch_related):
+            objects[(content_type_id, unicode(instance.pk))] = instance
+
+    # Application details render the applicant with UserSerializer and its task stats
+    prefetch_user_stats([instance.user for instance in objects.itervalues() if isinstance(instance, Application)])
+    prefetch_channel_attachments([instance for instance in objects.itervalues() if isinstance(instance, Channel)])
+
+    for action in actions:
+        for field in fields:
+            instance = objects.get(
+                (getattr(action, '%s_content_type_id' % field), getattr(action, '%s_object_id' % field)), None
+            )
+            if instance:
+                setattr(action, getattr(Action, field).cache_attr, instance)
+    return actions
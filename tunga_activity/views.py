@@ -4,6 +4,8 @@ from rest_framework.permissions import IsAdminUser
 
 from tunga_activity.filters import ActionFilter
 from tunga_activity.serializers import ActivitySerializer
+from tunga_activity.utils import prefetch_activity_objects
+from tunga_utils.pagination import OptionalKeysetPagination
 
 
 class ActionViewSet(viewsets.ReadOnlyModelViewSet):
@@ -14,6 +16,13 @@ class ActionViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = ActivitySerializer
     permission_classes = [IsAdminUser]
     filter_class = ActionFilter
+    pagination_class = OptionalKeysetPagination
     search_fields = (
         'comments__body', 'messages__body', 'uploads__file', 'messages__attachments__file', 'comments__uploads__file'
     )
+
+    def paginate_queryset(self, queryset):
+        page = super(ActionViewSet, self).paginate_queryset(queryset)
+        if page is not None:
+            prefetch_activity_objects(page)
+        return page
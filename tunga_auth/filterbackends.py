@@ -1,26 +1,13 @@
-from django.core.exceptions import ObjectDoesNotExist
-from django.db.models.aggregates import Count, Sum
+from django.db.models.aggregates import Count
 from django.db.models.expressions import When, Case, F
 from django.db.models.fields import IntegerField
 from django.db.models.query_utils import Q
 from dry_rest_permissions.generics import DRYPermissionFiltersBase
 
 from tunga_auth.models import USER_TYPE_DEVELOPER, USER_TYPE_PROJECT_OWNER
-from tunga_profiles.models import UserProfile
+from tunga_profiles.connections import connected_user_ids
 from tunga_utils.constants import USER_TYPE_PROJECT_MANAGER
-
-
-def my_connections_q_filter(user):
-    return (
-        (
-            Q(connections_initiated__to_user=user) &
-            Q(connections_initiated__accepted=True)
-        ) |
-        (
-            Q(connection_requests__from_user=user) &
-            Q(connection_requests__accepted=True)
-        )
-    )
+from tunga_utils.skill_matching import annotate_skill_matches, match_users, get_user_skill_ids
 
 
 class UserFilterBackend(DRYPermissionFiltersBase):
@@ -77,31 +64,12 @@ class UserFilterBackend(DRYPermissionFiltersBase):
                 user_type = USER_TYPE_PROJECT_OWNER
             else:
                 user_type = USER_TYPE_DEVELOPER
-            queryset = queryset.filter(type=user_type).filter(
-                my_connections_q_filter(request.user)
-            )
+            queryset = queryset.filter(type=user_type, id__in=connected_user_ids(request.user))
         elif user_filter == 'requests':
             queryset = queryset.filter(
                 connections_initiated__to_user=request.user, connections_initiated__responded=False)
         elif user_filter == 'relevant':
-            queryset = queryset.filter(type=USER_TYPE_DEVELOPER)
-            try:
-                user_skills = request.user.userprofile.skills.all()
-                queryset = queryset.filter(userprofile__skills__in=user_skills)
-                when = []
-                for skill in user_skills:
-                    new_when = When(
-                            userprofile__skills=skill,
-                            then=1
-                        )
-                    when.append(new_when)
-                queryset = queryset.annotate(matches=Sum(
-                    Case(
-                        *when,
-                        default=0,
-                        output_field=IntegerField()
-                    )
-                )).order_by('-matches', 'first_name', 'last_name', '-date_joined')
-            except (ObjectDoesNotExist, UserProfile.DoesNotExist):
-                return queryset.none()
+            queryset = annotate_skill_matches(
+                queryset.filter(type=USER_TYPE_DEVELOPER), match_users(get_user_skill_ids(request.user))
+            ).order_by('-matches', 'first_name', 'last_name', '-date_joined')
         return queryset
@@ -84,18 +84,32 @@ class UserSerializer(SimpleUserSerializer, GetCurrentUserAnnotatedSerializerMixi
                 pass
         return None
 
+    def get_prefetched_stats(self, obj):
+        # Memoized for a batch of users by tunga_tasks.utils.prefetch_user_stats
+        return getattr(obj, 'prefetched_stats', None)
+
     def get_tasks_created(self, obj):
+        stats = self.get_prefetched_stats(obj)
+        if stats is not None:
+            return stats['tasks_created']
         return obj.tasks_created.count()
 
     def get_tasks_completed(self, obj):
+        stats = self.get_prefetched_stats(obj)
+        if stats is not None:
+            return stats['tasks_completed']
         return obj.participation_set.filter(task__closed=True, accepted=True).count()
 
     def get_satisfaction(self, obj):
         score = None
         if obj.type == USER_TYPE_DEVELOPER:
-            score = obj.participation_set.filter(
-                task__closed=True, accepted=True
-            ).aggregate(satisfaction=Avg('task__satisfaction'))['satisfaction']
+            stats = self.get_prefetched_stats(obj)
+            if stats is not None:
+                score = stats['satisfaction']
+            else:
+                score = obj.participation_set.filter(
+                    task__closed=True, accepted=True
+                ).aggregate(satisfaction=Avg('task__satisfaction'))['satisfaction']
             if score:
                 score = '{:0,.0f}%'.format(score*10)
         return score
@@ -103,15 +117,20 @@ class UserSerializer(SimpleUserSerializer, GetCurrentUserAnnotatedSerializerMixi
     def get_ratings(self, obj):
         score = None
         if obj.type == USER_TYPE_DEVELOPER:
-            query = Rating.objects.filter(
-                tasks__closed=True, tasks__participants=obj, tasks__participation__accepted=True
-            ).order_by('criteria')
-            details = query.values('criteria').annotate(avg=Avg('score'))
+            stats = self.get_prefetched_stats(obj)
+            if stats is not None:
+                details = stats['rating_details']
+                avg = stats['rating_avg']
+            else:
+                query = Rating.objects.filter(
+                    tasks__closed=True, tasks__participants=obj, tasks__participation__accepted=True
+                ).order_by('criteria')
+                details = query.values('criteria').annotate(avg=Avg('score'))
+                avg = query.aggregate(avg=Avg('score'))['avg']
             criteria_choices = dict(Rating._meta.get_field('criteria').flatchoices)
             for rating in details:
                 rating['display_criteria'] = criteria_choices[rating['criteria']]
                 rating['display_avg'] = rating['avg'] and '{:0,.0f}%'.format(rating['avg']*10)
-            avg = query.aggregate(avg=Avg('score'))['avg']
             score = {'avg': avg, 'display_avg': avg and '{:0,.0f}%'.format(avg*10) or None, 'details': details}
         return score
 
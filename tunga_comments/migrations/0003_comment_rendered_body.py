@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-17 04:09
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tunga_comments', '0002_auto_20160419_1817'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='body_excerpt',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='body_html',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='body_render_hash',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='body_text',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+    ]
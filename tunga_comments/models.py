@@ -6,18 +6,15 @@ from actstream.models import Action
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
-from django.utils.html import strip_tags
 from django.utils.translation import ugettext_lazy as _
 from dry_rest_permissions.generics import allow_staff_or_superuser
 
 from tunga import settings
-from tunga_utils.helpers import convert_to_text, convert_to_html
-from tunga_utils.models import Upload
+from tunga_utils.models import Upload, AbstractRenderedBody
 
 
-class Comment(models.Model):
+class Comment(AbstractRenderedBody):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    body = models.TextField()
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, verbose_name=_('content type'))
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey('content_type', 'object_id')
@@ -45,15 +42,3 @@ class Comment(models.Model):
     @allow_staff_or_superuser
     def has_object_write_permission(self, request):
         return request.user == self.user
-
-    @property
-    def excerpt(self):
-        return strip_tags(self.body)
-
-    @property
-    def text_body(self):
-        return convert_to_text(self.body)
-
-    @property
-    def html_body(self):
-        return convert_to_html(self.body)
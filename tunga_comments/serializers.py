@@ -11,5 +11,5 @@ class CommentSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Comment
-        fields = '__all__'
+        exclude = ('body_html', 'body_text', 'body_excerpt', 'body_render_hash')
         read_only_fields = ('created_at',)
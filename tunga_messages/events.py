@@ -0,0 +1,67 @@
+import json
+import time
+
+from django.db import transaction
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from tunga_messages.models import ChannelUser
+
+USER_EVENTS_CHANNEL = 'tunga:events:user:%s'
+
+EVENT_MESSAGE = 'message'
+EVENT_PARTICIPANT = 'participant'
+
+# Streams are closed after this long and the client reconnects (EventSource does so automatically),
+# this bounds how long a worker thread holds a connection and lets load balancers rebalance
+EVENT_STREAM_TIMEOUT = 55
+EVENT_STREAM_HEARTBEAT = 15
+EVENT_STREAM_RETRY = 3000
+
+
+def publish_channel_event(channel_id, event, **data):
+    """
+    Publishes a compact event envelope to every participant of the channel.
+    Envelopes only carry ids, clients fetch the activity itself with the channel activity endpoint.
+    Events are published once the transaction commits, so clients can always fetch what they are told about.
+    """
+    transaction.on_commit(lambda: _publish_channel_event(channel_id, event, **data))
+
+
+def _publish_channel_event(channel_id, event, **data):
+    envelope = json.dumps(dict(event=event, channel=channel_id, **data))
+    user_ids = ChannelUser.objects.filter(channel_id=channel_id).values_list('user_id', flat=True)
+    try:
+        pipeline = get_redis_connection('default').pipeline(transaction=False)
+        for user_id in user_ids:
+            pipeline.publish(USER_EVENTS_CHANNEL % user_id, envelope)
+        pipeline.execute()
+    except RedisError:
+        # Delivery is best effort, clients catch up with the activity endpoint on reconnect
+        pass
+
+
+def stream_user_events(user, timeout=EVENT_STREAM_TIMEOUT, heartbeat=EVENT_STREAM_HEARTBEAT):
+    """
+    Yields the user's events as Server-Sent Events until the timeout.
+    The stream subscribes before its first chunk is yielded and waits on the socket between events,
+    so an idle connection costs one Redis connection and no database queries.
+    """
+    pubsub = get_redis_connection('default').pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(USER_EVENTS_CHANNEL % user.id)
+    try:
+        yield 'retry: %s\n\n' % EVENT_STREAM_RETRY
+
+        started_at = last_sent_at = time.time()
+        while time.time() - started_at < timeout:
+            message = pubsub.get_message(timeout=min(heartbeat, max(timeout - (time.time() - started_at), 0)))
+            if message and message['type'] == 'message':
+                envelope = json.loads(message['data'])
+                yield 'event: %s\ndata: %s\n\n' % (envelope['event'], message['data'])
+                last_sent_at = time.time()
+            elif time.time() - last_sent_at >= heartbeat:
+                # Comments keep proxies from closing idle connections
+                yield ': keep-alive\n\n'
+                last_sent_at = time.time()
+    finally:
+        pubsub.close()
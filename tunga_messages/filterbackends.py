@@ -1,7 +1,7 @@
 from django.db.models.query_utils import Q
 from dry_rest_permissions.generics import DRYPermissionFiltersBase
 
-from tunga_messages.utils import all_messages_q_filter
+from tunga_messages.utils import all_messages_q_filter, user_channel_ids
 from tunga_utils.constants import CHANNEL_TYPE_SUPPORT, CHANNEL_TYPE_DEVELOPER
 
 
@@ -11,14 +11,15 @@ class ChannelFilterBackend(DRYPermissionFiltersBase):
         if request.user.is_authenticated():
             if request.user.is_staff or request.user.is_superuser:
                 queryset = queryset.filter(
-                    Q(channeluser__user=request.user) | Q(type=CHANNEL_TYPE_SUPPORT) | Q(type=CHANNEL_TYPE_DEVELOPER)
+                    Q(id__in=user_channel_ids(request.user)) | Q(type=CHANNEL_TYPE_SUPPORT) |
+                    Q(type=CHANNEL_TYPE_DEVELOPER)
                 )
             elif request.user.is_developer:
                 queryset = queryset.filter(
-                    Q(channeluser__user=request.user) | Q(type=CHANNEL_TYPE_DEVELOPER)
+                    Q(id__in=user_channel_ids(request.user)) | Q(type=CHANNEL_TYPE_DEVELOPER)
                 )
             else:
-                queryset = queryset.filter(channeluser__user=request.user)
+                queryset = queryset.filter(id__in=user_channel_ids(request.user))
             if not request.query_params.get('type', None):
                 queryset = queryset.exclude(type=CHANNEL_TYPE_SUPPORT)
             return queryset
@@ -29,5 +30,5 @@ class MessageFilterBackend(DRYPermissionFiltersBase):
 
     def filter_list_queryset(self, request, queryset, view):
         if request.user.is_authenticated():
-            return queryset.filter(all_messages_q_filter(request.user)).distinct()
+            return queryset.filter(all_messages_q_filter(request.user))
         return queryset.none()
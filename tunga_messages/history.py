@@ -0,0 +1,174 @@
+import csv
+import datetime
+import json
+
+from actstream.models import Action
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Case, When, Value
+from django.db.models.fields import DateTimeField
+
+from tunga_activity import verbs
+from tunga_messages.models import Message, Channel, ChannelUser
+from tunga_messages.utils import backfill_channel_last_activity, reconcile_channel_unread_counts
+from tunga_utils.constants import APP_INTEGRATION_PROVIDER_SLACK
+from tunga_utils.helpers import Echo
+
+EXPORT_FORMAT_NDJSON = 'ndjson'
+EXPORT_FORMAT_CSV = 'csv'
+
+EXPORT_CONTENT_TYPES = {
+    EXPORT_FORMAT_NDJSON: 'application/x-ndjson',
+    EXPORT_FORMAT_CSV: 'text/csv'
+}
+
+EXPORT_FIELDS = ('id', 'created_at', 'sender_id', 'sender', 'email', 'body', 'attachments')
+
+EXPORT_CHUNK_SIZE = 500
+
+# Slack message subtypes that are conversation, everything else (joins, topic changes e.t.c) is skipped
+SLACK_IMPORT_SUBTYPES = [None, 'bot_message', 'file_share', 'me_message', 'thread_broadcast']
+
+
+def iterate_channel_messages(channel, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields the channel's messages in id order one chunk at a time.
+    Each chunk is a fresh keyset query so memory stays constant even when the driver buffers whole results.
+    """
+    last_id = 0
+    while True:
+        messages = list(
+            Message.objects.filter(channel=channel, id__gt=last_id).order_by('id').select_related(
+                'user', 'channel'
+            ).prefetch_related('attachments')[:chunk_size]
+        )
+        if not messages:
+            break
+        for message in messages:
+            yield message
+        last_id = messages[-1].id
+
+
+def get_message_export_row(message):
+    sender = message.sender
+    return dict(
+        id=message.id,
+        created_at=message.created_at.isoformat(),
+        sender_id=getattr(sender, 'id', None),
+        sender=getattr(sender, 'display_name', None),
+        email=getattr(sender, 'email', None),
+        body=message.text_body,
+        attachments=[upload.file.url for upload in message.attachments.all()]
+    )
+
+
+def export_channel_messages(channel, export_format=EXPORT_FORMAT_NDJSON, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields the channel's history as NDJSON lines or CSV rows, suitable for a StreamingHttpResponse
+    """
+    rows = (get_message_export_row(message) for message in iterate_channel_messages(channel, chunk_size=chunk_size))
+    if export_format == EXPORT_FORMAT_CSV:
+        writer = csv.writer(Echo())
+        yield writer.writerow(EXPORT_FIELDS)
+        for row in rows:
+            row['attachments'] = ' '.join(row['attachments'])
+            yield writer.writerow([
+                unicode(row[field] if row[field] is not None else '').encode('utf-8') for field in EXPORT_FIELDS
+            ])
+    else:
+        for row in rows:
+            yield json.dumps(row) + '\n'
+
+
+def get_slack_user(slack_message, slack_users):
+    user_id = slack_message.get('user', None) or slack_message.get('bot_id', None)
+    profile = slack_message.get('user_profile', None) or {}
+    name = slack_users.get(user_id, None) or profile.get('real_name', None) or profile.get('name', None) or \
+        slack_message.get('username', None) or user_id
+    return dict(id=user_id, name=name, provider=APP_INTEGRATION_PROVIDER_SLACK)
+
+
+def bulk_create_slack_messages(channel, messages, batch_size=EXPORT_CHUNK_SIZE):
+    """
+    Inserts unsaved Slack messages (with extra carrying their Slack timestamp) and their send activity in batches.
+    Returns the ids of the new messages. bulk_create skips save() and signals,
+    callers update what the signals would have.
+    """
+    channel_type = ContentType.objects.get_for_model(Channel)
+    message_type = ContentType.objects.get_for_model(Message)
+    message_ids = []
+    for idx in range(0, len(messages), batch_size):
+        batch = messages[idx:idx + batch_size]
+        for message in batch:
+            message.render_body()
+        created_at_by_timestamp = dict([(json.loads(item.extra)['timestamp'], item.created_at) for item in batch])
+        with transaction.atomic():
+            last_id = Message.objects.filter(channel=channel).order_by('-id').values_list('id', flat=True).first()
+            Message.objects.bulk_create(batch, batch_size=batch_size)
+
+            created_at_by_id = dict()
+            for message_id, extra in Message.objects.filter(
+                    channel=channel, source=APP_INTEGRATION_PROVIDER_SLACK, id__gt=last_id or 0
+            ).values_list('id', 'extra'):
+                created_at = created_at_by_timestamp.get(json.loads(extra).get('timestamp', None), None)
+                if created_at:
+                    created_at_by_id[message_id] = created_at
+
+            # auto_now_add replaces the Slack timestamps on insert, restore them in one update
+            Message.objects.filter(id__in=created_at_by_id.keys()).update(created_at=Case(
+                *[When(id=key, then=Value(value)) for key, value in created_at_by_id.items()],
+                output_field=DateTimeField()
+            ))
+
+            # Slack messages are sent by the channel, like the ones relayed by the Slack webhook
+            Action.objects.bulk_create([
+                Action(
+                    actor_content_type=channel_type, actor_object_id=channel.id, verb=verbs.SEND,
+                    action_object_content_type=message_type, action_object_object_id=key,
+                    target_content_type=channel_type, target_object_id=channel.id, timestamp=value
+                ) for key, value in sorted(created_at_by_id.items())
+            ], batch_size=batch_size)
+            message_ids.extend(sorted(created_at_by_id.keys()))
+    return message_ids
+
+
+def import_slack_history(channel, slack_messages, slack_users=None, batch_size=EXPORT_CHUNK_SIZE):
+    """
+    Bulk creates the messages of a Slack channel export (and their send activity) in the channel.
+    Messages already imported (by Slack timestamp) are skipped so imports can be resumed.
+    Returns the number of imported messages.
+    """
+    slack_users = slack_users or dict()
+    imported_timestamps = set()
+    for extra in Message.objects.filter(
+            channel=channel, source=APP_INTEGRATION_PROVIDER_SLACK
+    ).values_list('extra', flat=True).iterator():
+        try:
+            imported_timestamps.add(json.loads(extra).get('timestamp', None))
+        except (TypeError, ValueError):
+            pass
+
+    messages = []
+    for slack_message in sorted(slack_messages, key=lambda item: float(item.get('ts', 0))):
+        timestamp = slack_message.get('ts', None)
+        if not timestamp or timestamp in imported_timestamps or \
+                slack_message.get('subtype', None) not in SLACK_IMPORT_SUBTYPES or not slack_message.get('text'):
+            continue
+        imported_timestamps.add(timestamp)
+        message = Message(
+            channel=channel,
+            body=slack_message['text'],
+            alt_user=json.dumps(get_slack_user(slack_message, slack_users)),
+            created_at=datetime.datetime.utcfromtimestamp(float(timestamp)),
+            source=APP_INTEGRATION_PROVIDER_SLACK,
+            extra=json.dumps(dict(timestamp=timestamp, imported=True))
+        )
+        messages.append(message)
+
+    bulk_create_slack_messages(channel, messages, batch_size=batch_size)
+
+    if messages:
+        # bulk_create skips the signals that maintain these
+        backfill_channel_last_activity([Channel.objects.get(id=channel.id)])
+        reconcile_channel_unread_counts(ChannelUser.objects.filter(channel=channel))
+    return len(messages)
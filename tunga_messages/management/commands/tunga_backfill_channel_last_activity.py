@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from tunga_messages.models import Channel
+from tunga_messages.utils import backfill_channel_last_activity
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=500)
+
+    def handle(self, *args, **options):
+        """
+        Fills the last activity and last message of channels from the existing activity and messages.
+        """
+        # command to run: python manage.py tunga_backfill_channel_last_activity
+
+        num_updated = 0
+        channel_ids = list(Channel.objects.all().order_by('id').values_list('id', flat=True))
+        for idx in range(0, len(channel_ids), options['batch_size']):
+            num_updated += len(backfill_channel_last_activity(
+                Channel.objects.filter(id__in=channel_ids[idx:idx + options['batch_size']])
+            ))
+
+        print "%s of %s channels updated" % (num_updated, len(channel_ids))
@@ -0,0 +1,31 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from tunga_messages.history import export_channel_messages, EXPORT_FORMAT_NDJSON, EXPORT_CONTENT_TYPES
+from tunga_messages.models import Channel
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('channel', type=int, help='Channel id')
+        parser.add_argument(
+            '--format', dest='export_format', default=EXPORT_FORMAT_NDJSON, choices=EXPORT_CONTENT_TYPES.keys()
+        )
+        parser.add_argument('--output', dest='output', default=None, help='File to write to, stdout by default')
+
+    def handle(self, *args, **options):
+        """
+        Writes a channel's full message history as NDJSON or CSV.
+        """
+        # command to run: python manage.py tunga_export_channel <channel_id> --format csv --output history.csv
+
+        channel = Channel.objects.get(id=options['channel'])
+        output = options['output'] and open(options['output'], 'wb') or sys.stdout
+        try:
+            for chunk in export_channel_messages(channel, export_format=options['export_format']):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,39 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from tunga_messages.history import import_slack_history
+from tunga_messages.models import Channel
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('channel', type=int, help='Channel id')
+        parser.add_argument('files', nargs='+', help='Day files of a Slack channel export e.g general/2017-03-01.json')
+        parser.add_argument('--users', dest='users', default=None, help='users.json of the Slack export')
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=500)
+
+    def handle(self, *args, **options):
+        """
+        Imports the history of a Slack channel into a channel.
+        """
+        # command to run: python manage.py tunga_import_slack_history <channel_id> general/*.json --users users.json
+
+        channel = Channel.objects.get(id=options['channel'])
+
+        slack_users = dict()
+        if options['users']:
+            with open(options['users']) as users_file:
+                for slack_user in json.load(users_file):
+                    slack_users[slack_user['id']] = slack_user.get('real_name', None) or slack_user.get('name', None)
+
+        slack_messages = []
+        for path in options['files']:
+            with open(path) as messages_file:
+                slack_messages.extend(json.load(messages_file))
+
+        num_imported = import_slack_history(
+            channel, slack_messages, slack_users=slack_users, batch_size=options['batch_size']
+        )
+        print "%s of %s messages imported into %s" % (num_imported, len(slack_messages), channel)
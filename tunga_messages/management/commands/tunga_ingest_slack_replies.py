@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from tunga_messages.slack_replies import ingest_slack_replies
+
+
+class Command(BaseCommand):
+
+    def handle(self, *args, **options):
+        """
+        Ingests Slack customer replies left queued, e.g by a consumer job that died.
+        """
+        # command to run: python manage.py tunga_ingest_slack_replies
+
+        print "ingested: %s" % ingest_slack_replies()
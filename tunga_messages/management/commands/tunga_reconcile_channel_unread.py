@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from tunga_messages.models import ChannelUser
+from tunga_messages.utils import reconcile_channel_unread_counts
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', dest='user', default=None, help='Only reconcile this username')
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run', default=False, help='Report drift without repairing it'
+        )
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=500)
+
+    def handle(self, *args, **options):
+        """
+        Recounts the unread counters of channel users from the activity table and repairs any drift.
+        """
+        # command to run: python manage.py tunga_reconcile_channel_unread
+
+        channel_users = ChannelUser.objects.all().order_by('channel_id', 'id')
+        if options['user']:
+            channel_users = channel_users.filter(user__username=options['user'])
+
+        num_checked = 0
+        num_drifted = 0
+        channel_user_ids = list(channel_users.values_list('id', flat=True))
+        for idx in range(0, len(channel_user_ids), options['batch_size']):
+            batch = ChannelUser.objects.filter(
+                id__in=channel_user_ids[idx:idx + options['batch_size']]
+            ).select_related('user')
+            for channel_user in reconcile_channel_unread_counts(batch, fix=not options['dry_run']):
+                print "%s in channel %s: %s unread, last message %s" % (
+                    channel_user.user.username, channel_user.channel_id, channel_user.unread_count,
+                    channel_user.last_message
+                )
+                num_drifted += 1
+            num_checked += len(batch)
+
+        print "%s of %s channel users drifted%s" % (num_drifted, num_checked, not options['dry_run'] and ', repaired' or '')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from tunga_messages.slack_replies import get_slack_reply_metrics
+
+
+class Command(BaseCommand):
+
+    def handle(self, *args, **options):
+        """
+        Prints the webhook latency, backlog depth and ingestion counters of Slack customer replies.
+        """
+        # command to run: python manage.py tunga_slack_reply_metrics
+
+        for key, value in sorted(get_slack_reply_metrics().iteritems()):
+            print "%s: %s" % (key, value)
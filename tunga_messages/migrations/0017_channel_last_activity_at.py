@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-17 03:54
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tunga_messages', '0016_channeluser_unread_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='channel',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='tunga_messages.Message'),
+        ),
+        migrations.AlterIndexTogether(
+            name='channel',
+            index_together=set([('last_activity_at', 'id')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-17 04:23
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tunga_messages', '0018_message_rendered_body'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channeluser',
+            name='last_email_action',
+            field=models.IntegerField(default=0),
+        ),
+    ]
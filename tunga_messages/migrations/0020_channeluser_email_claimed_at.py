@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-17 09:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_last_email_action(apps, schema_editor):
+    # Unread messages emails used to cover activity after last_email_at,
+    # the last activity before it is the high-water mark they are now bound by
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Action = apps.get_model('actstream', 'Action')
+    ChannelUser = apps.get_model('tunga_messages', 'ChannelUser')
+
+    channel_type = ContentType.objects.filter(app_label='tunga_messages', model='channel').first()
+    if not channel_type:
+        return
+    for channel_user_id, channel_id, last_email_at in ChannelUser.objects.filter(
+        last_email_at__isnull=False, last_email_action=0
+    ).values_list('id', 'channel_id', 'last_email_at').iterator():
+        last_action = Action.objects.filter(
+            target_content_type=channel_type, target_object_id=str(channel_id), timestamp__lte=last_email_at
+        ).order_by('-id').values_list('id', flat=True).first()
+        if last_action:
+            ChannelUser.objects.filter(id=channel_user_id).update(last_email_action=last_action)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('actstream', '0002_remove_action_data'),
+        ('tunga_messages', '0019_channeluser_last_email_action'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channeluser',
+            name='email_claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(set_last_email_action, migrations.RunPython.noop),
+    ]
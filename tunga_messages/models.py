@@ -8,7 +8,6 @@ from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelatio
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
 from django.db.models.query_utils import Q
-from django.utils.html import strip_tags
 from django.utils.translation import ugettext_lazy as _
 from dry_rest_permissions.generics import allow_staff_or_superuser
 
@@ -16,8 +15,8 @@ from tunga import settings
 from tunga_profiles.models import Connection, Inquirer
 from tunga_utils.constants import CHANNEL_TYPE_DIRECT, CHANNEL_TYPE_TOPIC, CHANNEL_TYPE_SUPPORT, \
     APP_INTEGRATION_PROVIDER_SLACK, CHANNEL_TYPE_DEVELOPER
-from tunga_utils.helpers import GenericObject, convert_to_text, convert_to_html
-from tunga_utils.models import Upload
+from tunga_utils.helpers import GenericObject
+from tunga_utils.models import Upload, AbstractRenderedBody
 
 
 CHANNEL_TYPE_CHOICES = (
@@ -43,6 +42,11 @@ class Channel(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     last_read = models.IntegerField(default=0)
+    # Denormalized from the channel's activity for inbox ordering (see update_channel_last_activity)
+    last_activity_at = models.DateTimeField(blank=True, null=True)
+    last_message = models.ForeignKey(
+        'Message', related_name='+', on_delete=models.SET_NULL, blank=True, null=True
+    )
 
     # The object of the channel, nullable for pure messages
     content_type = models.ForeignKey(
@@ -64,6 +68,7 @@ class Channel(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        index_together = [('last_activity_at', 'id')]
 
     @staticmethod
     @allow_staff_or_superuser
@@ -106,12 +111,18 @@ class Channel(models.Model):
 
     @property
     def all_attachments(self):
+        if hasattr(self, 'prefetched_attachments'):
+            # Memoized for a batch of channels by tunga_messages.utils.prefetch_channel_attachments
+            return self.prefetched_attachments
         return Upload.objects.filter(Q(channels=self) | Q(messages__channel=self))
 
     def get_receiver(self, sender):
         if sender and self.type in [CHANNEL_TYPE_DIRECT, CHANNEL_TYPE_TOPIC]:
-            participation = self.channeluser_set.filter(~Q(user_id=sender.id))
-            if participation and participation.count() == 1:
+            # Filtered in python so prefetched channel users are reused
+            participation = [
+                channel_user for channel_user in self.channeluser_set.all() if channel_user.user_id != sender.id
+            ]
+            if len(participation) == 1:
                 return participation[0].user
         return None
 
@@ -152,6 +163,14 @@ class ChannelUser(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     last_read = models.IntegerField(default=0)
     last_email_at = models.DateTimeField(blank=True, null=True)
+    # Last activity included in an unread messages email
+    last_email_action = models.IntegerField(default=0)
+    # When an unread messages email was claimed for sending, cleared once it's delivered or failed
+    email_claimed_at = models.DateTimeField(blank=True, null=True)
+
+    # Maintained from new channel activity, see tunga_messages.utils.increment_channel_unread_counts
+    unread_count = models.IntegerField(default=0)
+    last_message = models.IntegerField(default=0)
 
     def __unicode__(self):
         return '%s - %s' % (self.channel, self.user.get_short_name() or self.user.username)
@@ -160,13 +179,12 @@ class ChannelUser(models.Model):
         unique_together = ('user', 'channel')
 
 
-class Message(models.Model):
+class Message(AbstractRenderedBody):
     channel = models.ForeignKey(Channel, on_delete=models.CASCADE, related_name='messages')
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='messages',
         blank=True, null=True
     )
-    body = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     alt_user = models.TextField(blank=True, null=True)
     source = models.CharField(max_length=50, blank=True, null=True)
@@ -222,18 +240,6 @@ class Message(models.Model):
             return False
         return request.user == self.user
 
-    @property
-    def excerpt(self):
-        return strip_tags(self.body)
-
-    @property
-    def text_body(self):
-        return convert_to_text(self.body)
-
-    @property
-    def html_body(self):
-        return convert_to_html(self.body)
-
     def get_alt_user(self):
         if not self.alt_user:
             return None
@@ -1,17 +1,36 @@
+import datetime
+import logging
+import time
+from collections import defaultdict
+
+from actstream.models import Action
+from dateutil.relativedelta import relativedelta
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.mail import get_connection
+from django.db import transaction
+from django.db.models.expressions import Case, When, F, Value
+from django.db.models.fields import IntegerField
 from django.db.models.query_utils import Q
 from django_rq.decorators import job
 
 from tunga.settings import EMAIL_SUBJECT_PREFIX, TUNGA_URL, SLACK_CUSTOMER_INCOMING_WEBHOOK, SLACK_CUSTOMER_BOT_NAME, \
     SLACK_ATTACHMENT_COLOR_GREEN, TUNGA_ICON_URL_150
-from tunga_messages.models import Message
+from tunga_activity import verbs
+from tunga_messages.models import Message, Channel, ChannelUser
 from tunga_settings.slugs import DIRECT_MESSAGES_EMAIL
 from tunga_utils import slack_utils
 from tunga_utils.constants import CHANNEL_TYPE_SUPPORT, APP_INTEGRATION_PROVIDER_SLACK, CHANNEL_TYPE_DEVELOPER, \
-    USER_TYPE_DEVELOPER
-from tunga_utils.emails import send_mail
+    USER_TYPE_DEVELOPER, CHANNEL_TYPE_DIRECT
+from tunga_utils.emails import send_mail, render_mail
 from tunga_utils.helpers import clean_instance
 
+logger = logging.getLogger(__name__)
+
+UNREAD_MESSAGES_EMAIL_BATCH_SIZE = 50
+# Seconds after which a claim whose emails were never delivered or released (e.g. the job crashed) expires
+UNREAD_MESSAGES_EMAIL_CLAIM_TIMEOUT = 60 * 60
+
 
 @job
 def notify_new_message(instance):
@@ -108,3 +127,152 @@ def notify_new_message_developers(instance):
                     'message_url': '%s/conversation/%s/' % (TUNGA_URL, instance.channel_id)
                 }
                 send_mail(subject, 'tunga/email/email_new_message', to, ctx, bcc=bcc)
+
+
+def get_unread_message_email_claim_expiry():
+    return datetime.datetime.utcnow() - relativedelta(seconds=UNREAD_MESSAGES_EMAIL_CLAIM_TIMEOUT)
+
+
+def get_unread_message_email_digests(min_date, min_last_email_date, commission_date):
+    """
+    Finds the channel users to email about unread messages with one query on the channel users' unread counters
+    and one on the activity after their high-water mark (the later of last read and last emailed activity).
+    Returns a list of dicts with the channel user id, the number of new messages and the latest included activity.
+    """
+    candidates = list(ChannelUser.objects.filter(
+        Q(last_email_at__isnull=True) | Q(last_email_at__lt=min_last_email_date),
+        Q(email_claimed_at__isnull=True) | Q(email_claimed_at__lt=get_unread_message_email_claim_expiry()),
+        unread_count__gt=0, last_message__gt=F('last_read')
+    ).filter(
+        last_message__gt=F('last_email_action')
+    ).values_list('id', 'channel_id', 'user_id', 'last_read', 'last_email_action'))
+    if not candidates:
+        return []
+
+    channel_actions = defaultdict(list)
+    for channel_id, action_id, actor_id in Action.objects.filter(
+        target_content_type=ContentType.objects.get_for_model(Channel),
+        target_object_id__in=set([str(candidate[1]) for candidate in candidates]),
+        verb__in=[verbs.SEND, verbs.UPLOAD],
+        id__gt=min([max(candidate[3], candidate[4]) for candidate in candidates]),
+        timestamp__lte=min_date, timestamp__gte=commission_date
+    ).values_list('target_object_id', 'id', 'actor_object_id'):
+        channel_actions[int(channel_id)].append((action_id, actor_id))
+
+    digests = []
+    for channel_user_id, channel_id, user_id, last_read, last_email_action in candidates:
+        high_water_mark = max(last_read, last_email_action)
+        action_ids = [
+            action_id for action_id, actor_id in channel_actions[channel_id]
+            if action_id > high_water_mark and actor_id != str(user_id)
+        ]
+        if action_ids:
+            digests.append(dict(channel_user=channel_user_id, new_messages=len(action_ids), last_action=max(action_ids)))
+    return digests
+
+
+def claim_unread_message_email_digests(digests, min_last_email_date):
+    """
+    Claims the channel users of the digests before the emails are sent.
+    Rows are locked while they are claimed, so overlapping runs never claim the same row.
+    Claims are released when delivery fails and expire after UNREAD_MESSAGES_EMAIL_CLAIM_TIMEOUT,
+    so digests whose job crashed are picked by a later run.
+    Returns the digests that were claimed.
+    """
+    claimed_ids = set()
+    utc_now = datetime.datetime.utcnow()
+    claim_expiry = get_unread_message_email_claim_expiry()
+    for idx in range(0, len(digests), UNREAD_MESSAGES_EMAIL_BATCH_SIZE):
+        ids = [digest['channel_user'] for digest in digests[idx:idx + UNREAD_MESSAGES_EMAIL_BATCH_SIZE]]
+        with transaction.atomic():
+            claimable_ids = list(ChannelUser.objects.select_for_update().filter(
+                Q(last_email_at__isnull=True) | Q(last_email_at__lt=min_last_email_date),
+                Q(email_claimed_at__isnull=True) | Q(email_claimed_at__lt=claim_expiry),
+                id__in=ids
+            ).values_list('id', flat=True))
+            ChannelUser.objects.filter(id__in=claimable_ids).update(email_claimed_at=utc_now)
+        claimed_ids.update(claimable_ids)
+    return [digest for digest in digests if digest['channel_user'] in claimed_ids]
+
+
+def record_unread_message_emails(digests):
+    """
+    Moves the high-water mark of the channel users to the latest activity included in their delivered digests
+    and releases their claims
+    """
+    if digests:
+        ChannelUser.objects.filter(id__in=[digest['channel_user'] for digest in digests]).update(
+            last_email_action=Case(
+                *[When(id=digest['channel_user'], then=Value(digest['last_action'])) for digest in digests],
+                output_field=IntegerField()
+            ),
+            last_email_at=datetime.datetime.utcnow(),
+            email_claimed_at=None
+        )
+
+
+def release_unread_message_email_claims(channel_user_ids):
+    """
+    Releases the claims of undelivered digests so the next run picks them again
+    """
+    if channel_user_ids:
+        ChannelUser.objects.filter(id__in=channel_user_ids).update(email_claimed_at=None)
+
+
+def render_unread_messages_email(channel_user, new_messages):
+    channel = channel_user.channel
+    channel_name = channel.get_channel_display_name(channel_user.user)
+    if channel.type == CHANNEL_TYPE_DIRECT:
+        conversation_subject = "New message%s from %s" % (new_messages == 1 and '' or 's', channel_name)
+    else:
+        conversation_subject = "Conversation: %s" % channel_name
+    subject = "%s %s" % (EMAIL_SUBJECT_PREFIX, conversation_subject)
+    ctx = {
+        'receiver': channel_user.user,
+        'new_messages': new_messages,
+        'channel_name': channel_name,
+        'channel': channel,
+        'channel_url': '%s/conversation/%s/' % (TUNGA_URL, channel.id)
+    }
+    return render_mail(subject, 'tunga/email/email_unread_channel_messages', [channel_user.user.email], ctx)
+
+
+@job
+def send_unread_message_emails(digests):
+    """
+    Renders a batch of claimed unread messages digests and sends them over one SMTP connection.
+    The high-water mark of each delivered digest is saved even if a later delivery fails,
+    the claims of the digests that weren't delivered are released.
+    """
+    started_at = rendered_at = time.time()
+    digests = dict([(digest['channel_user'], digest) for digest in digests])
+    emails = []
+    delivered_ids = []
+    try:
+        channel_users = ChannelUser.objects.filter(id__in=digests.keys()).select_related(
+            'channel', 'user'
+        ).prefetch_related('channel__channeluser_set__user')
+        emails = [
+            (channel_user.id, render_unread_messages_email(channel_user, digests[channel_user.id]['new_messages']))
+            for channel_user in channel_users
+        ]
+        rendered_at = time.time()
+
+        connection = get_connection()
+        connection.open()
+        try:
+            for channel_user_id, email in emails:
+                if connection.send_messages([email]):
+                    delivered_ids.append(channel_user_id)
+        finally:
+            connection.close()
+    finally:
+        record_unread_message_emails([digests[channel_user_id] for channel_user_id in delivered_ids])
+        release_unread_message_email_claims([
+            channel_user_id for channel_user_id in digests.keys() if channel_user_id not in delivered_ids
+        ])
+        logger.info(
+            'Unread messages emails: rendered %s in %.2fs, delivered %s in %.2fs',
+            len(emails), rendered_at - started_at, len(delivered_ids), time.time() - rendered_at
+        )
+    return len(delivered_ids)
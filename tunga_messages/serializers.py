@@ -3,7 +3,6 @@ from django.db.models.query_utils import Q
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from tunga_messages.utils import channel_activity_new_messages_filter
 from tunga_messages.models import Message, Channel, ChannelUser
 from tunga_messages.tasks import get_or_create_direct_channel
 from tunga_utils.constants import CHANNEL_TYPE_SUPPORT, CHANNEL_TYPE_DEVELOPER
@@ -141,21 +140,37 @@ class ChannelSerializer(DetailAnnotatedModelSerializer, GetCurrentUserAnnotatedS
                 return SimpleUserSerializer(receiver).data
         return None
 
+    def get_channel_user(self, obj):
+        # The same serializer renders every channel of a list, so keep each channel's lookup
+        if not hasattr(self, 'channel_users'):
+            self.channel_users = dict()
+        if obj.id not in self.channel_users:
+            current_user = self.get_current_user()
+            prefetch_cache_name = ChannelUser._meta.get_field('channel').related_query_name()
+            if prefetch_cache_name in getattr(obj, '_prefetched_objects_cache', {}):
+                # Filtered in python so prefetched channel users are reused
+                channel_users = [
+                    channel_user for channel_user in obj.channeluser_set.all() if channel_user.user_id == current_user.id
+                ]
+                self.channel_users[obj.id] = channel_users and channel_users[0] or None
+            else:
+                self.channel_users[obj.id] = obj.channeluser_set.filter(user=current_user).first()
+        return self.channel_users[obj.id]
+
     def get_new(self, obj):
         user = self.get_current_user()
         if user:
-            return channel_activity_new_messages_filter(
-                queryset=obj.target_actions.filter(channels__channeluser__user=user), user=user
-            ).count()
+            channel_user = self.get_channel_user(obj)
+            if channel_user:
+                return channel_user.unread_count
         return 0
 
     def get_last_read(self, obj):
         user = self.get_current_user()
         if user:
-            try:
-                return obj.channeluser_set.get(user=user).last_read
-            except:
-                pass
+            channel_user = self.get_channel_user(obj)
+            if channel_user:
+                return channel_user.last_read
         else:
             return obj.last_read
         return 0
@@ -181,7 +196,7 @@ class MessageSerializer(serializers.ModelSerializer, GetCurrentUserAnnotatedSeri
 
     class Meta:
         model = Message
-        exclude = ('alt_user', 'source', 'extra')
+        exclude = ('alt_user', 'source', 'extra', 'body_html', 'body_text', 'body_excerpt', 'body_render_hash')
         read_only_fields = ('created_at',)
 
 
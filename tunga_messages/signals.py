@@ -1,15 +1,28 @@
+from actstream.models import Action
 from actstream.signals import action
 from django.contrib.contenttypes.models import ContentType
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch.dispatcher import receiver
 
 from tunga_activity import verbs
+from tunga_messages.events import publish_channel_event, EVENT_MESSAGE, EVENT_PARTICIPANT
 from tunga_messages.models import Message, Channel, ChannelUser
 from tunga_messages.notifications import notify_new_message_slack, notify_new_message_developers
 from tunga_profiles.models import Inquirer
+from tunga_profiles.notification_summary import invalidate_notifications, NOTIFICATION_CHANNELS
 from tunga_utils.constants import CHANNEL_TYPE_DIRECT, CHANNEL_TYPE_SUPPORT, APP_INTEGRATION_PROVIDER_SLACK, \
     CHANNEL_TYPE_DEVELOPER
 from tunga_messages.tasks import clean_direct_channel
+from tunga_messages.utils import is_channel_unread_activity, increment_channel_unread_counts, \
+    reconcile_channel_unread_counts, update_channel_last_activity
+
+
+def get_sent_action(responses):
+    # action.send returns the (receiver, response) pairs of the signal, actstream's handler responds with the action
+    for handler, response in responses or []:
+        if isinstance(response, Action):
+            return response
+    return None
 
 
 @receiver(post_save, sender=Channel)
@@ -24,6 +37,9 @@ def activity_handler_channel(sender, instance, created, **kwargs):
             action.send(
                 actor, verb=verbs.CREATE, action_object=instance, timestamp=instance.created_at
             )
+        if not instance.last_activity_at:
+            Channel.objects.filter(id=instance.id).update(last_activity_at=instance.created_at)
+            instance.last_activity_at = instance.created_at
 
     if instance.type == CHANNEL_TYPE_DIRECT:
         clean_direct_channel(instance)
@@ -32,15 +48,26 @@ def activity_handler_channel(sender, instance, created, **kwargs):
 @receiver(post_save, sender=ChannelUser)
 def activity_handler_channel_user(sender, instance, created, **kwargs):
     if created:
-        action.send(
+        activity = get_sent_action(action.send(
             instance.user, verb=verbs.ADD, action_object=instance, target=instance.channel,
             timestamp=instance.created_at
+        ))
+        publish_channel_event(
+            instance.channel_id, EVENT_PARTICIPANT, user=instance.user_id, activity=activity and activity.id
         )
+        # Earlier activity in the channel is unread for new participants
+        reconcile_channel_unread_counts([instance])
 
     if instance.channel.type == CHANNEL_TYPE_DIRECT:
         clean_direct_channel(instance.channel)
 
 
+@receiver(post_save, sender=ChannelUser)
+@receiver(post_delete, sender=ChannelUser)
+def activity_handler_channel_user_notifications(sender, instance, **kwargs):
+    invalidate_notifications([instance.user_id], NOTIFICATION_CHANNELS)
+
+
 @receiver(post_save, sender=Message)
 def activity_handler_new_message(sender, instance, created, **kwargs):
     if created:
@@ -53,9 +80,13 @@ def activity_handler_new_message(sender, instance, created, **kwargs):
             actor = instance.channel.content_object
 
         if actor:
-            action.send(
+            activity = get_sent_action(action.send(
                 actor, verb=verbs.SEND, action_object=instance, target=instance.channel,
                 timestamp=instance.created_at
+            ))
+            publish_channel_event(
+                instance.channel_id, EVENT_MESSAGE, message=instance.id, user=instance.user_id,
+                activity=activity and activity.id
             )
 
         if instance.channel.type == CHANNEL_TYPE_SUPPORT:
@@ -63,3 +94,16 @@ def activity_handler_new_message(sender, instance, created, **kwargs):
 
         if instance.channel.type == CHANNEL_TYPE_DEVELOPER and (instance.user.is_staff or instance.user.is_superuser):
             notify_new_message_developers.delay(instance.id)
+
+
+@receiver(post_save, sender=Action)
+def activity_handler_channel_unread_counts(sender, instance, created, **kwargs):
+    # Messages are counted through their send activity, uploads to the channel through their upload activity
+    if created and is_channel_unread_activity(instance):
+        increment_channel_unread_counts(instance)
+
+
+@receiver(post_save, sender=Action)
+def activity_handler_channel_last_activity(sender, instance, created, **kwargs):
+    if created and instance.target_content_type_id == ContentType.objects.get_for_model(Channel).id:
+        update_channel_last_activity(instance)
@@ -0,0 +1,202 @@
+import datetime
+import json
+import time
+from collections import defaultdict
+from uuid import uuid4
+
+from django.db import transaction
+from django_redis import get_redis_connection
+
+from tunga_messages.events import publish_channel_event, EVENT_MESSAGE
+from tunga_messages.history import bulk_create_slack_messages
+from tunga_messages.models import Message, Channel, ChannelUser
+from tunga_messages.utils import backfill_channel_last_activity, reconcile_channel_unread_counts
+from tunga_utils import slack_utils
+from tunga_utils.constants import APP_INTEGRATION_PROVIDER_SLACK
+from tunga_utils.scheduler import acquire_lock, renew_lock, release_lock
+
+SLACK_REPLIES_QUEUE_KEY = 'tunga:slack:replies:queue'
+SLACK_REPLIES_PROCESSING_KEY = 'tunga:slack:replies:processing'
+SLACK_REPLIES_LOCK_KEY = 'tunga:slack:replies:lock'
+SLACK_REPLIES_SCHEDULED_KEY = 'tunga:slack:replies:scheduled'
+SLACK_REPLIES_METRICS_KEY = 'tunga:slack:replies:metrics'
+
+# A consumer job is enqueued at most once in this window, replies arriving meanwhile are picked up by that job
+SLACK_REPLIES_SCHEDULE_TIMEOUT = 60
+SLACK_REPLIES_BATCH_SIZE = 200
+# Only one job ingests at a time, so the processing list only holds the batch of the job that is running
+SLACK_REPLIES_LOCK_TIMEOUT = 5 * 60
+
+# Moves the oldest replies to the processing list in one step, unless a batch is still there from a job that died
+CLAIM_SLACK_REPLIES_SCRIPT = """
+if redis.call('llen', KEYS[2]) == 0 then
+    local replies = redis.call('lrange', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+    if #replies > 0 then
+        redis.call('rpush', KEYS[2], unpack(replies))
+        redis.call('ltrim', KEYS[1], #replies, -1)
+    end
+end
+return redis.call('lrange', KEYS[2], 0, -1)
+"""
+
+
+def queue_slack_reply(channel_id, message, payload):
+    """
+    Queues a validated reply from the Slack webhook and returns True if a consumer job needs to be enqueued
+    """
+    connection = get_redis_connection('default')
+    pipeline = connection.pipeline()
+    pipeline.rpush(SLACK_REPLIES_QUEUE_KEY, json.dumps(dict(
+        channel=channel_id, message=message, payload=payload, received_at=time.time()
+    )))
+    pipeline.set(SLACK_REPLIES_SCHEDULED_KEY, 1, ex=SLACK_REPLIES_SCHEDULE_TIMEOUT, nx=True)
+    return bool(pipeline.execute()[1])
+
+
+def record_slack_reply_latency(started_at):
+    pipeline = get_redis_connection('default').pipeline(transaction=False)
+    pipeline.hincrby(SLACK_REPLIES_METRICS_KEY, 'webhook_count', 1)
+    pipeline.hincrbyfloat(SLACK_REPLIES_METRICS_KEY, 'webhook_total_ms', (time.time() - started_at) * 1000)
+    pipeline.execute()
+
+
+def get_slack_reply_metrics():
+    """
+    Webhook latency, backlog depth and ingestion counters of Slack customer replies
+    """
+    pipeline = get_redis_connection('default').pipeline(transaction=False)
+    pipeline.hgetall(SLACK_REPLIES_METRICS_KEY)
+    pipeline.llen(SLACK_REPLIES_QUEUE_KEY)
+    pipeline.llen(SLACK_REPLIES_PROCESSING_KEY)
+    stored_metrics, backlog, processing = pipeline.execute()
+
+    metrics = dict([(key, float(value)) for key, value in stored_metrics.iteritems()])
+    webhook_count = metrics.get('webhook_count', 0)
+    metrics['webhook_avg_ms'] = webhook_count and metrics.get('webhook_total_ms', 0) / webhook_count or 0
+    metrics['backlog'] = backlog + processing
+    return metrics
+
+
+def claim_slack_replies(batch_size=SLACK_REPLIES_BATCH_SIZE):
+    """
+    Moves a batch of queued replies to the processing list and returns it.
+    The batch stays there until it's acknowledged, so a batch whose job died is claimed again.
+    """
+    return [json.loads(reply) for reply in get_redis_connection('default').eval(
+        CLAIM_SLACK_REPLIES_SCRIPT, 2, SLACK_REPLIES_QUEUE_KEY, SLACK_REPLIES_PROCESSING_KEY, batch_size
+    )]
+
+
+def acknowledge_slack_replies():
+    get_redis_connection('default').delete(SLACK_REPLIES_PROCESSING_KEY)
+
+
+def get_slack_reply_message(channel, reply):
+    payload = reply['payload']
+    timestamp = payload.get(slack_utils.KEY_TIMESTAMP, None) or payload.get(slack_utils.KEY_TS, None) or \
+        '%.6f' % reply['received_at']
+    return Message(
+        channel=channel,
+        body=reply['message'],
+        alt_user=json.dumps(dict(
+            id=payload.get(slack_utils.KEY_USER_ID, None),
+            name=payload.get(slack_utils.KEY_USER_NAME, None),
+            provider=APP_INTEGRATION_PROVIDER_SLACK
+        )),
+        created_at=datetime.datetime.utcfromtimestamp(float(timestamp)),
+        source=APP_INTEGRATION_PROVIDER_SLACK,
+        extra=json.dumps(dict(
+            channel=dict(
+                id=payload.get(slack_utils.KEY_CHANNEL_ID, None),
+                name=payload.get(slack_utils.KEY_CHANNEL_NAME, None)
+            ),
+            team=dict(
+                id=payload.get(slack_utils.KEY_TEAM_ID, None),
+                domain=payload.get(slack_utils.KEY_TEAM_DOMAIN, None)
+            ),
+            timestamp=timestamp
+        ))
+    )
+
+
+def ingest_slack_replies(batch_size=SLACK_REPLIES_BATCH_SIZE):
+    """
+    Drains the queued Slack replies, coalescing each burst into one bulk insert per channel.
+    Replies Slack delivered more than once (same channel and timestamp) are only inserted once.
+    A batch is only removed from Redis once its messages are committed,
+    batches left behind by a job that died are picked up by the next job or by the scheduled sweep.
+    Returns the number of inserted messages.
+    """
+    # Replies queued from now on schedule another job
+    get_redis_connection('default').delete(SLACK_REPLIES_SCHEDULED_KEY)
+
+    token = str(uuid4())
+    if not acquire_lock(SLACK_REPLIES_LOCK_KEY, token, SLACK_REPLIES_LOCK_TIMEOUT):
+        return 0
+    try:
+        num_ingested = 0
+        while True:
+            replies = claim_slack_replies(batch_size=batch_size)
+            if not replies:
+                break
+            with transaction.atomic():
+                num_ingested += ingest_slack_reply_batch(replies)
+            acknowledge_slack_replies()
+            renew_lock(SLACK_REPLIES_LOCK_KEY, token, SLACK_REPLIES_LOCK_TIMEOUT)
+        return num_ingested
+    finally:
+        release_lock(SLACK_REPLIES_LOCK_KEY, token)
+
+
+def ingest_slack_reply_batch(replies):
+    """
+    Inserts the new messages of a batch of replies and returns their number
+    """
+    num_batch_ingested = 0
+    num_duplicates = 0
+    channel_replies = defaultdict(list)
+    for reply in replies:
+        channel_replies[reply['channel']].append(reply)
+    channels = Channel.objects.in_bulk(channel_replies.keys())
+
+    for channel_id, replies_to_channel in channel_replies.iteritems():
+        channel = channels.get(channel_id, None)
+        if not channel:
+            continue
+        messages = [get_slack_reply_message(channel, reply) for reply in replies_to_channel]
+
+        received_timestamps = set()
+        existing_timestamps = set()
+        for extra in Message.objects.filter(
+                channel=channel, source=APP_INTEGRATION_PROVIDER_SLACK,
+                created_at__in=[message.created_at for message in messages]
+        ).values_list('extra', flat=True):
+            existing_timestamps.add(json.loads(extra).get('timestamp', None))
+
+        new_messages = []
+        for message in messages:
+            timestamp = json.loads(message.extra)['timestamp']
+            if timestamp in existing_timestamps or timestamp in received_timestamps:
+                num_duplicates += 1
+                continue
+            received_timestamps.add(timestamp)
+            new_messages.append(message)
+
+        message_ids = bulk_create_slack_messages(channel, new_messages)
+        if message_ids:
+            # bulk_create skips the signals that maintain these
+            backfill_channel_last_activity([channel])
+            reconcile_channel_unread_counts(ChannelUser.objects.filter(channel=channel))
+            for activity_id, message_id in channel.target_actions.filter(
+                action_object_object_id__in=[str(item) for item in message_ids]
+            ).values_list('id', 'action_object_object_id'):
+                publish_channel_event(channel.id, EVENT_MESSAGE, message=int(message_id), activity=activity_id)
+        num_batch_ingested += len(message_ids)
+
+    oldest_received_at = min([reply['received_at'] for reply in replies])
+    pipeline = get_redis_connection('default').pipeline(transaction=False)
+    pipeline.hincrby(SLACK_REPLIES_METRICS_KEY, 'ingested_count', num_batch_ingested)
+    pipeline.hincrby(SLACK_REPLIES_METRICS_KEY, 'duplicate_count', num_duplicates)
+    pipeline.hset(SLACK_REPLIES_METRICS_KEY, 'ingest_lag_ms', (time.time() - oldest_received_at) * 1000)
+    pipeline.execute()
+    return num_batch_ingested
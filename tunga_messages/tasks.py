@@ -2,6 +2,7 @@ from django.contrib.contenttypes.models import ContentType
 from django_rq.decorators import job
 
 from tunga_messages.models import Channel, ChannelUser, Message
+from tunga_messages.slack_replies import ingest_slack_replies
 from tunga_tasks.models import Task
 from tunga_utils.constants import CHANNEL_TYPE_DIRECT, CHANNEL_TYPE_TOPIC, CHANNEL_TYPE_SUPPORT, CHANNEL_TYPE_DEVELOPER
 from tunga_utils.helpers import clean_instance
@@ -72,3 +73,8 @@ def clean_direct_channel(channel):
     if channel.type == CHANNEL_TYPE_DIRECT and channel.participants.count() > 2:
         channel.type = CHANNEL_TYPE_TOPIC
         channel.save()
+
+
+@job
+def ingest_slack_customer_replies():
+    ingest_slack_replies()
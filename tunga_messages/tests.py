@@ -1,3 +1,396 @@
-from django.test import TestCase
+import csv
+import datetime
+import json
 
-# Create your tests here.
+from actstream.models import Action
+from dateutil.relativedelta import relativedelta
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import transaction
+from django_redis import get_redis_connection
+from rest_framework.test import APIRequestFactory
+from django.test import TestCase, TransactionTestCase
+
+from tunga_activity import verbs
+from tunga_messages import notifications, slack_replies
+from tunga_messages.slack_replies import SLACK_REPLIES_QUEUE_KEY, SLACK_REPLIES_SCHEDULED_KEY, \
+    SLACK_REPLIES_METRICS_KEY, SLACK_REPLIES_PROCESSING_KEY, SLACK_REPLIES_LOCK_KEY, ingest_slack_replies, \
+    get_slack_reply_metrics
+from tunga_messages.views import slack_customer_notification
+from tunga_messages.history import import_slack_history, export_channel_messages, EXPORT_FORMAT_CSV
+from tunga_messages.events import stream_user_events, EVENT_MESSAGE, EVENT_PARTICIPANT
+from tunga_messages.models import Message, ChannelUser, Channel
+from tunga_messages.notifications import get_unread_message_email_digests, claim_unread_message_email_digests, \
+    record_unread_message_emails, send_unread_message_emails, UNREAD_MESSAGES_EMAIL_CLAIM_TIMEOUT
+from tunga_messages.tasks import create_channel, get_or_create_direct_channel
+from tunga_messages.utils import channel_activity_new_messages_filter, update_channel_last_read, \
+    reconcile_channel_unread_counts, backfill_channel_last_activity
+from tunga.settings import SLACK_CUSTOMER_OUTGOING_WEBHOOK_TOKEN
+from tunga_utils.constants import USER_TYPE_DEVELOPER, USER_TYPE_PROJECT_OWNER, CHANNEL_TYPE_SUPPORT
+from tunga_utils.helpers import convert_to_html, convert_to_text
+from tunga_utils.models import Upload
+
+
+class ChannelUnreadTestCase(TestCase):
+
+    def setUp(self):
+        self.project_owner = get_user_model().objects.create_user(
+            'project_owner', 'po@example.com', 'secret', **{'type': USER_TYPE_PROJECT_OWNER})
+        self.developer = get_user_model().objects.create_user(
+            'developer', 'developer@example.com', 'secret', **{'type': USER_TYPE_DEVELOPER})
+
+    def test_unread_counters(self):
+        """
+        Unread counters follow new messages and uploads, reads and drift the same way as the activity aggregate
+        """
+        channel = create_channel(self.project_owner, participants=[self.developer], subject='Channel')
+        for idx in range(3):
+            Message.objects.create(channel=channel, user=self.developer, body='Message %s' % idx)
+        Message.objects.create(channel=channel, user=self.project_owner, body='Reply')
+        Upload.objects.create(file='uploads/upload.txt', user=self.developer, content_object=channel)
+
+        def assert_counters_match():
+            for user in [self.project_owner, self.developer]:
+                channel_user = ChannelUser.objects.get(channel=channel, user=user)
+                self.assertEqual(channel_user.unread_count, channel_activity_new_messages_filter(
+                    queryset=channel.target_actions.filter(channels__channeluser__user=user), user=user
+                ).count())
+                self.assertEqual(channel_user.last_message, channel.target_actions.latest('id').id)
+
+        assert_counters_match()
+        self.assertEqual(ChannelUser.objects.get(channel=channel, user=self.project_owner).unread_count, 4)
+        self.assertEqual(ChannelUser.objects.get(channel=channel, user=self.developer).unread_count, 1)
+
+        # Partial and full reads
+        first_message = channel.target_actions.order_by('id').filter(verb=verbs.SEND).first()
+        update_channel_last_read(channel, self.project_owner, first_message.id)
+        assert_counters_match()
+        self.assertEqual(ChannelUser.objects.get(channel=channel, user=self.project_owner).unread_count, 3)
+        update_channel_last_read(channel, self.project_owner, channel.target_actions.latest('id').id)
+        assert_counters_match()
+
+        # Drift is reported and repaired
+        ChannelUser.objects.filter(channel=channel).update(unread_count=10)
+        self.assertEqual(len(reconcile_channel_unread_counts(ChannelUser.objects.filter(channel=channel))), 2)
+        assert_counters_match()
+        self.assertEqual(reconcile_channel_unread_counts(ChannelUser.objects.filter(channel=channel)), [])
+
+        # New participants start with the earlier activity unread
+        other_developer = get_user_model().objects.create_user(
+            'other_developer', 'other_developer@example.com', 'secret', **{'type': USER_TYPE_DEVELOPER})
+        ChannelUser.objects.create(channel=channel, user=other_developer)
+        self.assertEqual(ChannelUser.objects.get(channel=channel, user=other_developer).unread_count, 5)
+
+
+class ChannelLastActivityTestCase(TestCase):
+
+    def setUp(self):
+        self.project_owner = get_user_model().objects.create_user(
+            'project_owner', 'po@example.com', 'secret', **{'type': USER_TYPE_PROJECT_OWNER})
+        self.developer = get_user_model().objects.create_user(
+            'developer', 'developer@example.com', 'secret', **{'type': USER_TYPE_DEVELOPER})
+
+    def test_last_activity(self):
+        """
+        Channels carry their latest activity and message so the inbox is ordered without the activity table
+        """
+        channel = create_channel(self.project_owner, participants=[self.developer], subject='Channel')
+        other_channel = create_channel(self.project_owner, participants=[self.developer], subject='Other Channel')
+        message = Message.objects.create(channel=channel, user=self.developer, body='Message')
+
+        channel = Channel.objects.get(id=channel.id)
+        self.assertEqual(channel.last_activity_at, channel.target_actions.latest('timestamp').timestamp)
+        self.assertEqual(channel.last_message_id, message.id)
+        self.assertEqual(
+            list(Channel.objects.order_by('-last_activity_at', '-id').values_list('id', flat=True)),
+            [channel.id, other_channel.id]
+        )
+
+        Upload.objects.create(file='uploads/upload.txt', user=self.developer, content_object=other_channel)
+        other_channel = Channel.objects.get(id=other_channel.id)
+        upload_activity_at = other_channel.target_actions.latest('timestamp').timestamp
+        self.assertEqual(other_channel.last_activity_at, upload_activity_at)
+        self.assertIsNone(other_channel.last_message_id)
+        self.assertEqual(
+            list(Channel.objects.order_by('-last_activity_at', '-id').values_list('id', flat=True)),
+            [other_channel.id, channel.id]
+        )
+
+        # The backfill agrees with the maintained columns and repairs cleared ones
+        self.assertEqual(backfill_channel_last_activity(Channel.objects.all()), [])
+        Channel.objects.update(last_activity_at=None, last_message=None)
+        self.assertEqual(len(backfill_channel_last_activity(Channel.objects.all())), 2)
+        self.assertEqual(Channel.objects.get(id=channel.id).last_message_id, message.id)
+        self.assertEqual(Channel.objects.get(id=other_channel.id).last_activity_at, upload_activity_at)
+
+
+class ChannelEventsTestCase(TransactionTestCase):
+
+    def setUp(self):
+        self.project_owner = get_user_model().objects.create_user(
+            'project_owner', 'po@example.com', 'secret', **{'type': USER_TYPE_PROJECT_OWNER})
+        self.developer = get_user_model().objects.create_user(
+            'developer', 'developer@example.com', 'secret', **{'type': USER_TYPE_DEVELOPER})
+
+    def test_user_events(self):
+        """
+        New messages and participants are pushed to the streams of the channel's participants
+        """
+        channel = create_channel(self.project_owner, participants=[self.developer], subject='Channel')
+
+        stream = stream_user_events(self.developer, timeout=5, heartbeat=1)
+        self.assertTrue(next(stream).startswith('retry:'))
+
+        # Events are only published once the message is committed
+        with transaction.atomic():
+            message = Message.objects.create(channel=channel, user=self.project_owner, body='Message')
+            self.assertEqual(next(stream), ': keep-alive\n\n')
+        event, data = next(stream).strip().split('\n')
+        self.assertEqual(event, 'event: %s' % EVENT_MESSAGE)
+        envelope = json.loads(data[len('data: '):])
+        self.assertEqual(envelope['channel'], channel.id)
+        self.assertEqual(envelope['message'], message.id)
+        self.assertEqual(envelope['activity'], message.activity_objects.get(verb=verbs.SEND).id)
+
+        other_developer = get_user_model().objects.create_user(
+            'other_developer', 'other_developer@example.com', 'secret', **{'type': USER_TYPE_DEVELOPER})
+        ChannelUser.objects.create(channel=channel, user=other_developer)
+        event, data = next(stream).strip().split('\n')
+        self.assertEqual(event, 'event: %s' % EVENT_PARTICIPANT)
+        self.assertEqual(json.loads(data[len('data: '):])['user'], other_developer.id)
+
+        # Idle streams send heartbeats
+        self.assertEqual(next(stream), ': keep-alive\n\n')
+        stream.close()
+
+
+class MessageBodyTestCase(TestCase):
+
+    def setUp(self):
+        self.project_owner = get_user_model().objects.create_user(
+            'project_owner', 'po@example.com', 'secret', **{'type': USER_TYPE_PROJECT_OWNER})
+
+    def test_rendered_body(self):
+        """
+        Message bodies are rendered when saved and the stored renderings are served until the body changes
+        """
+        channel = create_channel(self.project_owner, subject='Channel')
+        body = 'Hello <b>there</b>\nhttps://tunga.io/work/1/'
+        message = Message.objects.create(channel=channel, user=self.project_owner, body=body)
+
+        message = Message.objects.get(id=message.id)
+        self.assertTrue(message.is_body_rendered)
+        self.assertEqual(message.html_body, convert_to_html(body))
+        self.assertEqual(message.text_body, convert_to_text(body))
+        self.assertEqual(message.excerpt, 'Hello there\nhttps://tunga.io/work/1/')
+
+        # Reads use the stored rendering
+        Message.objects.filter(id=message.id).update(body_html='<p>Stored</p>')
+        self.assertEqual(Message.objects.get(id=message.id).html_body, '<p>Stored</p>')
+
+        # Renderings of another body are ignored until they're rendered again
+        Message.objects.filter(id=message.id).update(body='Edited\nhttps://tunga.io')
+        message = Message.objects.get(id=message.id)
+        self.assertFalse(message.is_body_rendered)
+        self.assertEqual(message.html_body, convert_to_html('Edited\nhttps://tunga.io'))
+
+        call_command('tunga_render_bodies')
+        message = Message.objects.get(id=message.id)
+        self.assertTrue(message.is_body_rendered)
+        self.assertEqual(message.body_html, convert_to_html('Edited\nhttps://tunga.io'))
+
+
+class ChannelHistoryTestCase(TestCase):
+
+    def setUp(self):
+        self.project_owner = get_user_model().objects.create_user(
+            'project_owner', 'po@example.com', 'secret', **{'type': USER_TYPE_PROJECT_OWNER})
+        self.developer = get_user_model().objects.create_user(
+            'developer', 'developer@example.com', 'secret', **{'type': USER_TYPE_DEVELOPER})
+
+    def test_import_and_export(self):
+        """
+        Slack history is bulk imported with its activity and exported in order with the other messages
+        """
+        channel = create_channel(self.project_owner, participants=[self.developer], subject='Channel')
+        slack_messages = [
+            {'type': 'message', 'user': 'U2', 'text': 'Second', 'ts': '1490000100.000200'},
+            {'type': 'message', 'user': 'U1', 'text': 'First', 'ts': '1490000000.000100'},
+            {'type': 'message', 'subtype': 'channel_join', 'user': 'U3', 'text': 'joined', 'ts': '1490000050.0001'}
+        ]
+        self.assertEqual(import_slack_history(channel, slack_messages, slack_users={'U1': 'Ann'}, batch_size=1), 2)
+        self.assertEqual(import_slack_history(channel, slack_messages), 0)
+
+        messages = list(Message.objects.filter(channel=channel).order_by('id'))
+        self.assertEqual([message.body for message in messages], ['First', 'Second'])
+        self.assertEqual(messages[0].created_at, datetime.datetime.utcfromtimestamp(1490000000.0001))
+        self.assertEqual(messages[0].sender.display_name, 'Ann from Tunga')
+        self.assertTrue(messages[0].is_body_rendered)
+        self.assertEqual(
+            sorted(channel.target_actions.filter(verb=verbs.SEND).values_list('action_object_object_id', flat=True)),
+            sorted([unicode(message.id) for message in messages])
+        )
+        self.assertEqual(ChannelUser.objects.get(channel=channel, user=self.developer).unread_count, 2)
+
+        Message.objects.create(channel=channel, user=self.developer, body='Third')
+        rows = [json.loads(line) for line in export_channel_messages(channel, chunk_size=2)]
+        self.assertEqual([row['body'] for row in rows], ['First', 'Second', 'Third'])
+        self.assertEqual(rows[2]['sender_id'], self.developer.id)
+
+        rows = list(csv.reader(''.join(export_channel_messages(
+            channel, export_format=EXPORT_FORMAT_CSV, chunk_size=2
+        )).splitlines()))
+        self.assertEqual(rows[0][0], 'id')
+        self.assertEqual([row[5] for row in rows[1:]], ['First', 'Second', 'Third'])
+
+
+class SlackRepliesTestCase(TestCase):
+
+    def setUp(self):
+        get_redis_connection('default').delete(
+            SLACK_REPLIES_QUEUE_KEY, SLACK_REPLIES_SCHEDULED_KEY, SLACK_REPLIES_METRICS_KEY,
+            SLACK_REPLIES_PROCESSING_KEY, SLACK_REPLIES_LOCK_KEY
+        )
+        self.project_owner = get_user_model().objects.create_user(
+            'project_owner', 'po@example.com', 'secret', **{'type': USER_TYPE_PROJECT_OWNER})
+
+    def test_slack_replies(self):
+        """
+        Slack replies are queued by the webhook and ingested in bulk once per Slack timestamp
+        """
+        channel = create_channel(self.project_owner, subject='Help', channel_type=CHANNEL_TYPE_SUPPORT)
+        other_channel = create_channel(self.project_owner, subject='Other help', channel_type=CHANNEL_TYPE_SUPPORT)
+
+        def reply(text, timestamp):
+            return slack_customer_notification(APIRequestFactory().post('/', {
+                'token': SLACK_CUSTOMER_OUTGOING_WEBHOOK_TOKEN, 'text': text, 'timestamp': timestamp,
+                'user_id': 'U1', 'user_name': 'agent', 'channel_id': 'C1', 'channel_name': 'support'
+            }))
+
+        reply('C%s First' % channel.id, '1490000000.000100')
+        reply('C%s First' % channel.id, '1490000000.000100')  # Retried by Slack
+        reply('*C%s* Second' % channel.id, '1490000100.000200')
+        reply('C%s Other' % other_channel.id, '1490000200.000300')
+        self.assertIn('Please try again', reply('C0 Nowhere', '1490000300.000400').data['text'])
+        self.assertIn('Please add a target', reply('Nowhere', '1490000400.000500').data['text'])
+
+        self.assertEqual(Message.objects.filter(source='slack').count(), 0)
+        self.assertEqual(get_slack_reply_metrics()['backlog'], 4)
+        self.assertEqual(get_slack_reply_metrics()['webhook_count'], 4)
+
+        self.assertEqual(ingest_slack_replies(batch_size=3), 3)
+        self.assertEqual(
+            list(Message.objects.filter(channel=channel).order_by('id').values_list('body', flat=True)),
+            ['First', 'Second']
+        )
+        message = Message.objects.filter(channel=channel).order_by('id').first()
+        self.assertEqual(message.created_at, datetime.datetime.utcfromtimestamp(1490000000.0001))
+        self.assertEqual(message.sender.display_name, 'Agent from Tunga')
+        self.assertEqual(channel.target_actions.filter(verb=verbs.SEND).count(), 2)
+        self.assertEqual(Channel.objects.get(id=other_channel.id).last_message_id, Message.objects.get(
+            channel=other_channel
+        ).id)
+
+        metrics = get_slack_reply_metrics()
+        self.assertEqual(metrics['backlog'], 0)
+        self.assertEqual(metrics['ingested_count'], 3)
+        self.assertEqual(metrics['duplicate_count'], 1)
+
+        # Already ingested replies are skipped
+        reply('C%s First' % channel.id, '1490000000.000100')
+        self.assertEqual(ingest_slack_replies(), 0)
+
+        # Replies stay in Redis until their messages are saved
+        reply('C%s Third' % channel.id, '1490000500.000600')
+        original_bulk_create_slack_messages = slack_replies.bulk_create_slack_messages
+
+        def fail_bulk_create(*args, **kwargs):
+            raise Exception('Database error')
+
+        slack_replies.bulk_create_slack_messages = fail_bulk_create
+        try:
+            self.assertRaises(Exception, ingest_slack_replies)
+        finally:
+            slack_replies.bulk_create_slack_messages = original_bulk_create_slack_messages
+        self.assertEqual(get_slack_reply_metrics()['backlog'], 1)
+        self.assertEqual(ingest_slack_replies(), 1)
+        self.assertEqual(Message.objects.filter(channel=channel, body='Third').count(), 1)
+        self.assertEqual(get_slack_reply_metrics()['backlog'], 0)
+
+
+class UnreadMessageEmailsTestCase(TestCase):
+
+    def setUp(self):
+        self.project_owner = get_user_model().objects.create_user(
+            'project_owner', 'po@example.com', 'secret', **{'type': USER_TYPE_PROJECT_OWNER})
+        self.developer = get_user_model().objects.create_user(
+            'developer', 'developer@example.com', 'secret', **{'type': USER_TYPE_DEVELOPER})
+
+    def claim_digests(self):
+        utc_now = datetime.datetime.utcnow()
+        min_last_email_date = utc_now - relativedelta(hours=3)
+        return claim_unread_message_email_digests(get_unread_message_email_digests(
+            utc_now - relativedelta(minutes=15), min_last_email_date, datetime.datetime(2016, 8, 8)
+        ), min_last_email_date)
+
+    def test_unread_message_emails(self):
+        """
+        Unread messages digests cover activity after each channel user's high-water mark and are only claimed once
+        """
+        channel = create_channel(self.project_owner, participants=[self.developer], subject='Channel')
+        direct_channel = get_or_create_direct_channel(self.project_owner, self.developer)
+        for idx in range(2):
+            Message.objects.create(channel=channel, user=self.developer, body='Message %s' % idx)
+        Message.objects.create(channel=direct_channel, user=self.developer, body='Hello')
+        Message.objects.create(channel=channel, user=self.project_owner, body='Reply')
+
+        # Activity is only emailed once it had time to be read
+        self.assertEqual(self.claim_digests(), [])
+        Action.objects.update(timestamp=datetime.datetime.utcnow() - relativedelta(minutes=20))
+
+        digests = dict([(digest['channel_user'], digest) for digest in self.claim_digests()])
+        self.assertEqual(len(digests), 3)
+        channel_user = ChannelUser.objects.get(channel=channel, user=self.project_owner)
+        self.assertEqual(digests[channel_user.id]['new_messages'], 2)
+        self.assertEqual(digests[channel_user.id]['last_action'], channel.target_actions.filter(
+            verb=verbs.SEND, actor_object_id=self.developer.id
+        ).latest('id').id)
+        self.assertEqual(
+            digests[ChannelUser.objects.get(channel=direct_channel, user=self.project_owner).id]['new_messages'], 1
+        )
+        self.assertEqual(digests[ChannelUser.objects.get(channel=channel, user=self.developer).id]['new_messages'], 1)
+
+        # Claimed digests aren't picked by a re-run, delivered ones aren't picked even once the throttle has passed
+        self.assertEqual(self.claim_digests(), [])
+        record_unread_message_emails([digests[channel_user.id]])
+        self.assertIsNotNone(ChannelUser.objects.get(id=channel_user.id).last_email_at)
+        undelivered_ids = sorted([key for key in digests.keys() if key != channel_user.id])
+
+        # Digests whose job crashed are picked again once their claims expire
+        ChannelUser.objects.update(
+            last_email_at=datetime.datetime.utcnow() - relativedelta(hours=4),
+            email_claimed_at=datetime.datetime.utcnow() - relativedelta(seconds=UNREAD_MESSAGES_EMAIL_CLAIM_TIMEOUT + 1)
+        )
+        claimed_digests = self.claim_digests()
+        self.assertEqual(sorted([digest['channel_user'] for digest in claimed_digests]), undelivered_ids)
+
+        # Failed deliveries release their claims right away
+        class FailingConnection(object):
+
+            def open(self):
+                pass
+
+            def close(self):
+                pass
+
+            def send_messages(self, messages):
+                return 0
+
+        original_functions = (notifications.get_connection, notifications.render_unread_messages_email)
+        notifications.get_connection = FailingConnection
+        notifications.render_unread_messages_email = lambda channel_user, new_messages: None
+        try:
+            self.assertEqual(send_unread_message_emails(claimed_digests), 0)
+        finally:
+            notifications.get_connection, notifications.render_unread_messages_email = original_functions
+        self.assertEqual(sorted([digest['channel_user'] for digest in self.claim_digests()]), undelivered_ids)
@@ -1,23 +1,27 @@
-from django.db.models import Q, Case, When, IntegerField, F
-from django.db.models.aggregates import Sum, Max
+from collections import defaultdict
+
+from actstream.models import Action
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q, Case, When, IntegerField, F, Value
+from django.db.models.aggregates import Max
 from django.db.models.fields import DateTimeField
+from django.db.models.functions import Greatest
 
 from tunga_activity import verbs
+from tunga_messages.models import Channel, ChannelUser, Message
+from tunga_profiles.notification_summary import invalidate_notifications, NOTIFICATION_CHANNELS
+from tunga_utils.models import Upload
 
+CHANNEL_UNREAD_VERBS = [verbs.SEND, verbs.UPLOAD]
 
-def all_messages_q_filter(user):
-    return Q(user=user) | Q(channel__channeluser__user=user)
 
+def user_channel_ids(user):
+    # Filtering on this subquery instead of joining channel users doesn't repeat rows, so no DISTINCT is needed
+    return ChannelUser.objects.filter(user=user).values('channel_id')
 
-def channel_last_read_annotation(user):
-    return Case(
-        When(
-            channeluser__user=user,
-            then='channeluser__last_read'
-        ),
-        default=0,
-        output_field=IntegerField()
-    )
+
+def all_messages_q_filter(user):
+    return Q(user=user) | Q(channel_id__in=user_channel_ids(user))
 
 
 def channel_activity_last_read_annotation(user):
@@ -31,65 +35,179 @@ def channel_activity_last_read_annotation(user):
     )
 
 
-def channel_new_messages_annotation(user):
+def channel_activity_new_messages_filter(queryset, user):
     """
-    Queryset needs to annotated with channel_last_read for this to work
-    :param user:
-    :return:
+    Unread channel activity computed from the user's last read activity.
+    Only used by the tests as the reference for the unread counters (see increment_channel_unread_counts)
     """
-    return Sum(
-        Case(
-            When(
-                ~Q(action_targets__actor_object_id=user.id) &
-                Q(action_targets__gt=F('channel_last_read')) &
-                Q(action_targets__verb__in=[verbs.SEND, verbs.UPLOAD]),
-                then=1
-            ),
-            default=0,
-            output_field=IntegerField()
-        )
+    return queryset.filter(
+        ~Q(actor_object_id=user.id) &
+        Q(verb__in=[verbs.SEND, verbs.UPLOAD])
+    ).annotate(
+        channel_last_read=channel_activity_last_read_annotation(user)
+    ).filter(
+        id__gt=F('channel_last_read')
     )
 
 
-def annotate_channel_queryset_with_new_messages(queryset, user):
-    return queryset.annotate(
-        channel_last_read=channel_last_read_annotation(user)
-    ).annotate(
-        new_messages=channel_new_messages_annotation(user)
+def is_channel_unread_activity(action):
+    return action.verb in CHANNEL_UNREAD_VERBS and \
+           action.target_content_type_id == ContentType.objects.get_for_model(Channel).id
+
+
+def increment_channel_unread_counts(action):
+    """
+    Counts a new message or upload for every participant of the channel except the sender in a single update
+    """
+    ChannelUser.objects.filter(channel_id=action.target_object_id).update(
+        unread_count=Case(
+            When(user_id=action.actor_object_id, then=F('unread_count')),
+            default=F('unread_count') + 1,
+            output_field=IntegerField()
+        ),
+        last_message=Greatest('last_message', Value(action.id))
+    )
+    invalidate_notifications(
+        ChannelUser.objects.filter(channel_id=action.target_object_id).values_list('user_id', flat=True),
+        NOTIFICATION_CHANNELS
     )
 
 
-def annotate_channel_queryset_with_latest_activity_at(queryset, user):
-    return queryset.annotate(
-        latest_activity_timestamp=Max('action_targets__timestamp'),
-    ).annotate(
-        latest_activity_at=Case(
-            When(
-                latest_activity_timestamp__isnull=True,
-                then='created_at'
-            ),
+def reconcile_channel_unread_counts(channel_users, fix=True):
+    """
+    Recounts unread activity for the channel users from the activity table
+    and returns the ones whose counters had drifted (after repairing them if fix is set)
+    """
+    channel_users = list(channel_users)
+    channel_actions = defaultdict(list)
+    for channel_id, action_id, actor_id in Action.objects.filter(
+        target_content_type=ContentType.objects.get_for_model(Channel),
+        target_object_id__in=set([str(channel_user.channel_id) for channel_user in channel_users]),
+        verb__in=CHANNEL_UNREAD_VERBS
+    ).values_list('target_object_id', 'id', 'actor_object_id'):
+        channel_actions[int(channel_id)].append((action_id, actor_id))
+
+    drifted_channel_users = []
+    for channel_user in channel_users:
+        actions = channel_actions[channel_user.channel_id]
+        unread_count = len([
+            action_id for action_id, actor_id in actions
+            if action_id > channel_user.last_read and actor_id != str(channel_user.user_id)
+        ])
+        last_message = max([action_id for action_id, actor_id in actions] or [0])
+        if unread_count != channel_user.unread_count or last_message != channel_user.last_message:
+            channel_user.unread_count = unread_count
+            channel_user.last_message = last_message
+            drifted_channel_users.append(channel_user)
+            if fix:
+                ChannelUser.objects.filter(id=channel_user.id).update(
+                    unread_count=unread_count, last_message=last_message
+                )
+    if fix:
+        invalidate_notifications(
+            [channel_user.user_id for channel_user in drifted_channel_users], NOTIFICATION_CHANNELS
+        )
+    return drifted_channel_users
+
+
+def update_channel_last_activity(action):
+    """
+    Moves the channel's last activity (and last message for messages) forward to the new activity
+    without reading the activity table, so the inbox can be ordered by an indexed column
+    """
+    values = dict(
+        last_activity_at=Case(
             When(
-                latest_activity_timestamp__gt=F('created_at'),
-                then='latest_activity_timestamp'
+                Q(last_activity_at__isnull=True) | Q(last_activity_at__lt=action.timestamp),
+                then=Value(action.timestamp)
             ),
-            default='created_at',
+            default=F('last_activity_at'),
             output_field=DateTimeField()
         )
     )
+    if action.verb == verbs.SEND and \
+            action.action_object_content_type_id == ContentType.objects.get_for_model(Message).id:
+        message_id = int(action.action_object_object_id)
+        values['last_message'] = Case(
+            When(
+                Q(last_message__isnull=True) | Q(last_message__lt=message_id),
+                then=Value(message_id)
+            ),
+            default=F('last_message'),
+            output_field=IntegerField()
+        )
+    Channel.objects.filter(id=action.target_object_id).update(**values)
 
 
-def channel_new_messages_filter(queryset, user):
-    return annotate_channel_queryset_with_new_messages(
-        queryset, user
-    ).filter(new_messages__gt=0)
+def backfill_channel_last_activity(channels):
+    """
+    Recomputes the last activity and last message of the channels from the activity and message tables
+    and returns the ones that changed
+    """
+    channels = list(channels)
+    channel_ids = [channel.id for channel in channels]
+    latest_activity = dict(
+        (int(channel_id), timestamp) for channel_id, timestamp in Action.objects.filter(
+            target_content_type=ContentType.objects.get_for_model(Channel),
+            target_object_id__in=[str(channel_id) for channel_id in channel_ids]
+        ).order_by().values_list('target_object_id').annotate(latest_timestamp=Max('timestamp'))
+    )
+    latest_messages = dict(
+        Message.objects.filter(channel_id__in=channel_ids).order_by().values_list('channel_id').annotate(
+            latest_id=Max('id')
+        )
+    )
+
+    updated_channels = []
+    for channel in channels:
+        last_activity_at = max(
+            [timestamp for timestamp in [channel.created_at, latest_activity.get(channel.id, None)] if timestamp]
+        )
+        last_message_id = latest_messages.get(channel.id, None)
+        if last_activity_at != channel.last_activity_at or last_message_id != channel.last_message_id:
+            Channel.objects.filter(id=channel.id).update(
+                last_activity_at=last_activity_at, last_message=last_message_id
+            )
+            channel.last_activity_at = last_activity_at
+            channel.last_message_id = last_message_id
+            updated_channels.append(channel)
+    return updated_channels
+
+
+def update_channel_last_read(channel, user, last_read):
+    """
+    Saves the user's last read activity for the channel and resets the unread counter
+    """
+    channel_user, created = ChannelUser.objects.update_or_create(
+        user=user, channel=channel, defaults={'last_read': last_read}
+    )
+    # Everything is read unless newer activity arrived in the meantime, recount only in that case
+    if not ChannelUser.objects.filter(id=channel_user.id, last_message__lte=last_read).update(unread_count=0):
+        reconcile_channel_unread_counts([ChannelUser.objects.get(id=channel_user.id)])
+    invalidate_notifications([user], NOTIFICATION_CHANNELS)
+    return channel_user
 
 
-def channel_activity_new_messages_filter(queryset, user):
-    return queryset.filter(
-        ~Q(actor_object_id=user.id) &
-        Q(verb__in=[verbs.SEND, verbs.UPLOAD])
+def prefetch_channel_attachments(channels):
+    """
+    Memoizes Channel.all_attachments for a batch of channels with one query
+    """
+    channel_ids = set([channel.id for channel in channels])
+    if not channel_ids:
+        return channels
+
+    channel_content_type = ContentType.objects.get_for_model(Channel)
+    attachments = defaultdict(list)
+    for upload in Upload.objects.filter(
+        Q(channels__in=channel_ids) | Q(messages__channel__in=channel_ids)
     ).annotate(
-        channel_last_read=channel_activity_last_read_annotation(user)
-    ).filter(
-        id__gt=F('channel_last_read')
-    )
+        message_channel_id=F('messages__channel')
+    ).select_related('user__userprofile').prefetch_related('user__socialaccount_set'):
+        if upload.content_type_id == channel_content_type.id:
+            attachments[upload.object_id].append(upload)
+        else:
+            attachments[upload.message_channel_id].append(upload)
+
+    for channel in channels:
+        channel.prefetched_attachments = attachments[channel.id]
+    return channels
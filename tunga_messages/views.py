@@ -1,32 +1,40 @@
-import json
 import re
+import time
 
-import datetime
+from django import db
+from django.http.response import StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from dry_rest_permissions.generics import DRYObjectPermissions, DRYPermissions
 from rest_framework import viewsets, status
 from rest_framework.decorators import detail_route, list_route, api_view, permission_classes
 from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
+from tunga_activity import verbs
 from tunga_activity.filters import ActionFilter, MessageActivityFilter
 from tunga_activity.serializers import SimpleActivitySerializer, LastReadActivitySerializer
+from tunga_activity.utils import prefetch_activity_objects
+from tunga_messages.events import stream_user_events
 from tunga_messages.filterbackends import MessageFilterBackend, ChannelFilterBackend
 from tunga_messages.filters import MessageFilter, ChannelFilter
-from tunga_messages.models import Message, Channel, ChannelUser
+from tunga_messages.history import export_channel_messages, EXPORT_CONTENT_TYPES, EXPORT_FORMAT_NDJSON
+from tunga_messages.models import Message, Channel
 from tunga_messages.serializers import MessageSerializer, ChannelSerializer, DirectChannelSerializer, \
     SupportChannelSerializer, DeveloperChannelSerializer
+from tunga_messages.slack_replies import queue_slack_reply, record_slack_reply_latency
 from tunga_messages.tasks import get_or_create_direct_channel, get_or_create_support_channel, create_channel, \
-    get_or_create_task_channel
-from tunga_messages.utils import annotate_channel_queryset_with_latest_activity_at
+    get_or_create_task_channel, ingest_slack_customer_replies
+from tunga_messages.utils import update_channel_last_read
 from tunga_profiles.models import Inquirer
 from tunga_tasks.models import Task
 from tunga_utils import slack_utils
-from tunga_utils.constants import CHANNEL_TYPE_SUPPORT, APP_INTEGRATION_PROVIDER_SLACK, CHANNEL_TYPE_DEVELOPER
+from tunga_utils.constants import CHANNEL_TYPE_SUPPORT, CHANNEL_TYPE_DEVELOPER
 from tunga_utils.filterbackends import DEFAULT_FILTER_BACKENDS
 from tunga_utils.mixins import SaveUploadsMixin
-from tunga_utils.pagination import LargeResultsSetPagination, DefaultPagination
+from tunga_utils.pagination import LargeResultsSetPagination, OptionalKeysetPagination
+from tunga_utils.renderers import EventStreamRenderer
 
 
 class ChannelViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
@@ -45,9 +53,8 @@ class ChannelViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
     )
 
     def get_queryset(self):
-        return annotate_channel_queryset_with_latest_activity_at(
-            self.queryset, self.request.user
-        ).distinct().order_by('-latest_activity_at')
+        # last_activity_at is kept up to date by the channel activity signal, so this is an index ordered scan
+        return self.queryset.order_by('-last_activity_at', '-id')
 
     @list_route(
         methods=['post'], url_path='direct',
@@ -158,6 +165,25 @@ class ChannelViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
         response_serializer = ChannelSerializer(channel, context={'request': request})
         return Response(response_serializer.data)
 
+    @list_route(
+        methods=['get'], url_path='events',
+        permission_classes=[IsAuthenticated], renderer_classes=[EventStreamRenderer, JSONRenderer]
+    )
+    def events(self, request):
+        """
+        Streams new messages and participants in the user's channels as Server-Sent Events
+        ---
+        omit_serializer: true
+        """
+        # Streams don't query the database, so the connection isn't held for the life of the stream
+        if not db.connection.in_atomic_block:
+            db.connection.close()
+        response = StreamingHttpResponse(stream_user_events(request.user), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
     @detail_route(
         methods=['post'], url_path='read',
         permission_classes=[AllowAny], serializer_class=LastReadActivitySerializer
@@ -175,9 +201,7 @@ class ChannelViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
         channel = get_object_or_404(self.get_queryset(), pk=pk)
         if channel.has_object_read_permission(request):
             if request.user.is_authenticated():
-                ChannelUser.objects.update_or_create(
-                    user=request.user, channel=channel, defaults={'last_read': last_read}
-                )
+                update_channel_last_read(channel, request.user, last_read)
             else:
                 channel.last_read = last_read
                 channel.save()
@@ -188,6 +212,29 @@ class ChannelViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
                 status=status.HTTP_401_UNAUTHORIZED
             )
 
+    @detail_route(
+        methods=['get'], url_path='export',
+        permission_classes=[IsAdminUser]
+    )
+    def export(self, request, pk=None):
+        """
+        Streams the channel's full message history as NDJSON (default) or CSV (?export_format=csv)
+        ---
+        omit_serializer: true
+        """
+        channel = get_object_or_404(self.get_queryset(), pk=pk)
+        export_format = request.query_params.get('export_format', EXPORT_FORMAT_NDJSON)
+        if export_format not in EXPORT_CONTENT_TYPES:
+            return Response(
+                {'status': 'Bad request', 'message': 'Unknown export format'}, status=status.HTTP_400_BAD_REQUEST
+            )
+        response = StreamingHttpResponse(
+            export_channel_messages(channel, export_format=export_format),
+            content_type=EXPORT_CONTENT_TYPES[export_format]
+        )
+        response['Content-Disposition'] = 'attachment; filename=tunga_channel_%s.%s' % (channel.id, export_format)
+        return response
+
     @detail_route(
         methods=['get'], url_path='activity',
         permission_classes=[AllowAny],
@@ -195,7 +242,7 @@ class ChannelViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
         filter_class=None,
         filter_backends=DEFAULT_FILTER_BACKENDS,
         search_fields=('messages__body', 'uploads__file', 'messages__attachments__file'),
-        pagination_class=DefaultPagination
+        pagination_class=OptionalKeysetPagination
     )
     def activity(self, request, pk=None):
         """
@@ -219,6 +266,7 @@ class ChannelViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
         )
         page = self.paginate_queryset(queryset.qs)
         if page is not None:
+            prefetch_activity_objects(page, fields=['action_object'])
             serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
 
@@ -236,6 +284,8 @@ class MessageViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
     filter_class = MessageFilter
     filter_backends = DEFAULT_FILTER_BACKENDS + (MessageFilterBackend,)
     search_fields = ('user__username', 'body',)
+    pagination_class = OptionalKeysetPagination
+    keyset_ordering = ('-created_at', '-id')
 
     @detail_route(
         methods=['post'], url_path='read',
@@ -250,9 +300,9 @@ class MessageViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
         message = get_object_or_404(self.get_queryset(), pk=pk)
 
         if message.has_object_read_permission(request):
-            ChannelUser.objects.update_or_create(
-                user=request.user, channel=message.channel, defaults={'last_read': message.id}
-            )
+            # last_read holds activity ids, so use the id of the message's send activity
+            last_read = message.activity_objects.filter(verb=verbs.SEND).values_list('id', flat=True).first()
+            update_channel_last_read(message.channel, request.user, last_read or message.id)
             response_serializer = ChannelSerializer(message.channel)
             return Response(response_serializer.data)
         return Response(
@@ -265,6 +315,7 @@ class MessageViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
 @api_view(http_method_names=['POST'])
 @permission_classes([AllowAny])
 def slack_customer_notification(request):
+    started_at = time.time()
     payload = request.data
 
     # Verify that the request came from Slack
@@ -273,38 +324,18 @@ def slack_customer_notification(request):
 
     response = None
     if payload and not payload.get(slack_utils.KEY_BOT_ID, None):
-        text = payload.get(slack_utils.KEY_TEXT, None)
+        text = payload.get(slack_utils.KEY_TEXT, None) or ''
         m = re.match(r'^[\*`_~]{0,3}C(?P<id>\d+)[\*`_~]{0,3}(?P<message>.*)', text, flags=re.DOTALL | re.IGNORECASE)
         if m:
             matches = m.groupdict()
             message = matches.get('message', '').strip()
-            channel_id = matches.get('id', '')
-            try:
-                slack_user = dict(
-                    id=payload.get(slack_utils.KEY_USER_ID, None),
-                    name=payload.get(slack_utils.KEY_USER_NAME, None),
-                    provider=APP_INTEGRATION_PROVIDER_SLACK
-                )
-                msg_extras = dict(
-                    channel=dict(
-                        id=payload.get(slack_utils.KEY_CHANNEL_ID),
-                        name=payload.get(slack_utils.KEY_CHANNEL_NAME)
-                    ),
-                    team=dict(
-                        id=payload.get(slack_utils.KEY_TEAM_ID),
-                        domain=payload.get(slack_utils.KEY_TEAM_DOMAIN)
-                    ),
-                    timestamp=payload.get(slack_utils.KEY_TS, None)
-                )
-                Message.objects.create(
-                    channel_id=channel_id,
-                    body=message,
-                    alt_user=json.dumps(slack_user),
-                    created_at=datetime.datetime.fromtimestamp(payload.get(slack_utils.KEY_TS, 0)),
-                    source=APP_INTEGRATION_PROVIDER_SLACK,
-                    extra=json.dumps(msg_extras)
-                )
-            except:
+            channel_id = int(matches.get('id', ''))
+            if message and Channel.objects.filter(id=channel_id).exists():
+                # Messages are created by a job so Slack doesn't wait on them, bursts are coalesced by that job
+                if queue_slack_reply(channel_id, message, getattr(payload, 'dict', lambda: payload)()):
+                    ingest_slack_customer_replies.delay()
+                record_slack_reply_latency(started_at)
+            else:
                 response = 'Failed to send message\n' \
                            '> %s\n' \
                            'Please try again' % message
@@ -0,0 +1,102 @@
+import random
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+
+from tunga_profiles.models import Connection
+
+CONNECTION_GRAPH_CACHE_KEY = 'tunga:connections:%s'
+CONNECTION_GRAPH_STATS_KEY = 'tunga:connections:stats:%s'
+CONNECTION_GRAPH_CACHE_TIMEOUT = 24 * 60 * 60
+# Hits and misses are counted for 1 in this many lookups so the stats stay off the hot path
+CONNECTION_GRAPH_STATS_SAMPLE_RATE = 100
+
+
+def get_connected_user_ids(user_id):
+    """
+    Loads the ids of users with an accepted connection to the user from the database
+    """
+    connected_user_ids = set(
+        Connection.objects.filter(from_user=user_id, accepted=True).values_list('to_user_id', flat=True)
+    )
+    connected_user_ids.update(
+        Connection.objects.filter(to_user=user_id, accepted=True).values_list('from_user_id', flat=True)
+    )
+    return connected_user_ids
+
+
+def _get_user_id(user):
+    return getattr(user, 'id', user)
+
+
+def _record_stat(name):
+    sample_rate = CONNECTION_GRAPH_STATS_SAMPLE_RATE
+    if sample_rate > 1 and random.randrange(sample_rate):
+        return
+    key = CONNECTION_GRAPH_STATS_KEY % name
+    try:
+        cache.incr(key, sample_rate)
+    except ValueError:
+        cache.set(key, sample_rate, timeout=None)
+
+
+def connected_user_ids(user):
+    """
+    Cached version of get_connected_user_ids, it accepts either a user or a user id
+    """
+    user_id = _get_user_id(user)
+    if not user_id:
+        return set()
+
+    key = CONNECTION_GRAPH_CACHE_KEY % user_id
+    user_ids = cache.get(key)
+    if user_ids is not None:
+        _record_stat('hits')
+        return set(user_ids)
+
+    _record_stat('misses')
+    user_ids = get_connected_user_ids(user_id)
+    cache.set(key, list(user_ids), timeout=CONNECTION_GRAPH_CACHE_TIMEOUT)
+    return user_ids
+
+
+def _delete_connected_user_ids(keys):
+    cache.delete_many(keys)
+
+
+def invalidate_connected_user_ids(*users):
+    keys = [CONNECTION_GRAPH_CACHE_KEY % _get_user_id(user) for user in users]
+    _delete_connected_user_ids(keys)
+    # Other processes could re-cache uncommitted connections in between, so invalidate again after the commit
+    transaction.on_commit(lambda: _delete_connected_user_ids(keys))
+
+
+def warm_connected_user_ids(user_ids):
+    """
+    Caches the connection sets of all the given users with a single query and returns the number of users cached
+    """
+    user_ids = set(user_ids)
+    connections = defaultdict(set)
+    for from_user_id, to_user_id in Connection.objects.filter(accepted=True).values_list('from_user_id', 'to_user_id'):
+        if from_user_id in user_ids:
+            connections[from_user_id].add(to_user_id)
+        if to_user_id in user_ids:
+            connections[to_user_id].add(from_user_id)
+
+    cache.set_many(
+        dict([(CONNECTION_GRAPH_CACHE_KEY % user_id, list(connections[user_id])) for user_id in user_ids]),
+        timeout=CONNECTION_GRAPH_CACHE_TIMEOUT
+    )
+    return len(user_ids)
+
+
+def get_connection_graph_stats():
+    """
+    Estimated hits and misses, only 1 in CONNECTION_GRAPH_STATS_SAMPLE_RATE lookups is counted
+    """
+    return dict([(name, cache.get(CONNECTION_GRAPH_STATS_KEY % name) or 0) for name in ['hits', 'misses']])
+
+
+def reset_connection_graph_stats():
+    cache.delete_many([CONNECTION_GRAPH_STATS_KEY % name for name in ['hits', 'misses']])
@@ -0,0 +1,19 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from tunga_profiles.connections import warm_connected_user_ids, get_connection_graph_stats
+
+
+class Command(BaseCommand):
+
+    def handle(self, *args, **options):
+        """
+        Caches the accepted connections of all active users.
+        """
+        # command to run: python manage.py tunga_warm_connection_graph
+
+        user_ids = get_user_model().objects.filter(is_active=True).values_list('id', flat=True)
+        total = warm_connected_user_ids(user_ids)
+
+        stats = get_connection_graph_stats()
+        print "%s connection sets cached (%s hits, %s misses so far)" % (total, stats['hits'], stats['misses'])
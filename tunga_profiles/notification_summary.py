@@ -0,0 +1,206 @@
+import hashlib
+import json
+import uuid
+
+from django.core.cache import cache
+from django.db.models.query_utils import Q
+
+from tunga_messages.models import ChannelUser
+from tunga_tasks.models import Task
+from tunga_utils.constants import USER_TYPE_PROJECT_OWNER, CHANNEL_TYPE_SUPPORT, CHANNEL_TYPE_DIRECT, \
+    CHANNEL_TYPE_TOPIC, CHANNEL_TYPE_DEVELOPER, TASK_SCOPE_ONGOING, TASK_SCOPE_PROJECT, TASK_SOURCE_NEW_USER, \
+    STATUS_ACCEPTED
+
+NOTIFICATION_SUMMARY_CACHE_KEY = 'tunga:notifications:%s'
+NOTIFICATION_COMPONENT_CACHE_KEY = 'tunga:notifications:%s:%s'
+NOTIFICATION_PM_TASKS_CACHE_KEY = 'tunga:notifications:pm_tasks'
+# Invalidation keeps entries fresh, the timeout only bounds changes that no signal reports (e.g. social avatars)
+NOTIFICATION_CACHE_TIMEOUT = 60 * 60
+
+NOTIFICATION_CHANNELS = 'channels'
+NOTIFICATION_REQUESTS = 'requests'
+NOTIFICATION_TASKS = 'tasks'
+NOTIFICATION_PROFILE = 'profile'
+
+CHANNEL_TYPE_MAP = {
+    CHANNEL_TYPE_DIRECT: 'direct',
+    CHANNEL_TYPE_TOPIC: 'topic',
+    CHANNEL_TYPE_SUPPORT: 'support',
+    CHANNEL_TYPE_DEVELOPER: 'developer'
+}
+
+
+def get_channel_notifications(user):
+    channel_updates = [
+        dict(
+            id=channel_user.channel_id, type=channel_user.channel.type, new=channel_user.unread_count,
+            last_read=channel_user.last_read
+        ) for channel_user in ChannelUser.objects.filter(
+            user=user, unread_count__gt=0
+        ).select_related('channel').order_by('-channel__created_at')
+    ]
+
+    channel_type_summary_updates = dict()
+    for channel_type_name in CHANNEL_TYPE_MAP.itervalues():
+        channel_type_summary_updates[channel_type_name] = 0
+
+    for channel in channel_updates:
+        channel_type_summary_updates[CHANNEL_TYPE_MAP.get(channel['type'], '')] += channel['new']
+    return {'channels': channel_updates, 'channel_summary': channel_type_summary_updates}
+
+
+def get_request_notifications(user):
+    return user.connection_requests.filter(responded=False, from_user__pending=False).count()
+
+
+def get_task_notifications(user):
+    return user.tasks_created.filter(closed=False).count() + user.participation_set.filter(
+        (Q(accepted=True) | Q(responded=False)), task__closed=False, user=user
+    ).count() + user.tasks_managed.filter(closed=False).count()
+
+
+def get_profile_notifications(user):
+    profile = None
+    profile_notifications = {'count': 0, 'missing': [], 'improve': [], 'more': [], 'section': None}
+    try:
+        profile = user.userprofile
+    except:
+        profile_notifications['missing'] = ['skills', 'bio', 'country', 'city', 'street', 'plot_number',
+                                            'phone_number']
+
+    if not user.avatar_url:
+        profile_notifications['missing'].append('image')
+
+    if profile:
+        skills = profile.skills.count()
+        if skills == 0:
+            profile_notifications['missing'].append('skills')
+        elif skills < 3:
+            profile_notifications['more'].append('skills')
+
+        if not profile.bio:
+            profile_notifications['missing'].append('bio')
+
+        if not profile.country:
+            profile_notifications['missing'].append('country')
+        if not profile.city:
+            profile_notifications['missing'].append('city')
+        if not profile.street:
+            profile_notifications['missing'].append('street')
+        if not profile.plot_number:
+            profile_notifications['missing'].append('plot_number')
+        if not profile.phone_number:
+            profile_notifications['missing'].append('phone_number')
+
+        if user.type == USER_TYPE_PROJECT_OWNER and not profile.company:
+            profile_notifications['missing'].append('company')
+
+    profile_notifications['count'] = len(profile_notifications['missing']) + len(profile_notifications['more']) \
+                                     + len(profile_notifications['improve'])
+    return profile_notifications
+
+
+NOTIFICATION_COMPONENTS = (
+    (NOTIFICATION_CHANNELS, get_channel_notifications),
+    (NOTIFICATION_REQUESTS, get_request_notifications),
+    (NOTIFICATION_TASKS, get_task_notifications),
+    (NOTIFICATION_PROFILE, get_profile_notifications)
+)
+
+
+def get_pm_task_notifications():
+    """
+    Tasks waiting on estimates and quotes, these counts are the same for every user so they share one entry
+    """
+    pm_tasks = cache.get(NOTIFICATION_PM_TASKS_CACHE_KEY)
+    if pm_tasks is None:
+        tasks = Task.objects.filter(
+            Q(scope=TASK_SCOPE_ONGOING) |
+            (
+                Q(scope=TASK_SCOPE_PROJECT) & (
+                    Q(pm_required=True) | Q(source=TASK_SOURCE_NEW_USER)
+                )
+            )
+        )
+        pm_tasks = {
+            'estimates': tasks.exclude(estimate__status=STATUS_ACCEPTED).distinct().count(),
+            'quotes': tasks.filter(
+                estimate__status=STATUS_ACCEPTED
+            ).exclude(quote__status=STATUS_ACCEPTED).distinct().count(),
+            'version': uuid.uuid4().hex
+        }
+        cache.set(NOTIFICATION_PM_TASKS_CACHE_KEY, pm_tasks, timeout=NOTIFICATION_CACHE_TIMEOUT)
+    return pm_tasks
+
+
+def _get_user_id(user):
+    return getattr(user, 'id', user)
+
+
+def get_notification_summary(user):
+    """
+    Returns the notification summary and its etag.
+    The assembled summary is cached so an unchanged poll costs a single cache round trip,
+    otherwise only the invalidated components are recomputed.
+    """
+    summary_key = NOTIFICATION_SUMMARY_CACHE_KEY % user.id
+    cached = cache.get_many([summary_key, NOTIFICATION_PM_TASKS_CACHE_KEY])
+    summary = cached.get(summary_key, None)
+    pm_tasks = cached.get(NOTIFICATION_PM_TASKS_CACHE_KEY, None)
+    if summary and pm_tasks and summary['pm_tasks_version'] == pm_tasks['version']:
+        return summary['data'], summary['etag']
+
+    component_keys = dict([
+        (name, NOTIFICATION_COMPONENT_CACHE_KEY % (user.id, name)) for name, loader in NOTIFICATION_COMPONENTS
+    ])
+    cached_components = cache.get_many(component_keys.values())
+    components = dict()
+    missing_components = dict()
+    for name, loader in NOTIFICATION_COMPONENTS:
+        key = component_keys[name]
+        if key in cached_components:
+            components[name] = cached_components[key]
+        else:
+            components[name] = missing_components[key] = loader(user)
+    if missing_components:
+        cache.set_many(missing_components, timeout=NOTIFICATION_CACHE_TIMEOUT)
+
+    if not pm_tasks:
+        pm_tasks = get_pm_task_notifications()
+
+    channel_summary = components[NOTIFICATION_CHANNELS]['channel_summary']
+    data = {
+        'messages': channel_summary['direct'] + channel_summary['topic'] + channel_summary['developer'],
+        'requests': components[NOTIFICATION_REQUESTS],
+        'tasks': components[NOTIFICATION_TASKS],
+        'estimates': pm_tasks['estimates'],
+        'quotes': pm_tasks['quotes'],
+        'profile': components[NOTIFICATION_PROFILE],
+        'channels': components[NOTIFICATION_CHANNELS]['channels'],
+        'channel_summary': channel_summary
+    }
+    etag = hashlib.md5(json.dumps(data, sort_keys=True)).hexdigest()
+    cache.set(
+        summary_key, {'data': data, 'etag': etag, 'pm_tasks_version': pm_tasks['version']},
+        timeout=NOTIFICATION_CACHE_TIMEOUT
+    )
+    return data, etag
+
+
+def invalidate_notifications(users, *components):
+    """
+    Drops the given components (all if none are given) for the users along with their assembled summaries
+    """
+    keys = []
+    for user_id in set([_get_user_id(user) for user in users if user]):
+        keys.append(NOTIFICATION_SUMMARY_CACHE_KEY % user_id)
+        for name, loader in NOTIFICATION_COMPONENTS:
+            if not components or name in components:
+                keys.append(NOTIFICATION_COMPONENT_CACHE_KEY % (user_id, name))
+    if keys:
+        cache.delete_many(keys)
+
+
+def invalidate_pm_task_notifications():
+    # Summaries remember the version of the counts they were built with, so they are rebuilt on the next poll
+    cache.delete(NOTIFICATION_PM_TASKS_CACHE_KEY)
@@ -1,11 +1,15 @@
 from actstream.signals import action
-from django.db.models.signals import post_save
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch.dispatcher import receiver
 
 from tunga_activity import verbs
+from tunga_profiles.connections import invalidate_connected_user_ids
 from tunga_profiles.notifications import send_new_developer_email, send_developer_accepted_email, \
     send_developer_application_received_email, send_new_skill_email, send_developer_invited_email
-from tunga_profiles.models import Connection, DeveloperApplication, Skill, DeveloperInvitation
+from tunga_profiles.models import Connection, DeveloperApplication, Skill, DeveloperInvitation, UserProfile
+from tunga_profiles.notification_summary import invalidate_notifications, NOTIFICATION_REQUESTS, \
+    NOTIFICATION_PROFILE
 from tunga_utils.constants import REQUEST_STATUS_ACCEPTED
 
 
@@ -23,6 +27,43 @@ def activity_handler_new_connection(sender, instance, created, **kwargs):
                 action.send(instance.to_user, verb=verbs.REJECT, action_object=instance)
 
 
+@receiver(post_save, sender=Connection)
+@receiver(post_delete, sender=Connection)
+def activity_handler_connection_graph(sender, instance, **kwargs):
+    invalidate_connected_user_ids(instance.from_user_id, instance.to_user_id)
+
+
+@receiver(post_save, sender=Connection)
+@receiver(post_delete, sender=Connection)
+def activity_handler_connection_notifications(sender, instance, **kwargs):
+    invalidate_notifications([instance.to_user_id], NOTIFICATION_REQUESTS)
+
+
+@receiver(post_save, sender=get_user_model())
+def activity_handler_user_notifications(sender, instance, created, **kwargs):
+    update_fields = kwargs.get('update_fields', None)
+    if created or (update_fields and set(update_fields) == set(['last_login'])):
+        return
+    invalidate_notifications([instance], NOTIFICATION_PROFILE)
+    # Pending users' requests are left out of the requests count
+    invalidate_notifications(
+        Connection.objects.filter(from_user=instance, responded=False).values_list('to_user_id', flat=True),
+        NOTIFICATION_REQUESTS
+    )
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def activity_handler_profile_notifications(sender, instance, **kwargs):
+    invalidate_notifications([instance.user_id], NOTIFICATION_PROFILE)
+
+
+@receiver(m2m_changed, sender=UserProfile.skills.through)
+def activity_handler_profile_skills_notifications(sender, instance, action, **kwargs):
+    if action in ['post_add', 'post_remove', 'post_clear'] and isinstance(instance, UserProfile):
+        invalidate_notifications([instance.user_id], NOTIFICATION_PROFILE)
+
+
 @receiver(post_save, sender=DeveloperApplication)
 def activity_handler_developer_application(sender, instance, created, **kwargs):
     if created:
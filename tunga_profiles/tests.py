@@ -1,3 +1,132 @@
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate
 
-# Create your tests here.
+from tunga_messages.models import Message
+from tunga_messages.tasks import create_channel
+from tunga_messages.utils import update_channel_last_read
+from tunga_profiles import connections
+from tunga_profiles.connections import connected_user_ids, get_connection_graph_stats, \
+    reset_connection_graph_stats, warm_connected_user_ids, invalidate_connected_user_ids
+from tunga_profiles.models import Connection, UserProfile
+from tunga_profiles.notification_summary import get_notification_summary, invalidate_notifications, \
+    invalidate_pm_task_notifications
+from tunga_profiles.views import NotificationView
+from tunga_tasks.models import Task
+from tunga_utils.constants import USER_TYPE_DEVELOPER, USER_TYPE_PROJECT_OWNER, TASK_SCOPE_ONGOING
+
+
+class ConnectionGraphTestCase(TestCase):
+
+    def setUp(self):
+        self.users = [
+            get_user_model().objects.create_user('user%s' % idx, 'user%s@example.com' % idx, 'secret')
+            for idx in range(3)
+        ]
+        invalidate_connected_user_ids(*self.users)
+        reset_connection_graph_stats()
+        # Count every lookup
+        self.stats_sample_rate = connections.CONNECTION_GRAPH_STATS_SAMPLE_RATE
+        connections.CONNECTION_GRAPH_STATS_SAMPLE_RATE = 1
+
+    def tearDown(self):
+        connections.CONNECTION_GRAPH_STATS_SAMPLE_RATE = self.stats_sample_rate
+
+    def test_connected_user_ids(self):
+        """
+        Connection sets are cached and invalidated when connections change
+        """
+        user, friend, stranger = self.users
+        self.assertEqual(connected_user_ids(user), set())
+
+        connection = Connection.objects.create(from_user=user, to_user=friend)
+        self.assertEqual(connected_user_ids(user), set())
+
+        connection.accepted = True
+        connection.responded = True
+        connection.save()
+        self.assertEqual(connected_user_ids(user), {friend.id})
+        self.assertEqual(connected_user_ids(friend.id), {user.id})
+        self.assertEqual(connected_user_ids(user), {friend.id})
+        self.assertEqual(get_connection_graph_stats(), {'hits': 1, 'misses': 4})
+
+        connection.delete()
+        self.assertEqual(connected_user_ids(friend), set())
+
+        Connection.objects.create(from_user=stranger, to_user=user, accepted=True, responded=True)
+        self.assertEqual(warm_connected_user_ids([u.id for u in self.users]), 3)
+        reset_connection_graph_stats()
+        self.assertEqual(connected_user_ids(user), {stranger.id})
+        self.assertEqual(connected_user_ids(friend), set())
+        self.assertEqual(get_connection_graph_stats(), {'hits': 2, 'misses': 0})
+
+
+class NotificationSummaryTestCase(TestCase):
+
+    def setUp(self):
+        self.project_owner = get_user_model().objects.create_user(
+            'project_owner', 'po@example.com', 'secret', **{'type': USER_TYPE_PROJECT_OWNER})
+        self.developer = get_user_model().objects.create_user(
+            'developer', 'developer@example.com', 'secret', **{'type': USER_TYPE_DEVELOPER})
+        invalidate_notifications([self.project_owner, self.developer])
+        invalidate_pm_task_notifications()
+
+    def test_notification_summary(self):
+        """
+        Cached summaries are served without queries and rebuilt after the signals that change them
+        """
+        data, etag = get_notification_summary(self.project_owner)
+        self.assertEqual(
+            [data['messages'], data['requests'], data['tasks'], data['estimates'], data['quotes']], [0, 0, 0, 0, 0]
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(get_notification_summary(self.project_owner), (data, etag))
+
+        channel = create_channel(self.developer, participants=[self.project_owner], subject='Channel')
+        Message.objects.create(channel=channel, user=self.developer, body='Message')
+        Connection.objects.create(from_user=self.developer, to_user=self.project_owner)
+        Task.objects.create(title='Task', fee=15, user=self.project_owner, scope=TASK_SCOPE_ONGOING)
+        UserProfile.objects.create(user=self.project_owner, bio='Bio')
+
+        data, new_etag = get_notification_summary(self.project_owner)
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(
+            [data['messages'], data['requests'], data['tasks'], data['estimates'], data['quotes']], [1, 0, 1, 1, 0]
+        )
+        self.assertEqual(data['channels'], [dict(id=channel.id, type=channel.type, new=1, last_read=0)])
+        self.assertNotIn('bio', data['profile']['missing'])
+
+        # Requests from pending developers only count once they're approved
+        self.developer.pending = False
+        self.developer.save()
+        data, new_etag = get_notification_summary(self.project_owner)
+        self.assertEqual(data['requests'], 1)
+
+        factory = APIRequestFactory()
+        request = factory.get('/api/me/notification/', HTTP_IF_NONE_MATCH='"%s"' % new_etag)
+        force_authenticate(request, user=self.project_owner)
+        response = NotificationView.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        update_channel_last_read(channel, self.project_owner, channel.target_actions.latest('id').id)
+        request = factory.get('/api/me/notification/', HTTP_IF_NONE_MATCH='"%s"' % new_etag)
+        force_authenticate(request, user=self.project_owner)
+        response = NotificationView.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['messages'], 0)
+        self.assertNotEqual(response['ETag'], '"%s"' % new_etag)
+
+    def test_task_reassignment_notifications(self):
+        """
+        Reassigning a task refreshes the counts of the owner who lost it
+        """
+        other_owner = get_user_model().objects.create_user(
+            'other_owner', 'other@example.com', 'secret', **{'type': USER_TYPE_PROJECT_OWNER})
+        task = Task.objects.create(title='Task', fee=15, user=self.project_owner)
+        self.assertEqual(get_notification_summary(self.project_owner)[0]['tasks'], 1)
+
+        task.user = other_owner
+        task.save()
+        self.assertEqual(get_notification_summary(self.project_owner)[0]['tasks'], 0)
+        self.assertEqual(get_notification_summary(other_owner)[0]['tasks'], 1)
@@ -1,7 +1,6 @@
 import json
 
 from allauth.socialaccount.providers.github.provider import GitHubProvider
-from django.db.models.query_utils import Q
 from django.shortcuts import get_object_or_404
 from django_countries.fields import CountryField
 from dry_rest_permissions.generics import DRYObjectPermissions, DRYPermissions
@@ -12,20 +11,16 @@ from rest_framework.response import Response
 from slacker import Slacker
 
 from tunga_auth.permissions import IsAdminOrCreateOnly
-from tunga_messages.models import Channel
-from tunga_messages.utils import channel_new_messages_filter
 from tunga_profiles.filterbackends import ConnectionFilterBackend
 from tunga_profiles.filters import EducationFilter, WorkFilter, ConnectionFilter, DeveloperApplicationFilter, \
     DeveloperInvitationFilter
 from tunga_profiles.models import UserProfile, Education, Work, Connection, DeveloperApplication, DeveloperInvitation
+from tunga_profiles.notification_summary import get_notification_summary
 from tunga_profiles.serializers import ProfileSerializer, EducationSerializer, WorkSerializer, ConnectionSerializer, \
     DeveloperApplicationSerializer, DeveloperInvitationSerializer
-from tunga_tasks.models import Task
 from tunga_tasks.utils import get_integration_token
 from tunga_utils import github, harvest_utils, slack_utils
-from tunga_utils.constants import USER_TYPE_PROJECT_OWNER, APP_INTEGRATION_PROVIDER_SLACK, CHANNEL_TYPE_SUPPORT, \
-    CHANNEL_TYPE_DIRECT, CHANNEL_TYPE_TOPIC, CHANNEL_TYPE_DEVELOPER, APP_INTEGRATION_PROVIDER_HARVEST, \
-    TASK_SCOPE_ONGOING, TASK_SCOPE_PROJECT, TASK_SOURCE_NEW_USER, STATUS_ACCEPTED
+from tunga_utils.constants import APP_INTEGRATION_PROVIDER_SLACK, APP_INTEGRATION_PROVIDER_HARVEST
 from tunga_utils.filterbackends import DEFAULT_FILTER_BACKENDS
 
 
@@ -178,104 +173,14 @@ class NotificationView(views.APIView):
                 status=status.HTTP_401_UNAUTHORIZED
             )
 
-        channel_filter = Q(channeluser__user=user)
-        if user.is_staff and user.is_superuser or user.is_developer:
-            # channel_filter = channel_filter | Q(type=CHANNEL_TYPE_DEVELOPER)
-            # TODO: Channel filter should include all developer channels for admins and devs
-            # However enabling above query currently breaks new message counts
-            pass
-
-        channels_with_messages = channel_new_messages_filter(
-            Channel.objects.filter(channel_filter),
-            user=user
-        )
-
-        channel_updates = [
-            dict(id=channel.id, type=channel.type, new=channel.new_messages, last_read=channel.channel_last_read)
-            for channel in channels_with_messages]
-
-        channel_type_map = {
-            CHANNEL_TYPE_DIRECT: 'direct',
-            CHANNEL_TYPE_TOPIC: 'topic',
-            CHANNEL_TYPE_SUPPORT: 'support',
-            CHANNEL_TYPE_DEVELOPER: 'developer'
-        }
-
-        channel_type_summary_updates = dict()
-        for channel_type_name in channel_type_map.itervalues():
-            channel_type_summary_updates[channel_type_name] = 0
-
-        for channel in channel_updates:
-            channel_type_summary_updates[channel_type_map.get(channel['type'], '')] += channel['new']
-
-        requests = user.connection_requests.filter(responded=False, from_user__pending=False).count()
-        tasks = user.tasks_created.filter(closed=False).count() + user.participation_set.filter(
-            (Q(accepted=True) | Q(responded=False)), task__closed=False, user=user
-        ).count() + user.tasks_managed.filter(closed=False).count()
-        pm_tasks = Task.objects.filter(
-            Q(scope=TASK_SCOPE_ONGOING) |
-            (
-                Q(scope=TASK_SCOPE_PROJECT) & (
-                    Q(pm_required=True) | Q(source=TASK_SOURCE_NEW_USER)
-                )
-            )
-        )
-        if request.user.is_project_manager:
-            pm_tasks.filter(pm=request.user)
-        estimates = pm_tasks.exclude(estimate__status=STATUS_ACCEPTED).distinct().count()
-        quotes = pm_tasks.filter(estimate__status=STATUS_ACCEPTED).exclude(quote__status=STATUS_ACCEPTED).distinct().count()
-
-        profile = None
-        profile_notifications = {'count': 0, 'missing': [], 'improve': [], 'more': [], 'section': None}
-        try:
-            profile = user.userprofile
-        except:
-            profile_notifications['missing'] = ['skills', 'bio', 'country', 'city', 'street', 'plot_number',
-                                                'phone_number']
-
-        if not user.avatar_url:
-            profile_notifications['missing'].append('image')
-
-        if profile:
-            skills = profile.skills.count()
-            if skills == 0:
-                profile_notifications['missing'].append('skills')
-            elif skills < 3:
-                profile_notifications['more'].append('skills')
-
-            if not profile.bio:
-                profile_notifications['missing'].append('bio')
-
-            if not profile.country:
-                profile_notifications['missing'].append('country')
-            if not profile.city:
-                profile_notifications['missing'].append('city')
-            if not profile.street:
-                profile_notifications['missing'].append('street')
-            if not profile.plot_number:
-                profile_notifications['missing'].append('plot_number')
-            if not profile.phone_number:
-                profile_notifications['missing'].append('phone_number')
-
-            if user.type == USER_TYPE_PROJECT_OWNER and not profile.company:
-                profile_notifications['missing'].append('company')
-
-        profile_notifications['count'] = len(profile_notifications['missing']) + len(profile_notifications['more']) \
-                                         + len(profile_notifications['improve'])
-
-        return Response(
-            {
-                'messages': channel_type_summary_updates['direct'] + channel_type_summary_updates['topic'] + channel_type_summary_updates['developer'],
-                'requests': requests,
-                'tasks': tasks,
-                'estimates': estimates,
-                'quotes': quotes,
-                'profile': profile_notifications,
-                'channels': channel_updates,
-                'channel_summary': channel_type_summary_updates
-            },
-            status=status.HTTP_200_OK
-        )
+        data, etag = get_notification_summary(user)
+        etag = '"%s"' % etag
+        if request.META.get('HTTP_IF_NONE_MATCH', None) == etag:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data, status=status.HTTP_200_OK)
+        response['ETag'] = etag
+        return response
 
 
 class RepoListView(views.APIView):
@@ -2,18 +2,47 @@ import datetime
 
 from dateutil.relativedelta import relativedelta
 from django.contrib.auth import get_user_model
-from django.core.exceptions import ObjectDoesNotExist
-from django.db.models.aggregates import Sum
-from django.db.models.expressions import Case, When, F
-from django.db.models.fields import IntegerField
+from django.db.models.expressions import F
 from django.db.models.query_utils import Q
 from dry_rest_permissions.generics import DRYPermissionFiltersBase
 
-from tunga_profiles.models import UserProfile
+from tunga_profiles.connections import connected_user_ids
+from tunga_tasks.models import Quote, TaskVisibility, Participation
 from tunga_utils.constants import VISIBILITY_DEVELOPER, \
     VISIBILITY_MY_TEAM, TASK_SCOPE_TASK, TASK_SCOPE_ONGOING, TASK_SCOPE_PROJECT, TASK_SOURCE_NEW_USER, STATUS_APPROVED, \
     STATUS_ACCEPTED
 from tunga_utils.filterbackends import dont_filter_staff_or_superuser
+from tunga_utils.skill_matching import annotate_skill_matches, match_tasks, get_user_skill_ids
+
+
+def developer_task_visibility_q_filter(user):
+    # Equivalent of the TaskVisibility index, used to check its consistency
+    return (
+        Q(user=user) |
+        Q(participation__user=user) |
+        (
+            Q(visibility=VISIBILITY_MY_TEAM) &
+            (
+                (
+                    Q(user__connections_initiated__to_user=user) &
+                    Q(user__connections_initiated__accepted=True)
+                ) |
+                (
+                    Q(user__connection_requests__from_user=user) &
+                    Q(user__connection_requests__accepted=True)
+                )
+            )
+        )
+    )
+
+
+def active_participation_task_ids(user):
+    """
+    Tasks the user has accepted or not yet responded to, as a subquery.
+    Filtering on it is a semi-join, unlike joining through participation it doesn't repeat rows
+    for tasks with several participants so no DISTINCT is needed.
+    """
+    return Participation.objects.filter(Q(accepted=True) | Q(responded=False), user=user).values('task_id')
 
 
 class ProjectFilterBackend(DRYPermissionFiltersBase):
@@ -60,69 +89,24 @@ class TaskFilterBackend(DRYPermissionFiltersBase):
                     queryset = queryset.exclude(estimate__status=STATUS_ACCEPTED)
                 if label_filter == 'quotes':
                     queryset = queryset.filter(estimate__status=STATUS_ACCEPTED).exclude(quote__status=STATUS_ACCEPTED)
-        elif label_filter == 'skills':
-            try:
-                user_skills = request.user.userprofile.skills.all()
-                queryset = queryset.filter(skills__in=user_skills)
-                when = []
-                for skill in user_skills:
-                    new_when = When(
-                        skills=skill,
-                        then=1
-                    )
-                    when.append(new_when)
-                queryset = queryset.annotate(matches=Sum(
-                    Case(
-                        *when,
-                        default=0,
-                        output_field=IntegerField()
-                    )
-                )).order_by('-matches', '-created_at')
-            except (ObjectDoesNotExist, UserProfile.DoesNotExist):
-                return queryset.none()
         elif label_filter in ['my-clients', 'project-owners']:
-            queryset = queryset.filter(
-                (
-                    Q(user__connections_initiated__to_user=request.user) &
-                    Q(user__connections_initiated__accepted=True)
-                ) |
-                (
-                    Q(user__connection_requests__from_user=request.user) &
-                    Q(user__connection_requests__accepted=True)
-                )
-            )
+            queryset = queryset.filter(user__in=connected_user_ids(request.user))
 
         if request.user.is_authenticated():
             if request.user.is_staff or request.user.is_superuser:
-                return queryset
-            if request.user.is_project_owner:
+                pass
+            elif request.user.is_project_owner:
                 queryset = queryset.filter(Q(user=request.user) | Q(taskaccess__user=request.user))
             elif request.user.is_developer:
-                return queryset.exclude(approved=False).filter(
+                queryset = queryset.exclude(approved=False).filter(
                     Q(scope=TASK_SCOPE_TASK) |
                     (
                         Q(scope=TASK_SCOPE_PROJECT) & Q(pm_required=False) & ~Q(source=TASK_SOURCE_NEW_USER)
-                    ) | Q(quote__status=STATUS_ACCEPTED)
+                    ) | Q(id__in=Quote.objects.filter(status=STATUS_ACCEPTED).values('task_id'))
                 ).filter(
-                    Q(user=request.user) |
-                    Q(participation__user=request.user) |
-                    (
-                        Q(visibility=VISIBILITY_DEVELOPER) |
-                        (
-                            Q(visibility=VISIBILITY_MY_TEAM) &
-                            (
-                                (
-                                    Q(user__connections_initiated__to_user=request.user) &
-                                    Q(user__connections_initiated__accepted=True)
-                                ) |
-                                (
-                                    Q(user__connection_requests__from_user=request.user) &
-                                    Q(user__connection_requests__accepted=True)
-                                )
-                            )
-                        )
-                    )
-                ).distinct()
+                    Q(visibility=VISIBILITY_DEVELOPER) |
+                    Q(id__in=TaskVisibility.objects.filter(user=request.user).values('task_id'))
+                )
             elif request.user.is_project_manager:
                 queryset = queryset.filter(
                     Q(user=request.user) |
@@ -139,6 +123,12 @@ class TaskFilterBackend(DRYPermissionFiltersBase):
                 return queryset.none()
         else:
             return queryset.none()
+
+        if label_filter == 'skills':
+            # Matches are ranked last so the visibility filters apply before the matches are capped
+            queryset = annotate_skill_matches(
+                queryset, match_tasks(get_user_skill_ids(request.user))
+            ).order_by('-matches', '-created_at')
         return queryset
 
 
@@ -154,12 +144,7 @@ class ParticipationFilterBackend(DRYPermissionFiltersBase):
         return queryset.filter(
             Q(user=request.user) |
             Q(task__user=request.user) |
-            (
-                Q(task__participation__user=request.user) &
-                (
-                    Q(task__participation__accepted=True) | Q(task__participation__responded=False)
-                )
-            )
+            Q(task_id__in=active_participation_task_ids(request.user))
         )
 
 
@@ -191,12 +176,7 @@ class ProgressEventFilterBackend(DRYPermissionFiltersBase):
         return queryset.filter(
             Q(created_by=request.user) |
             Q(task__user=request.user) |
-            (
-                Q(task__participation__user=request.user) &
-                (
-                    Q(task__participation__accepted=True) | Q(task__participation__responded=False)
-                )
-            )
+            Q(task_id__in=active_participation_task_ids(request.user))
         )
 
 
@@ -206,10 +186,5 @@ class ProgressReportFilterBackend(DRYPermissionFiltersBase):
         return queryset.filter(
             Q(user=request.user) |
             Q(event__task__user=request.user) |
-            (
-                Q(event__task__participation__user=request.user) &
-                (
-                    Q(event__task__participation__accepted=True) | Q(event__task__participation__responded=False)
-                )
-            )
+            Q(event__task_id__in=active_participation_task_ids(request.user))
         )
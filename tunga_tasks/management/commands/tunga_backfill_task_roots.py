@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from tunga_tasks.utils import backfill_task_roots
+
+
+class Command(BaseCommand):
+
+    def handle(self, *args, **options):
+        """
+        Sets the denormalized task and root task on existing uploads and task activity.
+        """
+        # command to run: python manage.py tunga_backfill_task_roots
+
+        num_uploads, num_actions = backfill_task_roots()
+        print "%s uploads updated, %s task actions created" % (num_uploads, num_actions)
@@ -0,0 +1,116 @@
+import datetime
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction, connection
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from tunga_profiles.models import Skill
+from tunga_tasks.models import Task, Participation, ProgressEvent
+from tunga_tasks.serializers import TaskSerializer
+from tunga_tasks.utils import get_task_prefetch_plan, prefetch_task_page
+from tunga_utils.constants import USER_TYPE_DEVELOPER, USER_TYPE_PROJECT_OWNER, PROGRESS_EVENT_TYPE_MILESTONE
+
+BENCHMARK_PREFIX = 'fieldsetbench'
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, dest='tasks', default=100)
+        parser.add_argument('--page-size', type=int, dest='page_size', default=20)
+        parser.add_argument('--repeat', type=int, dest='repeat', default=5)
+        parser.add_argument(
+            '--fields', dest='fields', default='id,title,summary,fee,display_fee,deadline,closed,skills,user'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Compares bytes, queries and milliseconds per page of tasks rendered with all fields and with sparse fieldsets.
+        All generated rows are rolled back at the end.
+        """
+        # command to run: python manage.py tunga_benchmark_task_fieldsets
+
+        with transaction.atomic():
+            developer = self.create_data(options)
+
+            for label, query in [
+                ('all fields', {}),
+                ('?fields=%s' % options['fields'], {'fields': options['fields']}),
+                ('?expand=details', {'expand': 'details'})
+            ]:
+                num_bytes, num_queries, duration = self.render_page(developer, query, options)
+                print "%s: %s bytes, %s queries, %.1fms per page" % (label, num_bytes, num_queries, duration * 1000)
+
+            transaction.set_rollback(True)
+
+    def create_data(self, options):
+        # Bulk inserts skip the user, skill and task signals which would queue jobs for rows that are rolled back
+        get_user_model().objects.bulk_create([
+            get_user_model()(
+                username='%s_%s' % (BENCHMARK_PREFIX, user_type),
+                email='%s_%s@example.com' % (BENCHMARK_PREFIX, user_type),
+                type=user_type
+            ) for user_type in [USER_TYPE_PROJECT_OWNER, USER_TYPE_DEVELOPER]
+        ])
+        owner = get_user_model().objects.get(username='%s_%s' % (BENCHMARK_PREFIX, USER_TYPE_PROJECT_OWNER))
+        developer = get_user_model().objects.get(username='%s_%s' % (BENCHMARK_PREFIX, USER_TYPE_DEVELOPER))
+
+        Skill.objects.bulk_create([
+            Skill(name='%s-%s' % (BENCHMARK_PREFIX, idx), slug='%s-%s' % (BENCHMARK_PREFIX, idx)) for idx in range(5)
+        ])
+        skill_ids = list(Skill.objects.filter(name__startswith=BENCHMARK_PREFIX).values_list('id', flat=True))
+
+        Task.objects.bulk_create([
+            Task(
+                title='%s %s' % (BENCHMARK_PREFIX, idx), description='Build the thing ' * 20, fee=150,
+                user=owner, pm=owner
+            ) for idx in range(options['tasks'])
+        ])
+        task_ids = list(Task.objects.filter(title__startswith=BENCHMARK_PREFIX).values_list('id', flat=True))
+
+        task_skills = Task._meta.get_field('skills').remote_field.through
+        task_skills.objects.bulk_create([
+            task_skills(task_id=task_id, skill_id=skill_id)
+            for task_id in task_ids for skill_id in random.sample(skill_ids, 3)
+        ])
+        Participation.objects.bulk_create([
+            Participation(
+                task_id=task_id, user=developer, accepted=True, responded=True, assignee=True, created_by=owner
+            ) for task_id in task_ids
+        ])
+        ProgressEvent.objects.bulk_create([
+            ProgressEvent(
+                task_id=task_id, type=PROGRESS_EVENT_TYPE_MILESTONE, due_at=datetime.datetime.now(), created_by=owner
+            ) for task_id in task_ids for idx in range(3)
+        ])
+        return developer
+
+    def render_page(self, user, query, options):
+        request = Request(RequestFactory().get('/', query))
+        request.user = user
+        context = {'request': request}
+        field_names = TaskSerializer(context=context).fields.keys()
+        select_related, prefetch_related = get_task_prefetch_plan(fields=field_names)
+        queryset = Task.objects.filter(title__startswith=BENCHMARK_PREFIX).select_related(
+            *select_related
+        ).prefetch_related(*prefetch_related).order_by('-id')
+
+        num_bytes = 0
+        num_queries = 0
+        start = time.time()
+        for idx in range(options['repeat']):
+            with CaptureQueriesContext(connection) as queries:
+                tasks = list(queryset.all()[:options['page_size']])
+                viewer_context = prefetch_task_page(tasks, user=user, fields=field_names)
+                if viewer_context:
+                    context['viewer_context'] = viewer_context
+                data = TaskSerializer(tasks, many=True, context=context).data
+                num_bytes = len(JSONRenderer().render(data))
+            num_queries = len(queries)
+        return num_bytes, num_queries, (time.time() - start) / options['repeat']
@@ -0,0 +1,44 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from tunga_tasks.filterbackends import developer_task_visibility_q_filter
+from tunga_tasks.models import Task, TaskVisibility
+from tunga_tasks.utils import update_task_visibility
+from tunga_utils.constants import USER_TYPE_DEVELOPER
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', dest='user', default=None, help='Only check this username')
+        parser.add_argument('--fix', action='store_true', dest='fix', default=False, help='Resync inconsistent tasks')
+
+    def handle(self, *args, **options):
+        """
+        Compares the task visibility index with the equivalent join based filter.
+        """
+        # command to run: python manage.py tunga_check_task_visibility
+
+        users = get_user_model().objects.filter(type=USER_TYPE_DEVELOPER)
+        if options['user']:
+            users = users.filter(username=options['user'])
+
+        inconsistent_task_ids = set()
+        for user in users:
+            expected_task_ids = set(
+                Task.objects.filter(developer_task_visibility_q_filter(user)).values_list('id', flat=True)
+            )
+            indexed_task_ids = set(TaskVisibility.objects.filter(user=user).values_list('task_id', flat=True))
+
+            missing_task_ids = expected_task_ids - indexed_task_ids
+            extra_task_ids = indexed_task_ids - expected_task_ids
+            if missing_task_ids or extra_task_ids:
+                print "%s: missing %s, extra %s" % (user.username, sorted(missing_task_ids), sorted(extra_task_ids))
+                inconsistent_task_ids.update(missing_task_ids)
+                inconsistent_task_ids.update(extra_task_ids)
+
+        if options['fix']:
+            for task in Task.objects.filter(id__in=inconsistent_task_ids):
+                update_task_visibility(task)
+
+        print "%s inconsistent tasks%s" % (len(inconsistent_task_ids), options['fix'] and ' fixed' or '')
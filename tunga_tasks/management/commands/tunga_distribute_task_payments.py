@@ -4,7 +4,7 @@ from dateutil.relativedelta import relativedelta
 from django.core.management.base import BaseCommand
 
 from tunga_tasks.models import Task
-from tunga_tasks.tasks import distribute_task_payment
+from tunga_tasks.payouts import plan_task_payouts, dispatch_payouts, reconcile_task_payouts
 
 
 class Command(BaseCommand):
@@ -19,6 +19,15 @@ class Command(BaseCommand):
         min_date = utc_now - relativedelta(minutes=10)  # 10 minute window to read new messages
 
         # Distribute payments for tasks which where paid at least 10 mins ago
-        tasks = Task.objects.filter(closed=True, pay_distributed=False, paid_at__lte=min_date)
-        for task in tasks:
-            distribute_task_payment(task.id)
+        task_ids = list(Task.objects.filter(
+            closed=True, pay_distributed=False, paid_at__lte=min_date
+        ).values_list('id', flat=True))
+
+        # Payouts confirmed since the last run (e.g by BitPesa) finalize their tasks
+        num_distributed = reconcile_task_payouts(task_ids)
+        num_planned = plan_task_payouts(task_ids)
+        num_dispatched = dispatch_payouts(task_ids=task_ids)
+
+        print "%s tasks distributed, %s payouts planned and %s dispatched" % (
+            num_distributed, num_planned, num_dispatched
+        )
@@ -7,22 +7,37 @@ from django.db.models.query_utils import Q
 from tunga_tasks.notifications import send_progress_event_reminder
 from tunga_tasks.models import Task, ProgressEvent
 from tunga_tasks.tasks import initialize_task_progress_events
+from tunga_tasks.utils import TASK_PROGRESS_GRACE_PERIOD
 
 
 class Command(BaseCommand):
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true', dest='all', default=False,
+            help='Check every open task, not only the ones that are due e.g after the due times were lost'
+        )
+
     def handle(self, *args, **options):
         """
         Update periodic update events and send notifications for upcoming update events.
         """
         # command to run: python manage.py tunga_manage_task_progress
 
-        # Periodic updates will continue to be scheduled for unclosed tasks for up to a week past their deadlines
-        min_deadline = datetime.datetime.utcnow() - relativedelta(days=7)
-        tasks = Task.objects.filter(Q(deadline__isnull=True) | Q(deadline__gte=min_deadline), closed=False)
-        for task in tasks:
-            # Creates the next periodic events and reconciles submit events if necessary
-            initialize_task_progress_events(task)
+        utc_now = datetime.datetime.utcnow()
+        if options['all']:
+            min_deadline = utc_now - TASK_PROGRESS_GRACE_PERIOD
+            Task.objects.filter(
+                Q(deadline__isnull=True) | Q(deadline__gte=min_deadline), closed=False
+            ).update(progress_check_at=utc_now)
+
+        # Only tasks whose latest periodic update has passed or whose progress settings changed are due
+        task_ids = list(Task.objects.filter(
+            progress_check_at__lte=utc_now, closed=False
+        ).order_by('progress_check_at').values_list('id', flat=True))
+        for task_id in task_ids:
+            # Creates the next periodic events, reconciles submit events if necessary and sets the next check
+            initialize_task_progress_events(task_id)
 
         min_date = datetime.datetime.utcnow()
         max_date = min_date + relativedelta(hours=24)
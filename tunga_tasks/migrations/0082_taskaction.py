@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-17 02:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('actstream', '0002_remove_action_data'),
+        ('tunga_tasks', '0081_taskvisibility'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskAction',
+            fields=[
+                ('action', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='task_action', serialize=False, to='actstream.Action')),
+                ('root_task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='root_actions', to='tunga_tasks.Task')),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tunga_tasks.Task')),
+            ],
+        ),
+    ]
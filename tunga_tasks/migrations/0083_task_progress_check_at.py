@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-17 04:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tunga_tasks', '0082_taskaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='progress_check_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
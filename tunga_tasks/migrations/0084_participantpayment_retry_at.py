@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-17 04:48
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tunga_tasks', '0083_task_progress_check_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participantpayment',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Failed payout attempts'),
+        ),
+        migrations.AddField(
+            model_name='participantpayment',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, help_text='When the payout is attempted again', null=True),
+        ),
+    ]
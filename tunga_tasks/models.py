@@ -239,6 +239,9 @@ class Task(models.Model):
     complete_task_email_at = models.DateTimeField(blank=True, null=True)
     check_task_email_at = models.DateTimeField(blank=True, null=True)
 
+    # When the progress events are next due for a check, see tunga_tasks.utils.get_task_progress_check_at
+    progress_check_at = models.DateTimeField(blank=True, null=True, db_index=True)
+
     # Applications and participation info
     pm = models.ForeignKey(
         settings.AUTH_USER_MODEL, related_name='tasks_managed', on_delete=models.DO_NOTHING, blank=True, null=True
@@ -480,6 +483,8 @@ class Task(models.Model):
 
     @property
     def milestones(self):
+        if hasattr(self, 'prefetched_milestones'):
+            return self.prefetched_milestones
         return self.progressevent_set.filter(type__in=[PROGRESS_EVENT_TYPE_MILESTONE, PROGRESS_EVENT_TYPE_SUBMIT])
 
     @property
@@ -488,6 +493,8 @@ class Task(models.Model):
 
     @property
     def participation(self):
+        if hasattr(self, 'prefetched_participation'):
+            return self.prefetched_participation
         return self.participation_set.filter(Q(accepted=True) | Q(responded=False))
 
     @property
@@ -496,6 +503,9 @@ class Task(models.Model):
 
     @property
     def assignee(self):
+        if hasattr(self, 'prefetched_participation'):
+            assignees = [participation for participation in self.prefetched_participation if participation.assignee]
+            return len(assignees) == 1 and assignees[0] or None
         try:
             return self.participation_set.get((Q(accepted=True) | Q(responded=False)), assignee=True)
         except:
@@ -503,6 +513,8 @@ class Task(models.Model):
 
     @property
     def invoice(self):
+        if hasattr(self, 'prefetched_invoices'):
+            return self.prefetched_invoices and self.prefetched_invoices[0] or None
         try:
             return self.taskinvoice_set.all().order_by('-id', '-created_at').first()
         except:
@@ -510,6 +522,8 @@ class Task(models.Model):
 
     @property
     def estimate(self):
+        if hasattr(self, 'prefetched_estimates'):
+            return self.prefetched_estimates and self.prefetched_estimates[0] or None
         try:
             return self.estimate_set.all().order_by('-id', '-created_at').first()
         except:
@@ -517,6 +531,8 @@ class Task(models.Model):
 
     @property
     def quote(self):
+        if hasattr(self, 'prefetched_quotes'):
+            return self.prefetched_quotes and self.prefetched_quotes[0] or None
         try:
             return self.quote_set.all().order_by('-id', '-created_at').first()
         except:
@@ -539,41 +555,36 @@ class Task(models.Model):
 
     @property
     def all_uploads(self):
-        return Upload.objects.filter(
-            Q(tasks=self) | Q(comments__tasks=self) | Q(progress_reports__event__task=self) |
-            Q(tasks__parent=self) | Q(comments__tasks__parent=self) | Q(progress_reports__event__task__parent=self)
-        )
+        if hasattr(self, 'prefetched_all_uploads'):
+            return self.prefetched_all_uploads
+        if self.parent_id:
+            # Sub tasks also have their own uploads which are rooted at the parent
+            return Upload.objects.filter(Q(task=self) | Q(root_task=self))
+        return Upload.objects.filter(root_task=self)
 
     @property
     def activity_stream(self):
-        return Action.objects.filter(
-            Q(tasks=self) | Q(tasks__parent=self) |
-            Q(progress_events__task=self) | Q(progress_events__task__parent=self)
-        )
+        if self.parent_id:
+            return Action.objects.filter(Q(task_action__task=self) | Q(task_action__root_task=self))
+        return Action.objects.filter(task_action__root_task=self)
 
     def get_participation_shares(self, return_hash=False):
-        participants = self.participation_set.filter(accepted=True).order_by('-share')
-        num_participants = participants.count()
-
-        participation_shares = []
-        participation_shares_hash = {}
+        if not hasattr(self, 'prefetched_participation_shares'):
+            if hasattr(self, 'prefetched_participation'):
+                # Accepted participation is a subset of the prefetched active participation
+                participants = [participant for participant in self.prefetched_participation if participant.accepted]
+            else:
+                participants = list(self.participation_set.filter(accepted=True))
+            self.prefetched_participation_shares = calculate_participation_shares(self, participants)
 
-        if participants:
-            all_shares = [participant.share or 0 for participant in participants]
-            total_shares = all_shares and sum(all_shares) or 0
+        participation_shares = self.prefetched_participation_shares
+        if return_hash:
+            return dict([(share_info['participant'].id, share_info) for share_info in participation_shares])
+        return list(participation_shares)
 
-            for participant in participants:
-                if not total_shares:
-                    share = 1/Decimal(num_participants)
-                else:
-                    share = Decimal(participant.share or 0)/Decimal(total_shares)
-                share_info = {
-                    'participant': participant,
-                    'share': share
-                }
-                participation_shares.append(share_info)
-                participation_shares_hash[participant.id] = share_info
-        return return_hash and participation_shares_hash or participation_shares
+    def clear_participation_shares(self):
+        if hasattr(self, 'prefetched_participation_shares'):
+            del self.prefetched_participation_shares
 
     def get_payment_shares(self):
         participation_shares = self.get_participation_shares()
@@ -602,6 +613,29 @@ class Task(models.Model):
         return 0
 
 
+def calculate_participation_shares(task, participants):
+    """
+    Splits the task between the accepted participants in proportion to their shares (equally if none are set)
+    """
+    participants = sorted(participants, key=lambda participant: participant.share or 0, reverse=True)
+    num_participants = len(participants)
+    total_shares = sum([participant.share or 0 for participant in participants])
+
+    participation_shares = []
+    for participant in participants:
+        # Point the participant back at this task so that Participation.payment_share reuses its memoized shares
+        participant.task = task
+        if not total_shares:
+            share = 1/Decimal(num_participants)
+        else:
+            share = Decimal(participant.share or 0)/Decimal(total_shares)
+        participation_shares.append({
+            'participant': participant,
+            'share': share
+        })
+    return participation_shares
+
+
 class TaskAccess(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     task = models.ForeignKey(Task, on_delete=models.CASCADE)
@@ -615,6 +649,35 @@ class TaskAccess(models.Model):
         unique_together = ('user', 'task')
 
 
+class TaskVisibility(models.Model):
+    """
+    Materialized index of the users who can see a task outside of VISIBILITY_DEVELOPER.
+    i.e the task owner, participants and the owner's connections for VISIBILITY_MY_TEAM tasks
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='visible_tasks')
+    task = models.ForeignKey(Task, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return '%s - %s' % (self.user.get_short_name() or self.user.username, self.task.summary)
+
+    class Meta:
+        unique_together = ('user', 'task')
+        verbose_name_plural = 'task visibility'
+
+
+class TaskAction(models.Model):
+    """
+    Task and root task (the task itself or its parent) of activity targeting a task or one of its progress events
+    """
+    action = models.OneToOneField(Action, on_delete=models.CASCADE, primary_key=True, related_name='task_action')
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='+')
+    root_task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='root_actions')
+
+    def __unicode__(self):
+        return '%s - %s' % (self.action_id, self.task.summary)
+
+
 class Application(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     task = models.ForeignKey(Task, on_delete=models.CASCADE)
@@ -1244,6 +1307,8 @@ class ParticipantPayment(models.Model):
     received_at = models.DateTimeField(blank=True, null=True)
     description = models.CharField(max_length=200, blank=True, null=True)
     extra = models.TextField(blank=True, null=True)  # JSON formatted extra details
+    attempts = models.PositiveSmallIntegerField(default=0, help_text='Failed payout attempts')
+    retry_at = models.DateTimeField(blank=True, null=True, help_text='When the payout is attempted again')
 
     def __unicode__(self):
         return 'bitcoin:%s - %s | %s' % (self.destination, self.participant.user, self.description)
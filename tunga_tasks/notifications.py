@@ -10,7 +10,7 @@ from django_rq.decorators import job
 from tunga.settings import EMAIL_SUBJECT_PREFIX, TUNGA_URL, TUNGA_STAFF_UPDATE_EMAIL_RECIPIENTS, SLACK_ATTACHMENT_COLOR_TUNGA, \
     SLACK_ATTACHMENT_COLOR_RED, SLACK_ATTACHMENT_COLOR_GREEN, SLACK_ATTACHMENT_COLOR_NEUTRAL, \
     SLACK_ATTACHMENT_COLOR_BLUE
-from tunga_auth.filterbackends import my_connections_q_filter
+from tunga_profiles.connections import connected_user_ids
 from tunga_tasks import slugs
 from tunga_tasks.models import Task, Participation, Application, ProgressEvent, ProgressReport, Quote, Estimate
 from tunga_utils import slack_utils
@@ -18,6 +18,7 @@ from tunga_utils.constants import USER_TYPE_DEVELOPER, VISIBILITY_DEVELOPER, VIS
     USER_TYPE_PROJECT_MANAGER, TASK_SOURCE_NEW_USER, STATUS_INITIAL, STATUS_SUBMITTED, STATUS_APPROVED, STATUS_DECLINED, \
     STATUS_ACCEPTED, STATUS_REJECTED
 from tunga_utils.emails import send_mail
+from tunga_utils.skill_matching import annotate_skill_matches, match_users
 from tunga_utils.helpers import clean_instance, convert_to_text
 
 
@@ -115,29 +116,16 @@ def send_new_task_community_email(instance):
 
         # Only developers on client's team
         if instance.is_developer_ready and instance.visibility == VISIBILITY_MY_TEAM:
-            queryset = queryset.filter(
-                my_connections_q_filter(instance.user)
-            )
+            queryset = queryset.filter(id__in=connected_user_ids(instance.user_id))
 
         ordering = []
 
         # Order by matching skills
         task_skills = instance.skills.all()
         if task_skills:
-            when = []
-            for skill in task_skills:
-                new_when = When(
-                        userprofile__skills=skill,
-                        then=1
-                    )
-                when.append(new_when)
-            queryset = queryset.annotate(matches=Sum(
-                Case(
-                    *when,
-                    default=0,
-                    output_field=IntegerField()
-                )
-            ))
+            queryset = annotate_skill_matches(
+                queryset, match_users([skill.id for skill in task_skills]), exclude_unmatched=False
+            )
             ordering.append('-matches')
 
         # Order developers by tasks completed
@@ -0,0 +1,368 @@
+import datetime
+import json
+import logging
+from decimal import Decimal
+from uuid import uuid4
+
+from dateutil.relativedelta import relativedelta
+from django.db.models.query_utils import Q
+from django_redis import get_redis_connection
+from django_rq.decorators import job
+
+from tunga.settings import BITPESA_SENDER
+from tunga_tasks.models import Task, TaskPayment, ParticipantPayment
+from tunga_tasks.utils import prefetch_participation_shares
+from tunga_utils import bitcoin_utils, coinbase_utils, bitpesa
+from tunga_utils.constants import CURRENCY_BTC, PAYMENT_METHOD_BTC_WALLET, PAYMENT_METHOD_BTC_ADDRESS, \
+    PAYMENT_METHOD_MOBILE_MONEY, STATUS_PENDING, STATUS_INITIATED, STATUS_PROCESSING, STATUS_COMPLETED, \
+    STATUS_FAILED
+from tunga_utils.scheduler import acquire_lock, release_lock
+
+logger = logging.getLogger(__name__)
+
+PAYOUTS_QUEUE = 'payouts'
+
+PAYOUT_QUEUED_KEY = 'tunga:payouts:queued:%s'
+PAYOUT_LOCK_KEY = 'tunga:payouts:lock:%s'
+PAYOUT_PROVIDER_SLOT_KEY = 'tunga:payouts:provider:%s:%s'
+
+PAYOUT_PROVIDER_COINBASE = 'coinbase'
+PAYOUT_PROVIDER_BITPESA = 'bitpesa'
+
+PAYOUT_PROVIDERS = {
+    PAYMENT_METHOD_BTC_ADDRESS: PAYOUT_PROVIDER_COINBASE,
+    PAYMENT_METHOD_BTC_WALLET: PAYOUT_PROVIDER_COINBASE,
+    PAYMENT_METHOD_MOBILE_MONEY: PAYOUT_PROVIDER_BITPESA
+}
+
+# Payouts in flight per provider, a slow provider only holds up its own payouts
+PAYOUT_PROVIDER_CONCURRENCY = {
+    PAYOUT_PROVIDER_COINBASE: 4,
+    PAYOUT_PROVIDER_BITPESA: 2
+}
+
+PAYOUT_TIMEOUT = 5 * 60
+PAYOUT_MAX_ATTEMPTS = 6
+# Failed attempts are retried after 5, 10, 20 ... minutes, payouts waiting for a provider slot after a minute,
+# payouts initiated with a provider are polled every 5 minutes until the provider completes them
+# and payouts waiting for the participant's payment method are checked every hour
+PAYOUT_RETRY_BACKOFF = 5
+PAYOUT_BUSY_RETRY = 1
+PAYOUT_PENDING_RETRY = 5
+PAYOUT_PAYMENT_METHOD_RETRY = 60
+
+PAYOUT_SENT_STATUSES = [STATUS_PROCESSING, STATUS_COMPLETED]
+
+
+def plan_task_payouts(task_ids):
+    """
+    Creates the missing participant payments of the received and unprocessed payments of the tasks in bulk.
+    Returns the number of participant payments created.
+    """
+    tasks = list(Task.objects.filter(id__in=task_ids, paid=True, pay_distributed=False))
+    if not tasks:
+        return 0
+    prefetch_participation_shares(tasks)
+
+    payments = list(TaskPayment.objects.filter(task__in=tasks, received_at__isnull=False, processed=False))
+    planned = set(ParticipantPayment.objects.filter(source__in=payments).values_list('source_id', 'participant_id'))
+
+    task_participants = dict([
+        (task.id, [item['participant'] for item in task.get_payment_shares() if item['participant'].user])
+        for task in tasks
+    ])
+    payouts = [
+        ParticipantPayment(source=payment, participant=participant)
+        for payment in payments for participant in task_participants[payment.task_id]
+        if (payment.id, participant.id) not in planned
+    ]
+    ParticipantPayment.objects.bulk_create(payouts, batch_size=200)
+    return len(payouts)
+
+
+def dispatch_payouts(task_ids=None):
+    """
+    Enqueues a job for every payout that is due. A payout's idem_key is its dedupe key,
+    so a payout is never queued again while its job is waiting.
+    Returns the number of jobs enqueued.
+    """
+    payouts = ParticipantPayment.objects.filter(
+        Q(retry_at__isnull=True) | Q(retry_at__lte=datetime.datetime.utcnow()),
+        status__in=[STATUS_PENDING, STATUS_INITIATED], source__processed=False,
+        source__task__pay_distributed=False, attempts__lt=PAYOUT_MAX_ATTEMPTS
+    )
+    if task_ids is not None:
+        payouts = payouts.filter(source__task__in=task_ids)
+
+    num_enqueued = 0
+    for payout_id, idem_key in payouts.values_list('id', 'idem_key'):
+        if acquire_lock(PAYOUT_QUEUED_KEY % idem_key, payout_id, PAYOUT_TIMEOUT * 2):
+            execute_payout.delay(payout_id)
+            num_enqueued += 1
+    return num_enqueued
+
+
+def acquire_provider_slot(provider, token):
+    for slot in range(PAYOUT_PROVIDER_CONCURRENCY.get(provider, 1)):
+        key = PAYOUT_PROVIDER_SLOT_KEY % (provider, slot)
+        if acquire_lock(key, token, PAYOUT_TIMEOUT):
+            return key
+    return None
+
+
+def get_payout_retry_at(attempts):
+    return datetime.datetime.utcnow() + relativedelta(minutes=PAYOUT_RETRY_BACKOFF * 2 ** max(attempts - 1, 0))
+
+
+@job(PAYOUTS_QUEUE, timeout=PAYOUT_TIMEOUT)
+def execute_payout(payout_id):
+    """
+    Sends a participant payment through its provider and finalizes the task's payments once all are sent.
+    Failed attempts are retried with exponential backoff until PAYOUT_MAX_ATTEMPTS, after which the payout is failed.
+    Payouts initiated with a provider are not failing, they are polled until the provider completes them.
+    """
+    payout = ParticipantPayment.objects.select_related(
+        'source__task', 'participant__user__userprofile'
+    ).get(id=payout_id)
+    get_redis_connection('default').delete(PAYOUT_QUEUED_KEY % payout.idem_key)
+
+    token = str(uuid4())
+    lock_key = PAYOUT_LOCK_KEY % payout.idem_key
+    if not acquire_lock(lock_key, token, PAYOUT_TIMEOUT):
+        return False
+
+    slot_key = None
+    try:
+        payout.refresh_from_db(fields=['status', 'ref', 'destination', 'extra', 'attempts'])
+        if payout.status not in [STATUS_PENDING, STATUS_INITIATED]:
+            return payout.status in PAYOUT_SENT_STATUSES
+
+        provider = PAYOUT_PROVIDERS.get(payout.participant.user.payment_method, None)
+        if not provider:
+            # Nothing to send with until the participant sets a payment method
+            ParticipantPayment.objects.filter(id=payout.id).update(
+                retry_at=datetime.datetime.utcnow() + relativedelta(minutes=PAYOUT_PAYMENT_METHOD_RETRY)
+            )
+            return False
+
+        slot_key = acquire_provider_slot(provider, token)
+        if not slot_key:
+            ParticipantPayment.objects.filter(id=payout.id).update(
+                retry_at=datetime.datetime.utcnow() + relativedelta(minutes=PAYOUT_BUSY_RETRY)
+            )
+            return False
+
+        try:
+            sent = send_payout(payout)
+        except Exception:
+            logger.exception('Payout %s failed', payout.idem_key)
+            sent = False
+
+        if sent:
+            reconcile_task_payouts([payout.source.task_id])
+            return True
+
+        # The status is re-read since the provider may have moved the payout on a different instance
+        status = ParticipantPayment.objects.filter(id=payout.id).values_list('status', flat=True).first()
+        if status == STATUS_INITIATED:
+            # Still waiting on the provider, not a failed attempt
+            ParticipantPayment.objects.filter(id=payout.id).update(
+                retry_at=datetime.datetime.utcnow() + relativedelta(minutes=PAYOUT_PENDING_RETRY)
+            )
+        elif status == STATUS_PENDING:
+            attempts = payout.attempts + 1
+            ParticipantPayment.objects.filter(id=payout.id).update(
+                attempts=attempts, retry_at=get_payout_retry_at(attempts)
+            )
+            if attempts >= PAYOUT_MAX_ATTEMPTS:
+                ParticipantPayment.objects.filter(id=payout.id, status=STATUS_PENDING).update(status=STATUS_FAILED)
+        return False
+    finally:
+        if slot_key:
+            release_lock(slot_key, token)
+        release_lock(lock_key, token)
+
+
+def send_payout(payout):
+    """
+    Sends the participant's share of the payment through their payment method.
+    Returns True once the share is on its way.
+    """
+    payment = payout.source
+    task = payment.task
+    participant = payout.participant
+    share = dict([
+        (item['participant'].id, item['share']) for item in task.get_payment_shares()
+    ]).get(participant.id, 0)
+    payment_method = participant.user.payment_method
+
+    if payout.status == STATUS_PENDING:
+        if payment_method in [PAYMENT_METHOD_BTC_ADDRESS, PAYMENT_METHOD_BTC_WALLET]:
+            if not (payout.destination and bitcoin_utils.is_valid_btc_address(payout.destination)):
+                payout.destination = participant.user.btc_address
+            transaction = send_payment_share(
+                destination=payout.destination,
+                amount=Decimal(share) * payment.btc_received,
+                idem=str(payout.idem_key),
+                description='%s - %s' % (task.summary, participant.user.display_name)
+            )
+            if transaction.status not in [
+                coinbase_utils.TRANSACTION_STATUS_FAILED, coinbase_utils.TRANSACTION_STATUS_EXPIRED,
+                coinbase_utils.TRANSACTION_STATUS_CANCELED
+            ]:
+                payout.ref = transaction.id
+                payout.btc_sent = abs(Decimal(transaction.amount.amount))
+                payout.status = STATUS_PROCESSING
+                payout.save()
+                return True
+        elif payment_method == PAYMENT_METHOD_MOBILE_MONEY:
+            share_amount = Decimal(share) * payment.btc_received
+            recipients = [
+                {
+                    bitpesa.KEY_REQUESTED_AMOUNT: float(
+                        bitcoin_utils.get_valid_btc_amount(share_amount)
+                    ),
+                    bitpesa.KEY_REQUESTED_CURRENCY: CURRENCY_BTC,
+                    bitpesa.KEY_PAYOUT_METHOD: {
+                        bitpesa.KEY_TYPE: bitpesa.get_pay_out_method(participant.user.mobile_money_cc),
+                        bitpesa.KEY_DETAILS: {
+                            bitpesa.KEY_FIRST_NAME: participant.user.first_name,
+                            bitpesa.KEY_LAST_NAME: participant.user.last_name,
+                            bitpesa.KEY_PHONE_NUMBER: participant.user.mobile_money_number
+                        }
+                    }
+                }
+            ]
+            # The idem key is the transaction's nonce, so the transaction can be found again
+            # if an attempt fails after BitPesa accepted it (e.g. on a read timeout)
+            bitpesa_nonce = str(payout.idem_key)
+            transaction = None
+            if payout.extra == bitpesa_nonce:
+                transaction = bitpesa.find_transaction(payout.id, bitpesa_nonce)
+            else:
+                # Marks the transaction as attempted before it's created
+                ParticipantPayment.objects.filter(id=payout.id).update(extra=bitpesa_nonce)
+                payout.extra = bitpesa_nonce
+            if not transaction:
+                transaction = bitpesa.create_transaction(
+                    BITPESA_SENDER, recipients, input_currency=CURRENCY_BTC,
+                    transaction_id=payout.id, nonce=bitpesa_nonce
+                )
+            if transaction:
+                payout.ref = transaction.get(bitpesa.KEY_ID, None)
+                payout.status = STATUS_INITIATED
+                payout.save()
+
+                return complete_bitpesa_payment(transaction)
+    elif payout.status == STATUS_INITIATED and payment_method == PAYMENT_METHOD_MOBILE_MONEY:
+        transaction_details = bitpesa.call_api(
+            bitpesa.get_endpoint_url('transactions/%s' % payout.ref),
+            'GET', str(uuid4()), data={}
+        )
+        transaction = transaction_details.json().get(bitpesa.KEY_OBJECT)
+        return bool(transaction and complete_bitpesa_payment(transaction))
+    return False
+
+
+def reconcile_task_payouts(task_ids):
+    """
+    Marks the payments whose participant payments have all been sent as processed
+    and the tasks whose received payments are all processed as distributed.
+    Returns the number of tasks marked as distributed.
+    """
+    payment_ids = list(TaskPayment.objects.filter(
+        task__in=task_ids, received_at__isnull=False, processed=False, participantpayment__isnull=False
+    ).exclude(
+        participantpayment__in=ParticipantPayment.objects.exclude(status__in=PAYOUT_SENT_STATUSES)
+    ).values_list('id', flat=True).distinct())
+    if payment_ids:
+        TaskPayment.objects.filter(id__in=payment_ids).update(processed=True)
+
+    distributed_task_ids = list(Task.objects.filter(
+        id__in=task_ids, paid=True, pay_distributed=False, taskpayment__received_at__isnull=False
+    ).exclude(
+        taskpayment__in=TaskPayment.objects.filter(received_at__isnull=False, processed=False)
+    ).values_list('id', flat=True).distinct())
+    if distributed_task_ids:
+        Task.objects.filter(id__in=distributed_task_ids).update(pay_distributed=True)
+    return len(distributed_task_ids)
+
+
+def complete_bitpesa_payment(transaction):
+    bp_transaction_id = transaction.get(bitpesa.KEY_ID, None)
+    metadata = transaction.get(bitpesa.KEY_METADATA, None)
+    reference = metadata.get(bitpesa.KEY_REFERENCE, None)
+    bp_idem_key = metadata.get(bitpesa.KEY_IDEM_KEY, None)
+
+    input_amount = Decimal('%s' % transaction.get(bitpesa.KEY_INPUT_AMOUNT, 0))
+    payin_methods = transaction.get(bitpesa.KEY_PAYIN_METHODS, None)
+
+    destination_address = None
+    if payin_methods:
+        out_details = payin_methods[0][bitpesa.KEY_OUT_DETAILS]
+        # Key was originally 'bitcoin_address' on first test but it appeared to have 'Address',
+        # Check both for redundancy and inquire from BitPesa on this
+        if bitpesa.KEY_BITCOIN_ADDRESS in out_details:
+            destination_address = out_details.get(bitpesa.KEY_BITCOIN_ADDRESS, None)
+        else:
+            destination_address = out_details.get("Address", None)
+        if not destination_address:
+            destination_address = payin_methods[0][bitpesa.KEY_IN_DETAILS].get(bitpesa.KEY_ADDRESS, None)
+
+    if destination_address:
+        try:
+            payment = ParticipantPayment.objects.get(
+                id=reference, ref=bp_transaction_id, extra=bp_idem_key, status=STATUS_INITIATED
+            )
+        except:
+            payment = None
+
+        if payment:
+
+            if transaction.get(bitpesa.KEY_STATE, None) == bitpesa.VALUE_CANCELED:
+                # Fail for canceled BitPesa transactions
+                if payment.status == STATUS_INITIATED:
+                    # Switch status to pending if BTC hasn't already been sent
+                    payment.status = STATUS_PENDING
+                    payment.save()
+                return False
+
+            share_amount = Decimal(
+                bitcoin_utils.get_valid_btc_amount(
+                    payment.source.btc_received * Decimal(payment.participant.payment_share)
+                )
+            )
+
+            if input_amount <= share_amount:
+                cb_transaction = send_payment_share(
+                    destination=destination_address,
+                    amount=input_amount,
+                    idem=str(payment.idem_key),
+                    description='%s - %s' % (
+                        payment.participant.task.summary, payment.participant.user.display_name
+                    )
+                )
+                if cb_transaction.status not in [
+                    coinbase_utils.TRANSACTION_STATUS_FAILED, coinbase_utils.TRANSACTION_STATUS_EXPIRED,
+                    coinbase_utils.TRANSACTION_STATUS_CANCELED
+                ]:
+                    payment.btc_sent = input_amount
+                    payment.destination = destination_address
+                    payment.ref = cb_transaction.id
+                    payment.status = STATUS_PROCESSING
+                    payment.extra = json.dumps(dict(bitpesa=bp_transaction_id))
+                    payment.save()
+                    return True
+    return False
+
+
+def send_payment_share(destination, amount, idem, description=None):
+    account = coinbase_utils.get_primary_account()
+    transaction = account.send_money(
+        to=destination,
+        amount=bitcoin_utils.get_valid_btc_amount(amount),
+        currency=CURRENCY_BTC,
+        idem=idem,
+        description=description
+    )
+    return transaction
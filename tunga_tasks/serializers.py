@@ -28,7 +28,7 @@ from tunga_utils.mixins import GetCurrentUserAnnotatedSerializerMixin
 from tunga_utils.models import Rating
 from tunga_utils.serializers import ContentTypeAnnotatedModelSerializer, SkillSerializer, \
     CreateOnlyCurrentUserDefault, SimpleUserSerializer, UploadSerializer, DetailAnnotatedModelSerializer, \
-    SimpleRatingSerializer, InvoiceUserSerializer
+    SimpleRatingSerializer, InvoiceUserSerializer, SparseFieldsetsSerializerMixin
 
 
 class SimpleProjectSerializer(ContentTypeAnnotatedModelSerializer):
@@ -210,7 +210,11 @@ class TaskInvoiceSerializer(serializers.ModelSerializer, GetCurrentUserAnnotated
         current_user = self.get_current_user()
         if current_user and current_user.is_developer:
             try:
-                participation = obj.task.participation_set.get(user=current_user)
+                viewer_context = self.context.get('viewer_context', None)
+                if viewer_context:
+                    participation = viewer_context.get_participation(obj.task)
+                else:
+                    participation = obj.task.participation_set.get(user=current_user)
                 share = obj.task.get_user_participation_share(participation.id)
                 return obj.get_amount_details(share=share)
             except:
@@ -244,8 +248,8 @@ class TaskDetailsSerializer(ContentTypeAnnotatedModelSerializer):
         fields = ('project', 'is_project', 'parent', 'amount', 'skills', 'applications', 'participation', 'participation_shares')
 
 
-class TaskSerializer(ContentTypeAnnotatedModelSerializer, DetailAnnotatedModelSerializer,
-                     GetCurrentUserAnnotatedSerializerMixin):
+class TaskSerializer(SparseFieldsetsSerializerMixin, ContentTypeAnnotatedModelSerializer,
+                     DetailAnnotatedModelSerializer, GetCurrentUserAnnotatedSerializerMixin):
     user = SimpleUserSerializer(required=False, read_only=True, default=CreateOnlyCurrentUserDefault())
     pay = serializers.DecimalField(max_digits=19, decimal_places=4, required=False, read_only=True)
     display_fee = serializers.SerializerMethodField(required=False, read_only=True)
@@ -296,6 +300,10 @@ class TaskSerializer(ContentTypeAnnotatedModelSerializer, DetailAnnotatedModelSe
             'scope': {'required': True, 'allow_blank': False, 'allow_null': False}
         }
         details_serializer = TaskDetailsSerializer
+        expandable_fields = (
+            'details', 'participation', 'milestones', 'progress_events', 'ratings', 'uploads', 'all_uploads',
+            'invoice', 'estimate', 'quote'
+        )
 
     def validate(self, attrs):
         has_parent = attrs.get('parent', None) or (self.instance and self.instance.parent)
@@ -555,6 +563,10 @@ class TaskSerializer(ContentTypeAnnotatedModelSerializer, DetailAnnotatedModelSe
             if assignee and changed_assignee:
                 Participation.objects.exclude(user__id=assignee).filter(task=task).update(assignee=False)
 
+    def get_viewer_context(self):
+        # Current user's relationship to the page of tasks being rendered (see TaskViewSet)
+        return self.context.get('viewer_context', None)
+
     def get_display_fee(self, obj):
         user = self.get_current_user()
         amount = None
@@ -571,6 +583,9 @@ class TaskSerializer(ContentTypeAnnotatedModelSerializer, DetailAnnotatedModelSe
         if user:
             if obj.user == user or not user.is_developer or user.pending or not profile_check(user):
                 return False
+            viewer_context = self.get_viewer_context()
+            if viewer_context:
+                return not viewer_context.has_applied(obj) and not viewer_context.get_participation(obj)
             return obj.applicants.filter(id=user.id).count() == 0 and \
                    obj.participation_set.filter(user=user).count() == 0
         return False
@@ -597,21 +612,31 @@ class TaskSerializer(ContentTypeAnnotatedModelSerializer, DetailAnnotatedModelSe
     def get_is_participant(self, obj):
         user = self.get_current_user()
         if user:
+            viewer_context = self.get_viewer_context()
+            if viewer_context:
+                return viewer_context.is_participant(obj)
             return obj.subtask_participants_inclusive_filter.filter((Q(accepted=True) | Q(responded=False)), user=user).count() > 0
         return False
 
     def get_is_admin(self, obj):
         user = self.get_current_user()
+        viewer_context = self.get_viewer_context()
+        if user and viewer_context:
+            return viewer_context.has_admin_access(obj)
         return obj.has_admin_access(user)
 
     def get_my_participation(self, obj):
         user = self.get_current_user()
         if user:
             try:
-                participation = obj.participation_set.get(user=user)
+                viewer_context = self.get_viewer_context()
+                if viewer_context:
+                    participation = viewer_context.get_participation(obj)
+                else:
+                    participation = obj.participation_set.get(user=user)
                 return {
                     'id': participation.id,
-                    'user': participation.user.id,
+                    'user': participation.user_id,
                     'assignee': participation.assignee,
                     'accepted': participation.accepted,
                     'responded': participation.responded
@@ -1,11 +1,15 @@
+from actstream.models import Action
 from actstream.signals import action
 from decimal import Decimal
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch.dispatcher import receiver, Signal
 
 from tunga_activity import verbs
 from tunga_messages.models import Message
 from tunga_messages.tasks import get_or_create_task_channel
+from tunga_profiles.models import Connection
+from tunga_profiles.notification_summary import invalidate_notifications, invalidate_pm_task_notifications, \
+    NOTIFICATION_TASKS
 from tunga_tasks.models import Task, Application, Participation, ProgressEvent, ProgressReport, \
     IntegrationActivity, Integration, Estimate, Quote
 from tunga_tasks.notifications import notify_new_task_application, send_new_task_application_applicant_email, \
@@ -13,8 +17,12 @@ from tunga_tasks.notifications import notify_new_task_application, send_new_task
     send_task_application_not_selected_email, notify_new_progress_report, notify_task_approved, send_estimate_status_email
 from tunga_tasks.tasks import initialize_task_progress_events, update_task_periodic_updates, \
     complete_harvest_integration
+from tunga_tasks.utils import update_task_visibility, update_connection_task_visibility, set_upload_task, \
+    create_task_action, update_task_root, set_task_progress_check, schedule_task_progress_check, \
+    set_task_stored_values, task_fields_changed
 from tunga_utils.constants import APP_INTEGRATION_PROVIDER_HARVEST, STATUS_SUBMITTED, STATUS_APPROVED, STATUS_DECLINED, \
     STATUS_ACCEPTED, STATUS_REJECTED
+from tunga_utils.models import Upload
 
 # Task
 task_approved = Signal(providing_args=["task"])
@@ -47,6 +55,37 @@ def activity_handler_new_task(sender, instance, created, **kwargs):
         initialize_task_progress_events.delay(instance.id)
 
 
+@receiver(pre_save, sender=Task)
+def activity_handler_task_progress_check(sender, instance, **kwargs):
+    # The stored row is loaded once for all the handlers that compare it with the task
+    set_task_stored_values(instance)
+    set_task_progress_check(instance)
+
+
+@receiver(post_save, sender=Task)
+def activity_handler_task_visibility(sender, instance, **kwargs):
+    # Participation and connection changes update the index from their own handlers
+    if task_fields_changed(instance, 'user_id', 'visibility'):
+        update_task_visibility(instance)
+
+
+@receiver(post_save, sender=Task)
+def activity_handler_task_root(sender, instance, created, **kwargs):
+    if not created and task_fields_changed(instance, 'parent_id'):
+        update_task_root(instance)
+
+
+@receiver(pre_save, sender=Upload)
+def activity_handler_upload_task(sender, instance, **kwargs):
+    set_upload_task(instance)
+
+
+@receiver(post_save, sender=Action)
+def activity_handler_task_action(sender, instance, created, **kwargs):
+    if created:
+        create_task_action(instance)
+
+
 @receiver(task_approved, sender=Task)
 def activity_handler_task_approved(sender, task, **kwargs):
     if task.approved and task.is_task:
@@ -111,6 +150,38 @@ def activity_handler_new_participant(sender, instance, created, **kwargs):
             update_task_periodic_updates.delay(instance.task.id)
 
 
+@receiver(post_save, sender=Participation)
+def activity_handler_participation_visibility(sender, instance, **kwargs):
+    update_task_visibility(instance.task)
+
+
+@receiver(post_delete, sender=Participation)
+def activity_handler_participation_delete_visibility(sender, instance, **kwargs):
+    try:
+        task = Task.objects.get(id=instance.task_id)
+    except Task.DoesNotExist:
+        return
+    update_task_visibility(task, remove_only=True)
+
+
+@receiver(post_save, sender=Participation)
+@receiver(post_delete, sender=Participation)
+def activity_handler_participation_progress_check(sender, instance, **kwargs):
+    try:
+        task = Task.objects.get(id=instance.task_id)
+    except Task.DoesNotExist:
+        return
+    schedule_task_progress_check(task)
+
+
+@receiver(post_save, sender=Participation)
+@receiver(post_delete, sender=Participation)
+def activity_handler_participation_shares(sender, instance, **kwargs):
+    # Only the task instance this participation was loaded with (if any) can hold stale memoized shares
+    if Participation.task.is_cached(instance):
+        instance.task.clear_participation_shares()
+
+
 @receiver(participation_response, sender=Participation)
 def activity_handler_participation_response(sender, participation, **kwargs):
     if participation.accepted or participation.responded:
@@ -224,3 +295,39 @@ def activity_handler_quote_status_changed(sender, quote, **kwargs):
     send_estimate_status_email(quote.id, estimate_type='quote')
 
 
+@receiver(post_save, sender=Connection)
+def activity_handler_connection_visibility(sender, instance, **kwargs):
+    update_connection_task_visibility(instance)
+
+
+@receiver(post_delete, sender=Connection)
+def activity_handler_connection_delete_visibility(sender, instance, **kwargs):
+    update_connection_task_visibility(instance, remove_only=True)
+
+
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+def activity_handler_task_notifications(sender, instance, **kwargs):
+    users = [instance.user_id, instance.pm_id]
+    stored_values = getattr(instance, 'stored_values', None)
+    if stored_values:
+        # A reassigned owner or PM loses the task, so their counts change too
+        users.extend([stored_values['user_id'], stored_values['pm_id']])
+    if instance.pk:
+        users.extend(instance.participation_set.values_list('user_id', flat=True))
+    invalidate_notifications(users, NOTIFICATION_TASKS)
+    invalidate_pm_task_notifications()
+
+
+@receiver(post_save, sender=Participation)
+@receiver(post_delete, sender=Participation)
+def activity_handler_participation_notifications(sender, instance, **kwargs):
+    invalidate_notifications([instance.user_id], NOTIFICATION_TASKS)
+
+
+@receiver(post_save, sender=Estimate)
+@receiver(post_delete, sender=Estimate)
+@receiver(post_save, sender=Quote)
+@receiver(post_delete, sender=Quote)
+def activity_handler_estimate_notifications(sender, instance, **kwargs):
+    invalidate_pm_task_notifications()
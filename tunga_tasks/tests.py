@@ -1,14 +1,49 @@
 import datetime
+import random
+from decimal import Decimal
 
+from actstream.models import Action
+from actstream.signals import action
+from dateutil.relativedelta import relativedelta
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.query_utils import Q
 from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django_redis import get_redis_connection
+from django_rq.queues import get_queue
 from django_rq.workers import get_worker
 from rest_framework import status
+from rest_framework.request import Request
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
-from tunga_utils.constants import USER_TYPE_DEVELOPER, USER_TYPE_PROJECT_OWNER
-from tunga_tasks.models import Task
+from tunga_utils.constants import USER_TYPE_DEVELOPER, USER_TYPE_PROJECT_OWNER, PROGRESS_EVENT_TYPE_MILESTONE, \
+    TASK_PAYMENT_METHOD_BITCOIN, VISIBILITY_MY_TEAM, VISIBILITY_DEVELOPER, PROGRESS_REPORT_STATUS_ON_SCHEDULE, \
+    PROGRESS_EVENT_TYPE_PERIODIC, UPDATE_SCHEDULE_DAILY, PAYMENT_METHOD_BTC_ADDRESS, STATUS_PROCESSING, \
+    PAYMENT_METHOD_MOBILE_MONEY, STATUS_PENDING, STATUS_INITIATED, STATUS_FAILED
+from tunga_activity import verbs
+from tunga_activity.models import ActivityReadLog
+from tunga_comments.models import Comment
+from tunga_profiles.models import Connection, UserProfile
+from tunga_tasks.filterbackends import developer_task_visibility_q_filter, ParticipationFilterBackend, \
+    ProgressEventFilterBackend, ProgressReportFilterBackend
+from tunga_tasks.models import Task, Participation, ProgressEvent, Estimate, Quote, TaskInvoice, TaskVisibility, \
+    ProgressReport, TaskAction, TaskPayment, ParticipantPayment
+from tunga_tasks import payouts
+from tunga_tasks.payouts import plan_task_payouts, dispatch_payouts, execute_payout, reconcile_task_payouts, \
+    PAYOUTS_QUEUE, PAYOUT_QUEUED_KEY, PAYOUT_PROVIDER_SLOT_KEY, PAYOUT_PROVIDER_COINBASE, PAYOUT_PROVIDER_CONCURRENCY, \
+    PAYOUT_MAX_ATTEMPTS
+from tunga_tasks.serializers import TaskSerializer
+from tunga_tasks.tasks import initialize_task_progress_events, update_task_periodic_updates
+from tunga_tasks.utils import get_task_prefetch_plan, prefetch_task_uploads, \
+    TaskViewerContext, rebuild_task_visibility, backfill_task_roots, prefetch_task_page, prefetch_participation_shares, \
+    initialize_task_read_logs, update_task_read_log_activity, get_task_activity_email_digests, \
+    TASK_ACTIVITY_CHECKPOINT_CACHE_KEY, get_periodic_update_dates
+from tunga_utils import bitpesa
+from tunga_utils.explain import explain_queryset, get_plan_text, get_plan_row_estimate, plan_removes_duplicates
+from tunga_utils.models import Rating, Upload
 
 
 class APITaskTestCase(APITestCase):
@@ -142,5 +177,698 @@ class APITaskTestCase(APITestCase):
         response = self.client.patch(url, data)
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+    def test_task_list_query_plan(self):
+        """
+        The task list endpoint takes a constant number of queries regardless of the number of tasks
+        """
+        for idx in range(2):
+            self.__create_rich_task(idx)
+        self.__count_task_list_queries()  # Warm up content type cache
+        num_queries = self.__count_task_list_queries()
+
+        for idx in range(2, 6):
+            self.__create_rich_task(idx)
+        self.assertEqual(self.__count_task_list_queries(), num_queries)
+
+    def test_task_list_viewer_context(self):
+        """
+        Permission flags for the current user are loaded once for the whole list
+        """
+        for idx in range(2):
+            self.__create_rich_task(idx)
+        self.__count_task_list_queries(user=self.developer)  # Warm up content type cache
+        num_queries = self.__count_task_list_queries(user=self.developer)
+
+        for idx in range(2, 6):
+            self.__create_rich_task(idx)
+        self.assertEqual(self.__count_task_list_queries(user=self.developer), num_queries)
+
+        for user in [self.developer, self.project_owner, self.admin]:
+            request = self.factory.get('/')
+            request.user = user
+            tasks = list(Task.objects.all())
+            without_viewer_context = TaskSerializer(tasks, many=True, context={'request': request}).data
+            with_viewer_context = TaskSerializer(
+                tasks, many=True, context={'request': request, 'viewer_context': TaskViewerContext(user, tasks)}
+            ).data
+            self.assertEqual(with_viewer_context, without_viewer_context)
+            if user == self.developer:
+                self.assertTrue(with_viewer_context[0]['is_participant'])
+                self.assertEqual(with_viewer_context[0]['my_participation']['user'], self.developer.id)
+
+    def test_task_visibility_index(self):
+        """
+        The task visibility index stays in sync with tasks, participation and connections
+        """
+        other_developer = get_user_model().objects.create_user(
+            'other_developer', 'other_developer@example.com', 'secret', **{'type': USER_TYPE_DEVELOPER})
+        team_task = Task.objects.create(
+            title='Team task', skills='Django', fee=15, user=self.project_owner, visibility=VISIBILITY_MY_TEAM
+        )
+        Task.objects.create(
+            title='Public task', skills='Django', fee=15, user=self.project_owner, visibility=VISIBILITY_DEVELOPER
+        )
+
+        def assert_index_matches(*users):
+            for user in users:
+                self.assertEqual(
+                    set(TaskVisibility.objects.filter(user=user).values_list('task_id', flat=True)),
+                    set(Task.objects.filter(developer_task_visibility_q_filter(user)).values_list('id', flat=True))
+                )
+
+        assert_index_matches(self.developer, other_developer)
+        self.assertFalse(TaskVisibility.objects.filter(user=self.developer).exists())
+
+        connection = Connection.objects.create(
+            from_user=self.project_owner, to_user=self.developer, accepted=True, responded=True
+        )
+        participation = Participation.objects.create(
+            task=team_task, user=other_developer, created_by=self.project_owner
+        )
+        assert_index_matches(self.developer, other_developer)
+        self.assertTrue(TaskVisibility.objects.filter(user=self.developer, task=team_task).exists())
+
+        connection.delete()
+        participation.delete()
+        assert_index_matches(self.developer, other_developer)
+        self.assertFalse(TaskVisibility.objects.filter(task=team_task).exclude(user=self.project_owner).exists())
+
+        Connection.objects.create(from_user=self.developer, to_user=self.project_owner, accepted=True, responded=True)
+        TaskVisibility.objects.all().delete()
+        self.assertEqual(rebuild_task_visibility(), 3)
+        assert_index_matches(self.developer, other_developer, self.project_owner)
+
+    def test_task_roots(self):
+        """
+        Denormalized task roots give the same uploads and activity as the generic relation joins
+        """
+        task = Task.objects.create(title='Task', fee=15, user=self.project_owner)
+        sub_task = Task.objects.create(title='Sub task', fee=15, user=self.project_owner, parent=task)
+        other_task = Task.objects.create(title='Other task', fee=15, user=self.project_owner)
+
+        for target in [task, sub_task, other_task]:
+            comment = Comment.objects.create(user=self.developer, body='Comment', content_object=target)
+            event = ProgressEvent.objects.create(
+                task=target, type=PROGRESS_EVENT_TYPE_MILESTONE, due_at=datetime.datetime.now(), created_by=self.admin
+            )
+            report = ProgressReport.objects.create(
+                event=event, user=self.developer, status=PROGRESS_REPORT_STATUS_ON_SCHEDULE, percentage=50,
+                accomplished='Some work'
+            )
+            for content_object in [target, comment, report]:
+                Upload.objects.create(file='uploads/upload.txt', user=self.developer, content_object=content_object)
+            action.send(self.developer, verb='updated', action_object=event, target=event)
+        Upload.objects.create(file='uploads/upload.txt', user=self.developer, content_object=self.project_owner)
+
+        def assert_roots_match(*tasks):
+            for root in tasks:
+                self.assertEqual(set(root.all_uploads), set(Upload.objects.filter(
+                    Q(tasks=root) | Q(comments__tasks=root) | Q(progress_reports__event__task=root) |
+                    Q(tasks__parent=root) | Q(comments__tasks__parent=root) |
+                    Q(progress_reports__event__task__parent=root)
+                )))
+                self.assertEqual(set(root.activity_stream), set(Action.objects.filter(
+                    Q(tasks=root) | Q(tasks__parent=root) |
+                    Q(progress_events__task=root) | Q(progress_events__task__parent=root)
+                )))
+
+        assert_roots_match(task, sub_task, other_task)
+        self.assertEqual(task.all_uploads.count(), 6)
+        self.assertEqual(len(prefetch_task_uploads([Task.objects.get(id=task.id)])[0].all_uploads), 6)
+
+        # Saves that don't change the parent read the stored task once and leave the roots alone
+        sub_task = Task.objects.get(id=sub_task.id)
+        sub_task.title = 'Sub task edit'
+        with CaptureQueriesContext(connection) as queries:
+            sub_task.save()
+        statements = [query['sql'] for query in queries.captured_queries]
+        self.assertEqual(len([
+            sql for sql in statements if sql.startswith('SELECT') and 'FROM "tunga_tasks_task" WHERE' in sql
+        ]), 1)
+        self.assertFalse([
+            sql for sql in statements if 'tunga_utils_upload' in sql or 'tunga_tasks_taskaction' in sql or
+            'tunga_tasks_taskvisibility' in sql
+        ])
+
+        sub_task.parent = other_task
+        sub_task.save()
+        assert_roots_match(task, sub_task, other_task)
+        self.assertEqual(other_task.all_uploads.count(), 6)
+
+        TaskAction.objects.all().delete()
+        Upload.objects.update(task=None, root_task=None)
+        self.assertEqual(backfill_task_roots(), (9, Action.objects.filter(task_action__isnull=False).count()))
+        assert_roots_match(task, sub_task, other_task)
+
+    def test_participation_shares(self):
+        """
+        Participation shares are computed once per task instance and recomputed after participation changes
+        """
+        task = Task.objects.create(title='Task', fee=15, user=self.project_owner)
+        other_developer = get_user_model().objects.create_user(
+            'other_developer', 'other_developer@example.com', 'secret', **{'type': USER_TYPE_DEVELOPER})
+        participation = Participation.objects.create(
+            task=task, user=self.developer, accepted=True, responded=True, share=3, created_by=self.project_owner
+        )
+        Participation.objects.create(
+            task=task, user=other_developer, accepted=True, responded=True, share=1, created_by=self.project_owner
+        )
+
+        task = Task.objects.get(id=task.id)
+        with CaptureQueriesContext(connection) as queries:
+            shares = task.get_participation_shares()
+            task.get_payment_shares()
+            task.get_user_participation_share(participation.id)
+            self.assertEqual([share_info['participant'].payment_share for share_info in shares], [
+                task.get_user_payment_share(share_info['participant'].id) for share_info in shares
+            ])
+        self.assertEqual(len(queries), 1)
+        self.assertEqual([share_info['share'] for share_info in shares], [Decimal('0.75'), Decimal('0.25')])
+
+        participation = shares[0]['participant']
+        participation.share = 1
+        participation.save()
+        self.assertEqual([share_info['share'] for share_info in task.get_participation_shares()], [
+            Decimal('0.5'), Decimal('0.5')
+        ])
+
+        tasks = [Task.objects.get(id=task.id), Task.objects.create(title='Other task', fee=15, user=self.project_owner)]
+        with CaptureQueriesContext(connection) as queries:
+            prefetch_participation_shares(tasks)
+            self.assertEqual(len(tasks[0].get_participation_shares()), 2)
+            self.assertEqual(tasks[1].get_participation_shares(), [])
+        self.assertEqual(len(queries), 1)
+
+    def test_task_sparse_fieldsets(self):
+        """
+        Only requested fields are rendered and only their prefetches are issued
+        """
+        for idx in range(3):
+            self.__create_rich_task(idx)
+
+        full_data, full_queries = self.__serialize_task_list('/')
+        sparse_data, sparse_queries = self.__serialize_task_list('/?fields=id,title,fee,deadline')
+        self.assertEqual(sparse_queries, 1)
+        self.assertLess(sparse_queries, full_queries)
+        self.assertEqual(
+            sparse_data, [dict([(key, task[key]) for key in ['id', 'title', 'fee', 'deadline']]) for task in full_data]
+        )
+
+        expanded_data, expanded_queries = self.__serialize_task_list('/?expand=details')
+        self.assertIn('details', expanded_data[0])
+        self.assertIn('can_apply', expanded_data[0])
+        self.assertNotIn('all_uploads', expanded_data[0])
+        self.assertEqual(expanded_data[0]['details'], full_data[0]['details'])
+
+    def test_task_invoice_fieldsets(self):
+        """
+        Invoices render with the developer's amount in a number of queries that doesn't grow with the page
+        """
+        self.__create_rich_task(0)
+        single_data, single_queries = self.__serialize_task_list('/?fields=id,invoice')
+        self.assertEqual(single_data[0]['invoice']['developer_amount'], single_data[0]['invoice']['amount'])
+
+        for idx in range(1, 3):
+            self.__create_rich_task(idx)
+        data, queries = self.__serialize_task_list('/?fields=id,invoice')
+        self.assertEqual(len(data), 3)
+        self.assertEqual(queries, single_queries)
+
+        select_related, prefetch_related = get_task_prefetch_plan(fields=['invoice'])
+        tasks = list(Task.objects.select_related(*select_related).prefetch_related(*prefetch_related))
+        with self.assertNumQueries(0):
+            for task in tasks:
+                self.assertEqual(task.invoice.task.get_user_participation_share(task.prefetched_participation[0].id), 1)
+
+    def __serialize_task_list(self, url):
+        request = Request(self.factory.get(url))
+        request.user = self.developer
+        context = {'request': request}
+        field_names = TaskSerializer(context=context).fields.keys()
+
+        select_related, prefetch_related = get_task_prefetch_plan(fields=field_names)
+        queryset = Task.objects.select_related(*select_related).prefetch_related(*prefetch_related).order_by('id')
+        TaskSerializer(list(queryset), many=True, context=context).data  # Warm up content type cache
+        with CaptureQueriesContext(connection) as queries:
+            tasks = list(queryset.all())
+            viewer_context = prefetch_task_page(tasks, user=self.developer, fields=field_names)
+            if viewer_context:
+                context['viewer_context'] = viewer_context
+            data = TaskSerializer(tasks, many=True, context=context).data
+        return data, len(queries)
+
+    def test_permission_filter_plans(self):
+        """
+        Participant permission filters are semi-joins, they neither repeat rows nor need DISTINCT
+        """
+        other_developers = [
+            get_user_model().objects.create_user(
+                'developer%s' % idx, 'developer%s@example.com' % idx, 'secret', **{'type': USER_TYPE_DEVELOPER}
+            ) for idx in range(3)
+        ]
+        for idx in range(3):
+            task = Task.objects.create(title='Task %s' % idx, fee=15, user=self.project_owner)
+            for user in [self.developer] + other_developers:
+                Participation.objects.create(
+                    task=task, user=user, accepted=idx != 2, responded=True, created_by=self.project_owner
+                )
+            for user in [self.developer] + other_developers:
+                event = ProgressEvent.objects.create(
+                    task=task, type=PROGRESS_EVENT_TYPE_MILESTONE, due_at=datetime.datetime.now(),
+                    created_by=self.project_owner
+                )
+                ProgressReport.objects.create(
+                    event=event, user=user, status=PROGRESS_REPORT_STATUS_ON_SCHEDULE, percentage=50
+                )
+
+        # Task owners match every row of their tasks, joining through participation repeats them per participant
+        for user in [other_developers[0], self.project_owner]:
+            for backend, queryset, owner_lookup, task_lookup in [
+                (ParticipationFilterBackend, Participation.objects.all(), 'user', 'task'),
+                (ProgressEventFilterBackend, ProgressEvent.objects.all(), 'created_by', 'task'),
+                (ProgressReportFilterBackend, ProgressReport.objects.all(), 'user', 'event__task')
+            ]:
+                request = Request(self.factory.get('/', {'filter': 'complete'}))
+                request.user = user
+                queryset = backend().filter_list_queryset(request, queryset, None)
+                ids = list(queryset.values_list('id', flat=True))
+                self.assertEqual(len(ids), len(set(ids)))
+
+                # Same rows as joining through participation and removing the duplicates
+                joined_queryset = queryset.model.objects.filter(
+                    Q(**{owner_lookup: user}) |
+                    Q(**{'%s__user' % task_lookup: user}) |
+                    (
+                        Q(**{'%s__participation__user' % task_lookup: user}) &
+                        (
+                            Q(**{'%s__participation__accepted' % task_lookup: True}) |
+                            Q(**{'%s__participation__responded' % task_lookup: False})
+                        )
+                    )
+                ).distinct()
+                self.assertEqual(sorted(ids), sorted(joined_queryset.values_list('id', flat=True)))
+                self.assertNotIn('DISTINCT', str(queryset.query))
+                self.assertFalse(plan_removes_duplicates(queryset))
+
+                # Participation is only read in a subquery, unlike the join it replaces
+                plan = explain_queryset(queryset)
+                joined_plan = explain_queryset(joined_queryset)
+                if connection.vendor == 'sqlite':
+                    self.assertIn('LIST SUBQUERY', get_plan_text(plan))
+                    self.assertNotIn('LEFT-JOIN', get_plan_text(plan))
+                    self.assertNotIn('SUBQUERY', get_plan_text(joined_plan))
+                    self.assertIn('LEFT-JOIN', get_plan_text(joined_plan))
+                else:
+                    self.assertLessEqual(get_plan_row_estimate(plan), get_plan_row_estimate(joined_plan))
+
+    def test_task_activity_emails(self):
+        """
+        Task activity emails only scan activity after the checkpoint and cover each activity once
+        """
+        cache.delete(TASK_ACTIVITY_CHECKPOINT_CACHE_KEY)
+        task = Task.objects.create(title='Task 1', fee=15, user=self.project_owner)
+        Participation.objects.create(
+            task=task, user=self.developer, accepted=True, responded=True, created_by=self.project_owner
+        )
+
+        self.assertEqual(initialize_task_read_logs(), 2)
+        self.assertEqual(initialize_task_read_logs(), 0)
+        owner_log = ActivityReadLog.objects.get(user=self.project_owner, object_id=task.id)
+        developer_log = ActivityReadLog.objects.get(user=self.developer, object_id=task.id)
+
+        for user in [self.developer, self.developer, self.project_owner]:
+            Comment.objects.create(user=user, body='Comment', content_object=task)
+        max_date = datetime.datetime.utcnow() + datetime.timedelta(minutes=1)
+        min_last_email_date = datetime.datetime.utcnow() - datetime.timedelta(hours=3)
+        self.assertEqual(update_task_read_log_activity(max_date), 3)
+        self.assertEqual(update_task_read_log_activity(max_date), 0)
+
+        digests = dict([(digest['read_log'], digest) for digest in get_task_activity_email_digests(min_last_email_date)])
+        self.assertEqual(
+            dict([(key, digest['new_activity']) for key, digest in digests.items()]),
+            {owner_log.id: 2, developer_log.id: 1}
+        )
+        for key, digest in digests.items():
+            ActivityReadLog.objects.filter(id=key).update(
+                last_email_at=datetime.datetime.utcnow() - datetime.timedelta(hours=4),
+                last_email_action=digest['last_action']
+            )
+        self.assertEqual(get_task_activity_email_digests(min_last_email_date), [])
+
+        # Only the new activity is scanned and emailed, read activity isn't
+        Comment.objects.create(user=self.developer, body='Comment', content_object=task)
+        self.assertEqual(update_task_read_log_activity(max_date), 1)
+        self.assertEqual(
+            [(digest['read_log'], digest['new_activity']) for digest in get_task_activity_email_digests(
+                min_last_email_date
+            )], [(owner_log.id, 1)]
+        )
+        ActivityReadLog.objects.filter(id=owner_log.id).update(last_read=task.activity_objects.latest('id').id)
+        self.assertEqual(get_task_activity_email_digests(min_last_email_date), [])
+
+    def test_task_progress_checks(self):
+        """
+        Tasks are only due for a progress check when their latest periodic update passes or their schedule changes
+        """
+        task = Task.objects.create(
+            title='Task 1', fee=15, user=self.project_owner, update_interval=1, update_interval_units=UPDATE_SCHEDULE_DAILY
+        )
+        self.assertIsNotNone(task.progress_check_at)
+
+        # Updates start with the participation
+        initialize_task_progress_events(task.id)
+        self.assertIsNone(Task.objects.get(id=task.id).progress_check_at)
+        Participation.objects.create(
+            task=task, user=self.developer, accepted=True, responded=True, created_by=self.project_owner,
+            activated_at=datetime.datetime.utcnow() - datetime.timedelta(days=3)
+        )
+        task = Task.objects.get(id=task.id)
+        self.assertLessEqual(task.progress_check_at, datetime.datetime.utcnow())
+
+        initialize_task_progress_events(task.id)
+        task = Task.objects.get(id=task.id)
+        latest_update = task.progressevent_set.filter(type=PROGRESS_EVENT_TYPE_PERIODIC).latest('due_at')
+        self.assertGreater(latest_update.due_at, datetime.datetime.utcnow())
+        self.assertEqual(task.progress_check_at, latest_update.due_at)
+
+        # Only changes to the schedule make the task due again
+        task.title = 'Task 1 updated'
+        task.save()
+        self.assertEqual(Task.objects.get(id=task.id).progress_check_at, latest_update.due_at)
+        task.deadline = datetime.datetime.utcnow() + datetime.timedelta(days=30)
+        task.save()
+        self.assertLessEqual(Task.objects.get(id=task.id).progress_check_at, datetime.datetime.utcnow())
+
+        task.closed = True
+        task.save()
+        self.assertIsNone(Task.objects.get(id=task.id).progress_check_at)
+
+    def test_periodic_update_dates(self):
+        """
+        The periodic update schedule matches walking the schedule one update at a time, for random schedules
+        """
+        for seed in range(200):
+            rand = random.Random(seed)
+            start_date = datetime.datetime(2017, 1, 1) + datetime.timedelta(minutes=rand.randint(0, 365 * 24 * 60))
+            delta = relativedelta(**{rand.choice(['hours', 'days', 'weeks', 'months']): rand.randint(1, 3)})
+            now = start_date + datetime.timedelta(hours=rand.randint(0, 45 * 24))
+            deadline = rand.choice([None, start_date + datetime.timedelta(hours=rand.randint(0, 60 * 24))])
+            existing_dates = [
+                start_date + datetime.timedelta(minutes=rand.randint(-2 * 24 * 60, 50 * 24 * 60))
+                for idx in range(rand.randint(0, 10))
+            ]
+
+            self.assertEqual(
+                get_periodic_update_dates(start_date, delta, now, deadline=deadline, existing_dates=existing_dates),
+                self.__walk_periodic_update_dates(start_date, delta, now, deadline, existing_dates),
+                'Schedule %s' % seed
+            )
+
+    def __walk_periodic_update_dates(self, start_date, delta, now, deadline, existing_dates):
+        # The schedule as update_task_periodic_updates used to create it, with an update count per candidate date
+        scheduled_dates = list(existing_dates)
+        new_dates = []
+        last_update_at = start_date
+        while True:
+            next_update_at = last_update_at + delta
+            if next_update_at.weekday() in [5, 6]:
+                next_update_at += relativedelta(days=7-next_update_at.weekday())
+            if not deadline or next_update_at < deadline:
+                num_updates_within_24hrs = len([
+                    due_at for due_at in scheduled_dates
+                    if next_update_at - relativedelta(hours=24) < due_at < next_update_at + relativedelta(hours=24)
+                ])
+                if num_updates_within_24hrs == 0:
+                    scheduled_dates.append(next_update_at)
+                    new_dates.append(next_update_at)
+            if next_update_at > now:
+                break
+            else:
+                last_update_at = next_update_at
+        return new_dates
+
+    def test_periodic_updates(self):
+        """
+        Missing periodic updates are created in bulk along with their activity
+        """
+        task = Task.objects.create(
+            title='Task 1', fee=15, user=self.project_owner, update_interval=1, update_interval_units=UPDATE_SCHEDULE_DAILY
+        )
+        Participation.objects.create(
+            task=task, user=self.developer, accepted=True, responded=True, created_by=self.project_owner,
+            activated_at=datetime.datetime.utcnow() - datetime.timedelta(days=60)
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            update_task_periodic_updates(task.id)
+        events = task.progressevent_set.filter(type=PROGRESS_EVENT_TYPE_PERIODIC)
+        self.assertGreater(events.count(), 10)
+        self.assertLess(len(queries), 20)
+        self.assertEqual(
+            sorted(TaskAction.objects.filter(
+                task=task, action__verb=verbs.CREATE, action__action_object_object_id__in=[
+                    str(event_id) for event_id in events.values_list('id', flat=True)
+                ]
+            ).values_list('action__action_object_object_id', flat=True)),
+            sorted([str(event_id) for event_id in events.values_list('id', flat=True)])
+        )
+
+        num_events = events.count()
+        update_task_periodic_updates(task.id)
+        self.assertEqual(events.count(), num_events)
+
+    def test_task_payouts(self):
+        """
+        Payouts are planned once, queued once per idem key, wait for provider slots and finalize the task when sent
+        """
+        task = Task.objects.create(
+            title='Task 1', fee=15, user=self.project_owner, closed=True, paid=True,
+            paid_at=datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+        )
+        participant = Participation.objects.create(
+            task=task, user=self.developer, accepted=True, responded=True, created_by=self.project_owner
+        )
+        payment = TaskPayment.objects.create(
+            task=task, btc_address='1BoatSLRHtKNngkdXEeobR76b53LETtpyT', ref='payment', btc_price=Decimal(1000),
+            btc_received=Decimal('0.015'), received_at=datetime.datetime.utcnow()
+        )
+
+        self.assertEqual(plan_task_payouts([task.id]), 1)
+        self.assertEqual(plan_task_payouts([task.id]), 0)
+        payout = ParticipantPayment.objects.get(source=payment, participant=participant)
+
+        get_queue(PAYOUTS_QUEUE).empty()
+        get_redis_connection('default').delete(PAYOUT_QUEUED_KEY % payout.idem_key)
+        self.assertEqual(dispatch_payouts(task_ids=[task.id]), 1)
+        self.assertEqual(dispatch_payouts(task_ids=[task.id]), 0)
+        self.assertEqual(get_queue(PAYOUTS_QUEUE).count, 1)
+        get_queue(PAYOUTS_QUEUE).empty()
+
+        # Payouts wait for a free slot with their provider without using up an attempt
+        UserProfile.objects.create(
+            user=self.developer, payment_method=PAYMENT_METHOD_BTC_ADDRESS,
+            btc_address='1BoatSLRHtKNngkdXEeobR76b53LETtpyT'
+        )
+        slot_keys = [
+            PAYOUT_PROVIDER_SLOT_KEY % (PAYOUT_PROVIDER_COINBASE, slot)
+            for slot in range(PAYOUT_PROVIDER_CONCURRENCY[PAYOUT_PROVIDER_COINBASE])
+        ]
+        for key in slot_keys:
+            get_redis_connection('default').set(key, 'busy')
+        try:
+            self.assertFalse(execute_payout(payout.id))
+        finally:
+            get_redis_connection('default').delete(*slot_keys)
+        payout = ParticipantPayment.objects.get(id=payout.id)
+        self.assertEqual(payout.attempts, 0)
+        self.assertGreater(payout.retry_at, datetime.datetime.utcnow())
+        self.assertEqual(dispatch_payouts(task_ids=[task.id]), 0)
+
+        self.assertEqual(reconcile_task_payouts([task.id]), 0)
+        ParticipantPayment.objects.filter(id=payout.id).update(status=STATUS_PROCESSING)
+        self.assertEqual(reconcile_task_payouts([task.id]), 1)
+        self.assertTrue(TaskPayment.objects.get(id=payment.id).processed)
+        self.assertTrue(Task.objects.get(id=task.id).pay_distributed)
+
+    def test_task_payout_retries(self):
+        """
+        Failed payouts back off until they run out of attempts, payouts initiated with a provider keep being polled
+        """
+        task = Task.objects.create(
+            title='Task 1', fee=15, user=self.project_owner, closed=True, paid=True,
+            paid_at=datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+        )
+        Participation.objects.create(
+            task=task, user=self.developer, accepted=True, responded=True, created_by=self.project_owner
+        )
+        TaskPayment.objects.create(
+            task=task, btc_address='1BoatSLRHtKNngkdXEeobR76b53LETtpyT', ref='payment', btc_price=Decimal(1000),
+            btc_received=Decimal('0.015'), received_at=datetime.datetime.utcnow()
+        )
+        UserProfile.objects.create(
+            user=self.developer, payment_method=PAYMENT_METHOD_BTC_ADDRESS,
+            btc_address='1BoatSLRHtKNngkdXEeobR76b53LETtpyT'
+        )
+        plan_task_payouts([task.id])
+        payout = ParticipantPayment.objects.get(source__task=task)
+
+        # Failed attempts back off exponentially
+        self.__send_payout(payout, lambda item: False)
+        payout = ParticipantPayment.objects.get(id=payout.id)
+        self.assertEqual(payout.status, STATUS_PENDING)
+        self.assertEqual(payout.attempts, 1)
+        first_retry_at = payout.retry_at
+        self.assertGreater(first_retry_at, datetime.datetime.utcnow())
+
+        def fail_payout(item):
+            raise Exception('Provider error')
+
+        self.__send_payout(payout, fail_payout)
+        payout = ParticipantPayment.objects.get(id=payout.id)
+        self.assertEqual(payout.attempts, 2)
+        self.assertGreater(payout.retry_at, first_retry_at)
+
+        # The last attempt fails the payout
+        ParticipantPayment.objects.filter(id=payout.id).update(attempts=PAYOUT_MAX_ATTEMPTS - 1)
+        self.__send_payout(payout, lambda item: False)
+        payout = ParticipantPayment.objects.get(id=payout.id)
+        self.assertEqual(payout.status, STATUS_FAILED)
+        self.assertEqual(payout.attempts, PAYOUT_MAX_ATTEMPTS)
+        self.assertEqual(dispatch_payouts(task_ids=[task.id]), 0)
+
+        # Payouts waiting for BitPesa's pay-in are polled without using up attempts
+        UserProfile.objects.filter(user=self.developer).update(payment_method=PAYMENT_METHOD_MOBILE_MONEY)
+        ParticipantPayment.objects.filter(id=payout.id).update(status=STATUS_INITIATED, attempts=1, retry_at=None)
+        for idx in range(PAYOUT_MAX_ATTEMPTS + 1):
+            self.__send_payout(payout, lambda item: False)
+        payout = ParticipantPayment.objects.get(id=payout.id)
+        self.assertEqual(payout.status, STATUS_INITIATED)
+        self.assertEqual(payout.attempts, 1)
+        self.assertGreater(payout.retry_at, datetime.datetime.utcnow())
+
+        # A cancelled BitPesa transaction resets the payout while it is being sent and stays reset
+        def cancel_payout(item):
+            ParticipantPayment.objects.filter(id=item.id).update(status=STATUS_PENDING)
+            return False
+
+        self.__send_payout(payout, cancel_payout)
+        payout = ParticipantPayment.objects.get(id=payout.id)
+        self.assertEqual(payout.status, STATUS_PENDING)
+        self.assertEqual(payout.attempts, 2)
+        self.assertFalse(Task.objects.get(id=task.id).pay_distributed)
+
+        # Sent payouts finalize the task
+        def complete_payout(item):
+            ParticipantPayment.objects.filter(id=item.id).update(status=STATUS_PROCESSING)
+            return True
+
+        self.assertTrue(self.__send_payout(payout, complete_payout))
+        self.assertTrue(Task.objects.get(id=task.id).pay_distributed)
+
+    def test_bitpesa_payout_retries(self):
+        """
+        Payouts wait for a payment method and BitPesa transactions created by failed attempts are not created twice
+        """
+        task = Task.objects.create(
+            title='Task 1', fee=15, user=self.project_owner, closed=True, paid=True,
+            paid_at=datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+        )
+        Participation.objects.create(
+            task=task, user=self.developer, accepted=True, responded=True, created_by=self.project_owner
+        )
+        TaskPayment.objects.create(
+            task=task, btc_address='1BoatSLRHtKNngkdXEeobR76b53LETtpyT', ref='payment', btc_price=Decimal(1000),
+            btc_received=Decimal('0.015'), received_at=datetime.datetime.utcnow()
+        )
+        UserProfile.objects.create(user=self.developer)
+        plan_task_payouts([task.id])
+        payout = ParticipantPayment.objects.get(source__task=task)
+
+        # Payouts wait for the participant's payment method without using up attempts
+        self.assertFalse(execute_payout(payout.id))
+        payout = ParticipantPayment.objects.get(id=payout.id)
+        self.assertEqual(payout.attempts, 0)
+        self.assertGreater(payout.retry_at, datetime.datetime.utcnow() + datetime.timedelta(minutes=30))
+        UserProfile.objects.filter(user=self.developer).update(payment_method=PAYMENT_METHOD_MOBILE_MONEY)
+
+        transactions = []
+
+        def create_transaction(sender, recipients, input_currency=None, transaction_id=None, nonce=None):
+            transactions.append({
+                bitpesa.KEY_ID: 'bp%s' % len(transactions),
+                bitpesa.KEY_METADATA: {bitpesa.KEY_REFERENCE: transaction_id, bitpesa.KEY_IDEM_KEY: nonce}
+            })
+            # BitPesa accepted the transaction but the response timed out
+            raise Exception('Read timed out')
+
+        def find_transaction(transaction_id, nonce):
+            for transaction in transactions:
+                metadata = transaction[bitpesa.KEY_METADATA]
+                if metadata[bitpesa.KEY_REFERENCE] == transaction_id and metadata[bitpesa.KEY_IDEM_KEY] == nonce:
+                    return transaction
+            return None
+
+        original_functions = (
+            bitpesa.create_transaction, bitpesa.find_transaction, payouts.complete_bitpesa_payment
+        )
+        bitpesa.create_transaction = create_transaction
+        bitpesa.find_transaction = find_transaction
+        payouts.complete_bitpesa_payment = lambda transaction: False
+        try:
+            self.assertFalse(execute_payout(payout.id))
+            payout = ParticipantPayment.objects.get(id=payout.id)
+            self.assertEqual(payout.status, STATUS_PENDING)
+            self.assertEqual(payout.attempts, 1)
+
+            ParticipantPayment.objects.filter(id=payout.id).update(retry_at=None)
+            self.assertFalse(execute_payout(payout.id))
+        finally:
+            bitpesa.create_transaction, bitpesa.find_transaction, payouts.complete_bitpesa_payment = \
+                original_functions
+
+        self.assertEqual(len(transactions), 1)
+        self.assertEqual(transactions[0][bitpesa.KEY_METADATA][bitpesa.KEY_IDEM_KEY], str(payout.idem_key))
+        payout = ParticipantPayment.objects.get(id=payout.id)
+        self.assertEqual(payout.status, STATUS_INITIATED)
+        self.assertEqual(payout.ref, 'bp0')
+        self.assertEqual(payout.attempts, 1)
+
+    def __send_payout(self, payout, send_payout):
+        original_send_payout = payouts.send_payout
+        payouts.send_payout = send_payout
+        try:
+            return execute_payout(payout.id)
+        finally:
+            payouts.send_payout = original_send_payout
+
+    def __create_rich_task(self, idx):
+        task = Task.objects.create(
+            title='Task %s' % idx, skills='Django, React.js', fee=15, user=self.project_owner, pm=self.admin
+        )
+        Participation.objects.create(
+            task=task, user=self.developer, accepted=True, responded=True, assignee=True, created_by=self.project_owner
+        )
+        ProgressEvent.objects.create(
+            task=task, type=PROGRESS_EVENT_TYPE_MILESTONE, due_at=datetime.datetime.now(), created_by=self.admin
+        )
+        Estimate.objects.create(task=task, user=self.admin)
+        Quote.objects.create(task=task, user=self.admin)
+        TaskInvoice.objects.create(
+            task=task, title=task.title, fee=task.fee, client=self.project_owner, developer=self.developer,
+            payment_method=TASK_PAYMENT_METHOD_BITCOIN, btc_address='1BvBMSEYstWetqTFn5Au4m4GFg7xJaNVN2'
+        )
+        Rating.objects.create(content_object=task, score=8, created_by=self.project_owner)
+        return task
+
+    def __count_task_list_queries(self, user=None):
+        self.client.force_authenticate(user=user or self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('task-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['results'])
+        if not user:
+            self.assertEqual(len(response.data['results']), Task.objects.count())
+        return len(queries)
+
     def tearDown(self):
         self.__process_jobs()
@@ -1,11 +1,34 @@
+import bisect
+import datetime
 import json
+from collections import defaultdict
 
+from actstream.models import Action
 from allauth.socialaccount.providers.github.provider import GitHubProvider
+from dateutil.relativedelta import relativedelta
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction, IntegrityError
+from django.db.models import Prefetch
+from django.db.models.aggregates import Max, Count, Avg
+from django.db.models.expressions import Case, When, Value, F
+from django.db.models.fields import IntegerField
+from django.db.models.query_utils import Q
 
+from tunga_activity import verbs
+from tunga_activity.models import ActivityReadLog
+from tunga_comments.models import Comment
+from tunga_profiles.connections import get_connected_user_ids
+from tunga_profiles.models import Connection
 from tunga_profiles.utils import get_app_integration
-from tunga_tasks.models import Integration, IntegrationMeta
-from tunga_utils.constants import APP_INTEGRATION_PROVIDER_SLACK, APP_INTEGRATION_PROVIDER_HARVEST
+from tunga_settings.slugs import TASK_ACTIVITY_UPDATE_EMAIL
+from tunga_tasks.models import Integration, IntegrationMeta, Task, Participation, Application, ProgressEvent, \
+    ProgressReport, TaskInvoice, Estimate, Quote, WorkActivity, WorkPlan, TaskAccess, TaskVisibility, TaskAction, \
+    calculate_participation_shares
+from tunga_utils.constants import APP_INTEGRATION_PROVIDER_SLACK, APP_INTEGRATION_PROVIDER_HARVEST, \
+    PROGRESS_EVENT_TYPE_MILESTONE, PROGRESS_EVENT_TYPE_SUBMIT, VISIBILITY_MY_TEAM, PROGRESS_EVENT_TYPE_PERIODIC
 from tunga_utils.helpers import clean_meta_value, get_social_token, GenericObject
+from tunga_utils.models import Upload, Rating
 
 
 def get_task_integration(task, provider):
@@ -73,3 +96,782 @@ def save_integration_tokens(user, task_id, provider):
                 token_info.pop('token_secret')
                 token_info['refresh_token'] = app_integration.token_secret
     save_task_integration_meta(task_id, provider, token_info)
+
+
+def get_user_prefetch_lookups(*user_lookups):
+    # SimpleUserSerializer reads avatar_url which falls back to the user's social accounts
+    return ['%s__socialaccount_set' % lookup for lookup in user_lookups]
+
+
+def get_task_prefetch_plan(fields=None):
+    """
+    Select and prefetch lookups needed to render tasks with TaskSerializer (and TaskDetailsSerializer)
+    in a constant number of queries regardless of the number of tasks.
+    Only the lookups needed for `fields` are included when given
+    """
+    def needs(*names):
+        return fields is None or bool(set(names) & set(fields))
+
+    select_related = []
+    prefetch_related = []
+    user_lookups = []
+
+    if needs('user'):
+        select_related.append('user__userprofile')
+        user_lookups.append('user')
+    if needs('pm', 'amount', 'display_fee', 'details'):
+        # pay_pm reads the pm
+        select_related.append('pm__userprofile')
+        if needs('pm'):
+            user_lookups.append('pm')
+    if needs('details'):
+        select_related.extend(['project__user__userprofile', 'parent__user__userprofile'])
+        user_lookups.extend(['project__user', 'parent__user'])
+
+    participation_queryset = Participation.objects.select_related('user__userprofile', 'created_by__userprofile')
+    if needs('details'):
+        prefetch_related.extend([
+            Prefetch('participation_set', queryset=participation_queryset),
+            Prefetch('application_set', queryset=Application.objects.select_related('user__userprofile'))
+        ])
+        user_lookups.extend(['participation_set__user', 'application_set__user'])
+    if needs('participation', 'assignee', 'details', 'invoice'):
+        # the invoice's developer_amount reads the participation shares
+        prefetch_related.append(
+            Prefetch(
+                'participation_set', queryset=participation_queryset.filter(Q(accepted=True) | Q(responded=False)),
+                to_attr='prefetched_participation'
+            )
+        )
+        user_lookups.extend(['prefetched_participation__user', 'prefetched_participation__created_by'])
+
+    progress_event_queryset = ProgressEvent.objects.select_related(
+        'created_by__userprofile', 'progressreport__user__userprofile'
+    )
+    if needs('progress_events'):
+        prefetch_related.append(Prefetch('progressevent_set', queryset=progress_event_queryset))
+        user_lookups.extend(['progressevent_set__created_by', 'progressevent_set__progressreport__user'])
+    if needs('milestones'):
+        prefetch_related.append(
+            Prefetch(
+                'progressevent_set',
+                queryset=progress_event_queryset.filter(
+                    type__in=[PROGRESS_EVENT_TYPE_MILESTONE, PROGRESS_EVENT_TYPE_SUBMIT]
+                ),
+                to_attr='prefetched_milestones'
+            )
+        )
+        user_lookups.extend(['prefetched_milestones__created_by', 'prefetched_milestones__progressreport__user'])
+
+    if needs('ratings'):
+        prefetch_related.append(Prefetch('ratings', queryset=Rating.objects.select_related('created_by__userprofile')))
+        user_lookups.append('ratings__created_by')
+    if needs('uploads'):
+        prefetch_related.append(Prefetch('uploads', queryset=Upload.objects.select_related('user__userprofile')))
+        user_lookups.append('uploads__user')
+
+    if needs('invoice'):
+        invoice_users = (
+            'client__userprofile__city', 'client__userprofile__btc_wallet',
+            'developer__userprofile__city', 'developer__userprofile__btc_wallet'
+        )
+        prefetch_related.extend([
+            Prefetch(
+                'taskinvoice_set',
+                queryset=TaskInvoice.objects.select_related(*invoice_users).order_by('-id', '-created_at'),
+                to_attr='prefetched_invoices'
+            ),
+            'prefetched_invoices__client__userprofile__skills',
+            'prefetched_invoices__developer__userprofile__skills'
+        ])
+
+    estimate_users = ('user__userprofile', 'moderated_by__userprofile', 'reviewed_by__userprofile')
+    if needs('estimate', 'can_return'):
+        prefetch_related.append(
+            Prefetch(
+                'estimate_set',
+                queryset=Estimate.objects.select_related(*estimate_users).order_by('-id', '-created_at'),
+                to_attr='prefetched_estimates'
+            )
+        )
+        if needs('estimate'):
+            prefetch_related.append(
+                Prefetch(
+                    'prefetched_estimates__activities',
+                    queryset=WorkActivity.objects.select_related('user__userprofile')
+                )
+            )
+            user_lookups.extend([
+                'prefetched_estimates__user', 'prefetched_estimates__moderated_by',
+                'prefetched_estimates__reviewed_by', 'prefetched_estimates__activities__user'
+            ])
+    if needs('quote', 'is_developer_ready', 'requires_estimate', 'can_apply'):
+        # is_developer_ready reads the quote status
+        prefetch_related.append(
+            Prefetch(
+                'quote_set',
+                queryset=Quote.objects.select_related(*estimate_users).order_by('-id', '-created_at'),
+                to_attr='prefetched_quotes'
+            )
+        )
+        if needs('quote'):
+            prefetch_related.extend([
+                Prefetch(
+                    'prefetched_quotes__activities', queryset=WorkActivity.objects.select_related('user__userprofile')
+                ),
+                Prefetch('prefetched_quotes__plan', queryset=WorkPlan.objects.select_related('user__userprofile'))
+            ])
+            user_lookups.extend([
+                'prefetched_quotes__user', 'prefetched_quotes__moderated_by', 'prefetched_quotes__reviewed_by',
+                'prefetched_quotes__activities__user', 'prefetched_quotes__plan__user'
+            ])
+
+    prefetch_related.extend(get_user_prefetch_lookups(*user_lookups))
+    return tuple(select_related), prefetch_related
+
+
+def prefetch_task_skills(tasks):
+    """
+    Loads skills for a batch of tasks in one query
+
+    Tagulous loads tags as soon as a task's tag manager is created,
+    so prefetch_related('skills') still costs a query per task.
+    Instead, this seeds the prefetch cache that the tag manager reads from.
+    """
+    task_skills = defaultdict(list)
+    skills_field = Task._meta.get_field('skills')
+    for task_skill in skills_field.remote_field.through.objects.filter(
+        task__in=[task.id for task in tasks]
+    ).select_related('skill').order_by('skill__name'):
+        task_skills[task_skill.task_id].append(task_skill.skill)
+
+    for task in tasks:
+        manager = Task.skills.descriptor.__get__(task)
+        skills = manager.get_queryset()
+        skills._result_cache = task_skills[task.id]
+        skills._prefetch_done = True
+        if not hasattr(task, '_prefetched_objects_cache'):
+            task._prefetched_objects_cache = {}
+        task._prefetched_objects_cache[manager.prefetch_cache_name] = skills
+    return tasks
+
+
+def prefetch_task_uploads(tasks):
+    """
+    Attaches all_uploads (task, sub task, comment and progress report uploads) to a batch of tasks in one query
+    """
+    uploads = defaultdict(list)
+    task_ids = set([task.id for task in tasks])
+    if task_ids:
+        for upload in Upload.objects.filter(Q(root_task__in=task_ids) | Q(task__in=task_ids)).select_related(
+                'user__userprofile'
+        ).prefetch_related('user__socialaccount_set'):
+            for task_id in set([upload.task_id, upload.root_task_id]) & task_ids:
+                uploads[task_id].append(upload)
+
+    for task in tasks:
+        task.prefetched_all_uploads = uploads[task.id]
+    return tasks
+
+
+def prefetch_participation_shares(tasks):
+    """
+    Memoizes participation shares for a batch of tasks,
+    accepted participation that hasn't been prefetched is loaded in one query
+    """
+    participation = defaultdict(list)
+    task_ids = [task.id for task in tasks if not hasattr(task, 'prefetched_participation')]
+    if task_ids:
+        for participant in Participation.objects.filter(
+                task__in=task_ids, accepted=True
+        ).select_related('user__userprofile'):
+            participation[participant.task_id].append(participant)
+
+    for task in tasks:
+        if hasattr(task, 'prefetched_participation'):
+            participants = [participant for participant in task.prefetched_participation if participant.accepted]
+        else:
+            participants = participation[task.id]
+        task.prefetched_participation_shares = calculate_participation_shares(task, participants)
+    return tasks
+
+
+def prefetch_user_stats(users):
+    """
+    Memoizes the task stats UserSerializer shows for a batch of users with one query per stat
+    """
+    user_ids = set([user.id for user in users])
+    if not user_ids:
+        return users
+
+    tasks_created = dict(
+        Task._default_manager.filter(user__in=user_ids).values('user').annotate(count=Count('id')).values_list(
+            'user', 'count'
+        )
+    )
+
+    completed_participation = Participation._default_manager.filter(
+        user__in=user_ids, task__closed=True, accepted=True
+    ).values('user')
+    tasks_completed = dict(completed_participation.annotate(count=Count('id')).values_list('user', 'count'))
+    satisfaction = dict(
+        completed_participation.annotate(satisfaction=Avg('task__satisfaction')).values_list('user', 'satisfaction')
+    )
+
+    ratings = Rating.objects.filter(
+        tasks__closed=True, tasks__participants__in=user_ids, tasks__participation__accepted=True
+    )
+    rating_details = defaultdict(list)
+    for user_id, criteria, avg in ratings.values('tasks__participants', 'criteria').annotate(
+        avg=Avg('score')
+    ).order_by('criteria').values_list('tasks__participants', 'criteria', 'avg'):
+        rating_details[user_id].append({'criteria': criteria, 'avg': avg})
+    rating_avg = dict(
+        ratings.values('tasks__participants').annotate(avg=Avg('score')).order_by().values_list(
+            'tasks__participants', 'avg'
+        )
+    )
+
+    for user in users:
+        user.prefetched_stats = dict(
+            tasks_created=tasks_created.get(user.id, 0),
+            tasks_completed=tasks_completed.get(user.id, 0),
+            satisfaction=satisfaction.get(user.id, None),
+            rating_details=rating_details[user.id],
+            rating_avg=rating_avg.get(user.id, None)
+        )
+    return users
+
+
+def prefetch_task_page(tasks, user=None, fields=None):
+    """
+    Batch loads what TaskSerializer needs for a page of tasks beyond get_task_prefetch_plan.
+    Returns the viewer context for the user if any of the fields need it
+    """
+    def needs(*names):
+        return fields is None or bool(set(names) & set(fields))
+
+    if needs('skills', 'details'):
+        prefetch_task_skills(tasks)
+    if needs('all_uploads'):
+        prefetch_task_uploads(tasks)
+    if needs('details', 'invoice'):
+        prefetch_participation_shares(tasks)
+    if user and user.is_authenticated() and \
+            needs('can_apply', 'is_participant', 'is_admin', 'my_participation', 'invoice'):
+        return TaskViewerContext(user, tasks)
+    return None
+
+
+class TaskViewerContext(object):
+    """
+    Current user's applications, participation and admin access for a page of tasks
+
+    Loaded once per page so TaskSerializer's permission flags are dict lookups instead of per task queries
+    """
+
+    def __init__(self, user, tasks):
+        self.user = user
+        task_ids = [task.id for task in tasks]
+
+        self.applications = set(
+            Application.objects.filter(user=user, task__in=task_ids).values_list('task_id', flat=True)
+        )
+        self.participation = dict(
+            (participation.task_id, participation)
+            for participation in Participation.objects.filter(user=user, task__in=task_ids)
+        )
+        self.active_participation = set()
+        for task_id, parent_id in Participation.objects.filter(
+            Q(task__in=task_ids) | Q(task__parent__in=task_ids), (Q(accepted=True) | Q(responded=False)),
+            user=user
+        ).values_list('task_id', 'task__parent_id'):
+            # Participation in a sub task also counts as participation in the parent task
+            self.active_participation.add(task_id)
+            if parent_id:
+                self.active_participation.add(parent_id)
+        self.admin_access = set(
+            TaskAccess.objects.filter(user=user, task__in=task_ids).values_list('task_id', flat=True)
+        )
+
+    def has_applied(self, task):
+        return task.id in self.applications
+
+    def get_participation(self, task):
+        return self.participation.get(task.id, None)
+
+    def is_participant(self, task):
+        return task.id in self.active_participation
+
+    def has_admin_access(self, task):
+        return self.user.id == task.user_id or task.id in self.admin_access
+
+
+def get_task_visibility_user_ids(task):
+    """
+    Users who can see the task regardless of VISIBILITY_DEVELOPER
+    """
+    user_ids = set([task.user_id])
+    user_ids.update(Participation.objects.filter(task=task).values_list('user_id', flat=True))
+    if task.visibility == VISIBILITY_MY_TEAM:
+        user_ids.update(get_connected_user_ids(task.user_id))
+    return user_ids
+
+
+def update_task_visibility(task, remove_only=False):
+    """
+    Syncs the task's visibility index entries.
+    remove_only is used from delete signals where adding entries could reference rows that are being deleted
+    """
+    user_ids = get_task_visibility_user_ids(task)
+    current_user_ids = set(TaskVisibility.objects.filter(task=task).values_list('user_id', flat=True))
+
+    removed_user_ids = current_user_ids - user_ids
+    if removed_user_ids:
+        TaskVisibility.objects.filter(task=task, user__in=removed_user_ids).delete()
+
+    new_user_ids = user_ids - current_user_ids
+    if new_user_ids and not remove_only:
+        try:
+            with transaction.atomic():
+                TaskVisibility.objects.bulk_create(
+                    [TaskVisibility(task=task, user_id=user_id) for user_id in new_user_ids]
+                )
+        except IntegrityError:
+            # A concurrent update already added some of the rows
+            for user_id in new_user_ids:
+                TaskVisibility.objects.get_or_create(task=task, user_id=user_id)
+
+
+def update_connection_task_visibility(connection, remove_only=False):
+    for task in Task.objects.filter(
+        user__in=[connection.from_user_id, connection.to_user_id], visibility=VISIBILITY_MY_TEAM
+    ):
+        update_task_visibility(task, remove_only=remove_only)
+
+
+def rebuild_task_visibility():
+    """
+    Rebuilds the entire task visibility index and returns the number of entries
+    """
+    task_users = defaultdict(set)
+    team_task_owners = dict()
+    for task_id, user_id, visibility in Task.objects.values_list('id', 'user_id', 'visibility'):
+        task_users[task_id].add(user_id)
+        if visibility == VISIBILITY_MY_TEAM:
+            team_task_owners[task_id] = user_id
+
+    for task_id, user_id in Participation.objects.values_list('task_id', 'user_id'):
+        task_users[task_id].add(user_id)
+
+    connections = defaultdict(set)
+    for from_user_id, to_user_id in Connection.objects.filter(accepted=True).values_list('from_user_id', 'to_user_id'):
+        connections[from_user_id].add(to_user_id)
+        connections[to_user_id].add(from_user_id)
+
+    for task_id, owner_id in team_task_owners.iteritems():
+        task_users[task_id].update(connections[owner_id])
+
+    entries = [
+        TaskVisibility(task_id=task_id, user_id=user_id)
+        for task_id, user_ids in task_users.iteritems() for user_id in user_ids
+    ]
+    with transaction.atomic():
+        TaskVisibility.objects.all().delete()
+        TaskVisibility.objects.bulk_create(entries, batch_size=200)
+    return len(entries)
+
+
+def get_periodic_update_dates(start_date, delta, now, deadline=None, existing_dates=None):
+    """
+    The periodic update dates to add to a schedule starting at start_date with updates every delta up to
+    the first one after now. Updates aren't scheduled on weekends, on or after the deadline or within 24 hours
+    of another update (existing or new).
+    """
+    scheduled_dates = sorted(existing_dates or [])
+    new_dates = []
+    min_gap = relativedelta(hours=24)
+    last_update_at = start_date
+    while True:
+        next_update_at = last_update_at + delta
+        if next_update_at.weekday() in [5, 6]:
+            # Don't schedule updates on weekends
+            next_update_at += relativedelta(days=7-next_update_at.weekday())
+        if not deadline or next_update_at < deadline:
+            idx = bisect.bisect_right(scheduled_dates, next_update_at - min_gap)
+            if idx == len(scheduled_dates) or scheduled_dates[idx] >= next_update_at + min_gap:
+                # Schedule at most one periodic update within any 24 hour period
+                bisect.insort(scheduled_dates, next_update_at)
+                new_dates.append(next_update_at)
+        if next_update_at > now:
+            break
+        last_update_at = next_update_at
+    return new_dates
+
+
+def bulk_create_progress_events(task, events):
+    """
+    Inserts unsaved progress events of the task with their create activity, bulk_create skips the signals.
+    Falls back to creating them one by one if some were created meanwhile.
+    """
+    if not events:
+        return
+    try:
+        with transaction.atomic():
+            ProgressEvent.objects.bulk_create(events, batch_size=200)
+            event_ids = ProgressEvent.objects.filter(
+                task=task, due_at__in=[event.due_at for event in events]
+            ).values_list('id', flat=True)
+
+            task_content_type = ContentType.objects.get_for_model(Task)
+            event_content_type = ContentType.objects.get_for_model(ProgressEvent)
+            last_action_id = Action.objects.order_by('-id').values_list('id', flat=True).first()
+            Action.objects.bulk_create([
+                Action(
+                    actor_content_type=ContentType.objects.get_for_model(task.user), actor_object_id=task.user_id,
+                    verb=verbs.CREATE, action_object_content_type=event_content_type, action_object_object_id=event_id,
+                    target_content_type=task_content_type, target_object_id=task.id
+                ) for event_id in event_ids
+            ], batch_size=200)
+            TaskAction.objects.bulk_create([
+                TaskAction(action_id=action_id, task_id=task.id, root_task_id=task.parent_id or task.id)
+                for action_id in Action.objects.filter(
+                    id__gt=last_action_id or 0, action_object_content_type=event_content_type,
+                    action_object_object_id__in=[str(event_id) for event_id in event_ids]
+                ).values_list('id', flat=True)
+            ], batch_size=200)
+    except IntegrityError:
+        for event in events:
+            ProgressEvent.objects.get_or_create(
+                task=task, due_at=event.due_at, defaults=dict(type=event.type, title=event.title)
+            )
+
+
+def get_object_task_ids(content_type_id, object_id):
+    """
+    (task_id, root_task_id) for a task, a comment on a task, a progress event or a progress report.
+    The root task is the task itself or its parent.
+    """
+    task_content_type = ContentType.objects.get_for_model(Task)
+    if content_type_id == task_content_type.id:
+        queryset = Task.objects.filter(id=object_id)
+    elif content_type_id == ContentType.objects.get_for_model(Comment).id:
+        queryset = Task.objects.filter(
+            id__in=Comment.objects.filter(id=object_id, content_type=task_content_type).values('object_id')
+        )
+    elif content_type_id == ContentType.objects.get_for_model(ProgressEvent).id:
+        queryset = Task.objects.filter(progressevent=object_id)
+    elif content_type_id == ContentType.objects.get_for_model(ProgressReport).id:
+        queryset = Task.objects.filter(progressevent__progressreport=object_id)
+    else:
+        return None, None
+
+    task = queryset.values_list('id', 'parent_id').first()
+    if task:
+        return task[0], task[1] or task[0]
+    return None, None
+
+
+def set_upload_task(upload):
+    upload.task_id, upload.root_task_id = get_object_task_ids(upload.content_type_id, upload.object_id)
+
+
+def create_task_action(action):
+    task_id, root_task_id = None, None
+    if action.target_content_type_id in [
+        ContentType.objects.get_for_model(Task).id, ContentType.objects.get_for_model(ProgressEvent).id
+    ]:
+        task_id, root_task_id = get_object_task_ids(action.target_content_type_id, action.target_object_id)
+    if task_id:
+        TaskAction.objects.get_or_create(action=action, defaults=dict(task_id=task_id, root_task_id=root_task_id))
+
+
+def update_task_root(task):
+    """
+    Moves the task's uploads and activity to the task's root, called after the task's parent changes
+    """
+    root_task_id = task.parent_id or task.id
+    Upload.objects.filter(task=task).exclude(root_task=root_task_id).update(root_task=root_task_id)
+    TaskAction.objects.filter(task=task).exclude(root_task=root_task_id).update(root_task=root_task_id)
+
+
+def backfill_task_roots():
+    """
+    Sets the task and root task of all existing uploads and task activity.
+    Returns the number of uploads updated and task actions created
+    """
+    task_content_type = ContentType.objects.get_for_model(Task)
+    event_content_type = ContentType.objects.get_for_model(ProgressEvent)
+
+    task_parents = dict(Task.objects.values_list('id', 'parent_id'))
+    object_tasks = {
+        task_content_type.id: dict([(task_id, task_id) for task_id in task_parents]),
+        ContentType.objects.get_for_model(Comment).id: dict(
+            Comment.objects.filter(content_type=task_content_type).values_list('id', 'object_id')
+        ),
+        event_content_type.id: dict(ProgressEvent.objects.values_list('id', 'task_id')),
+        ContentType.objects.get_for_model(ProgressReport).id: dict(
+            ProgressReport.objects.values_list('id', 'event__task_id')
+        )
+    }
+
+    def get_task_ids(content_type_id, object_id):
+        task_id = object_tasks.get(content_type_id, {}).get(object_id, None)
+        if task_id in task_parents:
+            return task_id, task_parents[task_id] or task_id
+        return None, None
+
+    upload_ids = defaultdict(list)
+    for upload_id, content_type_id, object_id, task_id, root_task_id in Upload.objects.values_list(
+        'id', 'content_type_id', 'object_id', 'task_id', 'root_task_id'
+    ):
+        task_ids = get_task_ids(content_type_id, object_id)
+        if task_ids != (task_id, root_task_id):
+            upload_ids[task_ids].append(upload_id)
+
+    num_uploads = 0
+    for (task_id, root_task_id), ids in upload_ids.iteritems():
+        for idx in range(0, len(ids), 200):
+            num_uploads += Upload.objects.filter(id__in=ids[idx:idx + 200]).update(
+                task=task_id, root_task=root_task_id
+            )
+
+    task_actions = []
+    for action_id, content_type_id, object_id in Action.objects.filter(
+        target_content_type__in=[task_content_type, event_content_type], task_action__isnull=True
+    ).values_list('id', 'target_content_type_id', 'target_object_id'):
+        try:
+            object_id = int(object_id)
+        except (TypeError, ValueError):
+            continue
+        task_id, root_task_id = get_task_ids(content_type_id, object_id)
+        if task_id:
+            task_actions.append(TaskAction(action_id=action_id, task_id=task_id, root_task_id=root_task_id))
+    TaskAction.objects.bulk_create(task_actions, batch_size=200)
+    return num_uploads, len(task_actions)
+
+
+TASK_ACTIVITY_CHECKPOINT_CACHE_KEY = 'tunga:tasks:activity_emails:checkpoint'
+TASK_ACTIVITY_EMAIL_VERBS = [verbs.COMMENT, verbs.UPLOAD]
+
+
+def initialize_task_read_logs():
+    """
+    Creates the missing read logs of the owners and participants of open tasks in bulk.
+    Returns the number of logs created.
+    """
+    task_content_type = ContentType.objects.get_for_model(Task)
+    open_task_ids = Task.objects.filter(closed=False).values('id')
+    members = set(Task.objects.filter(closed=False).values_list('user_id', 'id')) | set(
+        Participation.objects.filter(task__closed=False).values_list('user_id', 'task_id')
+    )
+    missing = members - set(ActivityReadLog.objects.filter(
+        content_type=task_content_type, object_id__in=open_task_ids
+    ).values_list('user_id', 'object_id'))
+    if not missing:
+        return 0
+
+    try:
+        with transaction.atomic():
+            ActivityReadLog.objects.bulk_create([
+                ActivityReadLog(user_id=user_id, content_type=task_content_type, object_id=task_id)
+                for user_id, task_id in missing
+            ], batch_size=200)
+    except IntegrityError:
+        # Some logs were created meanwhile (e.g by the read endpoint)
+        for user_id, task_id in missing:
+            ActivityReadLog.objects.get_or_create(user_id=user_id, content_type=task_content_type, object_id=task_id)
+    return len(missing)
+
+
+def update_task_read_log_activity(max_date, min_date=None):
+    """
+    Moves the last activity of the owners' and participants' read logs forward with the task comments and uploads
+    after the stored checkpoint up to max_date, then moves the checkpoint.
+    Only activity since the previous scan is read, so the cost follows new activity rather than the task history.
+    Returns the number of activities scanned.
+    """
+    checkpoint = cache.get(TASK_ACTIVITY_CHECKPOINT_CACHE_KEY)
+    if checkpoint is None:
+        # Logs are only ever moved to scanned activity, so the scan resumes from the latest of them
+        checkpoint = ActivityReadLog.objects.aggregate(checkpoint=Max('last_activity'))['checkpoint'] or 0
+    head = Action.objects.filter(id__gt=checkpoint, timestamp__lte=max_date).aggregate(head=Max('id'))['head']
+    if not head:
+        return 0
+
+    task_content_type = ContentType.objects.get_for_model(Task)
+    actions = Action.objects.filter(
+        target_content_type=task_content_type, verb__in=TASK_ACTIVITY_EMAIL_VERBS, id__gt=checkpoint, id__lte=head
+    )
+    if min_date:
+        actions = actions.filter(timestamp__gte=min_date)
+
+    task_actions = defaultdict(list)
+    num_actions = 0
+    for action_id, task_id, actor_id in actions.values_list('id', 'target_object_id', 'actor_object_id'):
+        task_actions[int(task_id)].append((action_id, actor_id))
+        num_actions += 1
+
+    if task_actions:
+        task_members = defaultdict(set)
+        for user_id, task_id in list(Task.objects.filter(id__in=task_actions.keys()).values_list('user_id', 'id')) + \
+                list(Participation.objects.filter(task__in=task_actions.keys()).values_list('user_id', 'task_id')):
+            task_members[task_id].add(user_id)
+
+        last_activity = dict()
+        for log_id, user_id, task_id, log_last_activity in ActivityReadLog.objects.filter(
+            content_type=task_content_type, object_id__in=task_actions.keys()
+        ).values_list('id', 'user_id', 'object_id', 'last_activity'):
+            if user_id not in task_members[task_id]:
+                continue
+            action_ids = [
+                action_id for action_id, actor_id in task_actions[task_id] if actor_id != str(user_id)
+            ]
+            if action_ids and max(action_ids) > log_last_activity:
+                last_activity[log_id] = max(action_ids)
+
+        if last_activity:
+            ActivityReadLog.objects.filter(id__in=last_activity.keys()).update(last_activity=Case(
+                *[When(id=key, then=Value(value)) for key, value in last_activity.items()],
+                output_field=IntegerField()
+            ))
+
+    cache.set(TASK_ACTIVITY_CHECKPOINT_CACHE_KEY, head, timeout=None)
+    return num_actions
+
+
+def get_task_activity_email_digests(min_last_email_date, min_date=None):
+    """
+    Finds the task read logs with activity that wasn't read or emailed yet with one query on their last activity
+    and one on the activity after their high-water mark (the later of last read and last emailed activity).
+    Returns a list of dicts with the read log id, the number of new activities and the latest included activity.
+    Logs whose activity was all covered by earlier emails have their high-water mark moved so they aren't checked again.
+    """
+    candidates = list(ActivityReadLog.objects.filter(
+        Q(last_email_at__isnull=True) | Q(last_email_at__lt=min_last_email_date),
+        content_type=ContentType.objects.get_for_model(Task), last_activity__gt=F('last_read')
+    ).filter(
+        last_activity__gt=F('last_email_action')
+    ).exclude(
+        user__userswitchsetting__setting__slug=TASK_ACTIVITY_UPDATE_EMAIL,
+        user__userswitchsetting__value=False
+    ).values_list('id', 'object_id', 'user_id', 'last_read', 'last_email_action', 'last_email_at', 'last_activity'))
+    if not candidates:
+        return []
+
+    task_actions = defaultdict(list)
+    actions = Action.objects.filter(
+        target_content_type=ContentType.objects.get_for_model(Task),
+        target_object_id__in=set([str(candidate[1]) for candidate in candidates]),
+        verb__in=TASK_ACTIVITY_EMAIL_VERBS,
+        id__gt=min([max(candidate[3], candidate[4]) for candidate in candidates]),
+        id__lte=max([candidate[6] for candidate in candidates])
+    )
+    if min_date:
+        actions = actions.filter(timestamp__gte=min_date)
+    for task_id, action_id, actor_id, timestamp in actions.values_list(
+            'target_object_id', 'id', 'actor_object_id', 'timestamp'
+    ):
+        task_actions[int(task_id)].append((action_id, actor_id, timestamp))
+
+    digests = []
+    covered = dict()
+    for log_id, task_id, user_id, last_read, last_email_action, last_email_at, last_activity in candidates:
+        high_water_mark = max(last_read, last_email_action)
+        action_ids = [
+            action_id for action_id, actor_id, timestamp in task_actions[task_id]
+            if high_water_mark < action_id <= last_activity and actor_id != str(user_id) and
+            (not last_email_at or timestamp > last_email_at)
+        ]
+        if action_ids:
+            digests.append(dict(read_log=log_id, new_activity=len(action_ids), last_action=max(action_ids)))
+        else:
+            covered[log_id] = last_activity
+
+    if covered:
+        ActivityReadLog.objects.filter(id__in=covered.keys()).update(last_email_action=Case(
+            *[When(id=key, then=Value(value)) for key, value in covered.items()],
+            output_field=IntegerField()
+        ))
+    return digests
+
+
+# Changes to these reschedule the task's progress events
+TASK_PROGRESS_FIELDS = ('deadline', 'update_interval', 'update_interval_units', 'parent_id', 'closed', 'fee', 'bid')
+
+# Periodic updates will continue to be scheduled for unclosed tasks for up to a week past their deadlines
+TASK_PROGRESS_GRACE_PERIOD = relativedelta(days=7)
+
+# Checks again after this long when the last check couldn't schedule an upcoming update
+TASK_PROGRESS_RETRY_PERIOD = relativedelta(hours=1)
+
+
+def get_task_progress_check_at(task, now=None):
+    """
+    When the task's progress events next need a check i.e when its latest periodic update is due.
+    None if only a change to the task or its participation can change them.
+    """
+    now = now or datetime.datetime.utcnow()
+    if task.closed or (task.deadline and task.deadline < now - TASK_PROGRESS_GRACE_PERIOD):
+        return None
+
+    target_task = task.parent or task
+    if not (target_task.update_interval and target_task.update_interval_units):
+        return None
+
+    latest_update_at = ProgressEvent.objects.filter(
+        Q(task=target_task) | Q(task__parent=target_task), type=PROGRESS_EVENT_TYPE_PERIODIC
+    ).aggregate(latest_date=Max('due_at'))['latest_date']
+    if latest_update_at and latest_update_at > now:
+        check_at = latest_update_at
+    elif (target_task.deadline and target_task.deadline <= now) or not Participation.objects.filter(
+        Q(task=target_task) | Q(task__parent=target_task), accepted=True, activated_at__isnull=False
+    ).exists():
+        # No more updates before the deadline or updates haven't started
+        return None
+    else:
+        check_at = now + TASK_PROGRESS_RETRY_PERIOD
+
+    if task.deadline and check_at > task.deadline + TASK_PROGRESS_GRACE_PERIOD:
+        return None
+    return check_at
+
+
+def schedule_task_progress_check(task):
+    """
+    Makes the task and its project (which holds the periodic updates of its sub-tasks) due for a progress check
+    """
+    Task.objects.filter(
+        id__in=[task_id for task_id in [task.id, task.parent_id] if task_id], closed=False
+    ).update(progress_check_at=datetime.datetime.utcnow())
+
+
+def set_task_progress_check(task):
+    """
+    Makes a new task or a task whose progress settings changed due for a progress check,
+    called before it's saved once its stored values are loaded
+    """
+    if task.closed:
+        task.progress_check_at = None
+        return
+    if task_fields_changed(task, *TASK_PROGRESS_FIELDS):
+        task.progress_check_at = datetime.datetime.utcnow()
+
+
+# Fields the task's save handlers compare with the stored row
+TASK_STORED_FIELDS = ('user_id', 'pm_id', 'visibility') + TASK_PROGRESS_FIELDS
+
+
+def set_task_stored_values(task):
+    """
+    Loads the task's stored values of TASK_STORED_FIELDS in one query, called before it's saved
+    """
+    task.stored_values = task.pk and Task.objects.filter(id=task.pk).values(*TASK_STORED_FIELDS).first() or None
+
+
+def task_fields_changed(task, *fields):
+    """
+    Whether any of the fields differs from the task's stored values, always True for new tasks
+    """
+    stored_values = getattr(task, 'stored_values', None)
+    return stored_values is None or any([stored_values[field] != getattr(task, field) for field in fields])
@@ -28,6 +28,7 @@ from tunga.settings import BITONIC_CONSUMER_KEY, BITONIC_CONSUMER_SECRET, BITONI
 from tunga_activity.filters import ActionFilter
 from tunga_activity.models import ActivityReadLog
 from tunga_activity.serializers import SimpleActivitySerializer, LastReadActivitySerializer
+from tunga_activity.utils import prefetch_activity_objects
 from tunga_profiles.models import DeveloperNumber
 from tunga_tasks import slugs
 from tunga_tasks.filterbackends import TaskFilterBackend, ApplicationFilterBackend, ParticipationFilterBackend, \
@@ -42,12 +43,15 @@ from tunga_tasks.renderers import PDFRenderer
 from tunga_tasks.serializers import TaskSerializer, ApplicationSerializer, ParticipationSerializer, \
     TimeEntrySerializer, ProjectSerializer, ProgressReportSerializer, ProgressEventSerializer, \
     IntegrationSerializer, TaskPaymentSerializer, TaskInvoiceSerializer, EstimateSerializer, QuoteSerializer
-from tunga_tasks.tasks import distribute_task_payment, generate_invoice_number, complete_bitpesa_payment
-from tunga_tasks.utils import save_integration_tokens, get_integration_token
+from tunga_tasks.payouts import complete_bitpesa_payment
+from tunga_tasks.tasks import distribute_task_payment, generate_invoice_number
+from tunga_tasks.utils import save_integration_tokens, get_integration_token, get_task_prefetch_plan, \
+    prefetch_task_page
 from tunga_utils import github, coinbase_utils, bitcoin_utils, bitpesa
 from tunga_utils.constants import TASK_PAYMENT_METHOD_BITONIC, TASK_PAYMENT_METHOD_BANK
 from tunga_utils.filterbackends import DEFAULT_FILTER_BACKENDS
 from tunga_utils.mixins import SaveUploadsMixin
+from tunga_utils.pagination import OptionalKeysetPagination
 from tunga_utils.serializers import InvoiceUserSerializer
 
 
@@ -95,6 +99,35 @@ class TaskViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
     filter_backends = DEFAULT_FILTER_BACKENDS + (TaskFilterBackend,)
     search_fields = ('title', 'description', 'skills__name')
 
+    def get_queryset(self):
+        queryset = super(TaskViewSet, self).get_queryset()
+        if self.action in ['list', 'retrieve']:
+            # Only plan reads, writes re-render the saved instance and would otherwise serve stale prefetched data
+            select_related, prefetch_related = get_task_prefetch_plan(fields=self.get_serializer_field_names())
+            queryset = queryset.select_related(*select_related).prefetch_related(*prefetch_related)
+        return queryset
+
+    def get_serializer_field_names(self):
+        # Fields left after ?fields= and ?expand= so that only their prefetches are planned
+        if not hasattr(self, '_serializer_field_names'):
+            self._serializer_field_names = self.get_serializer().fields.keys()
+        return self._serializer_field_names
+
+    def paginate_queryset(self, queryset):
+        page = super(TaskViewSet, self).paginate_queryset(queryset)
+        if page is not None and self.action == 'list':
+            self.viewer_context = prefetch_task_page(
+                page, user=self.request.user, fields=self.get_serializer_field_names()
+            )
+        return page
+
+    def get_serializer_context(self):
+        context = super(TaskViewSet, self).get_serializer_context()
+        viewer_context = getattr(self, 'viewer_context', None)
+        if viewer_context:
+            context['viewer_context'] = viewer_context
+        return context
+
     def perform_destroy(self, instance):
         instance.archived = True
         instance.archived_at = datetime.datetime.utcnow()
@@ -177,7 +210,8 @@ class TaskViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
         serializer_class=SimpleActivitySerializer,
         filter_class=None,
         filter_backends=DEFAULT_FILTER_BACKENDS,
-        search_fields=('comments__body',)
+        search_fields=('comments__body',),
+        pagination_class=OptionalKeysetPagination
     )
     def activity(self, request, pk=None):
         """
@@ -193,6 +227,7 @@ class TaskViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
         queryset = ActionFilter(request.GET, self.filter_queryset(task.activity_stream.all().order_by('-id')))
         page = self.paginate_queryset(queryset.qs)
         if page is not None:
+            prefetch_activity_objects(page, fields=['action_object'])
             serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
 
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from tunga_utils.models import ContactRequest
+from tunga_utils.models import ContactRequest, ScheduledJobRun
 
 
 class AdminAutoCreatedBy(admin.ModelAdmin):
@@ -45,3 +45,9 @@ class ContactRequestAdmin(admin.ModelAdmin):
     list_display = ('email', 'item', 'created_at')
     list_filter = ('created_at',)
     search_fields = ('email',)
+
+
+@admin.register(ScheduledJobRun)
+class ScheduledJobRunAdmin(ReadOnlyModelAdmin):
+    list_display = ('name', 'status', 'started_at', 'finished_at', 'duration')
+    list_filter = ('name', 'status', 'started_at')
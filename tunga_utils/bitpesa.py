@@ -4,10 +4,9 @@ import json
 from decimal import Decimal
 from uuid import uuid4
 
-import requests
-
 from tunga.settings import BITPESA_API_URL, BITPESA_API_SECRET, BITPESA_API_KEY
 from tunga_utils.constants import CURRENCY_BTC, COUNTRY_CODE_TANZANIA, COUNTRY_CODE_UGANDA, COUNTRY_CODE_NIGERIA
+from tunga_utils.provider_clients import PROVIDER_BITPESA, get_provider_session
 
 PAY_METHOD_UGX_MOBILE = 'UGX::Mobile'
 PAY_METHOD_TZS_MOBILE = 'TZS::Mobile'
@@ -116,7 +115,9 @@ def call_api(endpoint, method, nonce, data=None):
     }
 
     kwargs = {'json': data or {}}
-    return requests.request(method=method.lower(), url=endpoint, headers=headers, **kwargs)
+    return get_provider_session(PROVIDER_BITPESA).request(
+        method=method.lower(), url=endpoint, headers=headers, **kwargs
+    )
 
 
 def get_response_object(response):
@@ -148,6 +149,21 @@ def create_transaction(sender, recipients, input_currency=CURRENCY_BTC, transact
     return None
 
 
+def find_transaction(transaction_id, nonce):
+    """
+    Finds a transaction created with the reference and nonce among the latest transactions, canceled ones are skipped
+    """
+    r = call_api(get_endpoint_url('transactions'), 'GET', str(uuid4()), data={})
+
+    if r.status_code == 200:
+        for transaction in r.json().get(KEY_OBJECT, None) or []:
+            metadata = transaction.get(KEY_METADATA, None) or {}
+            if str(metadata.get(KEY_REFERENCE, None)) == str(transaction_id) and \
+                    metadata.get(KEY_IDEM_KEY, None) == nonce and transaction.get(KEY_STATE, None) != VALUE_CANCELED:
+                return transaction
+    return None
+
+
 def create_sender(sender):
     r = call_api(get_endpoint_url('senders'), 'POST', str(uuid4()), data={KEY_SENDER: sender})
 
@@ -4,6 +4,7 @@ from tunga.settings import COINBASE_BASE_URL, COINBASE_CLIENT_ID, COINBASE_SCOPE
     COINBASE_BASE_API_URL, COINBASE_API_KEY, COINBASE_API_SECRET
 from tunga_profiles.models import BTCWallet
 from tunga_utils.constants import BTC_WALLET_PROVIDER_COINBASE
+from tunga_utils.provider_clients import PROVIDER_COINBASE, get_provider_session, get_provider_object
 
 PAYLOAD_ID = 'id'
 
@@ -38,8 +39,25 @@ def get_token_url():
     return '%s/oauth/token' % COINBASE_BASE_URL
 
 
+def create_api_client():
+    client = Client(COINBASE_API_KEY, COINBASE_API_SECRET, base_api_uri=COINBASE_BASE_API_URL)
+    # Move the client's auth and headers to the pooled session
+    session = get_provider_session(PROVIDER_COINBASE)
+    session.auth = client.session.auth
+    session.headers.update(client.session.headers)
+    client.session = session
+    return client
+
+
 def get_api_client():
-    return Client(COINBASE_API_KEY, COINBASE_API_SECRET, base_api_uri=COINBASE_BASE_API_URL)
+    """
+    The process' Coinbase API client, it reuses its connections across calls
+    """
+    return get_provider_object(PROVIDER_COINBASE, 'client', create_api_client, timeout=None)
+
+
+def get_primary_account():
+    return get_provider_object(PROVIDER_COINBASE, 'primary_account', lambda: get_api_client().get_primary_account())
 
 
 def get_oauth_client(access_token, refresh_token, user=None):
@@ -0,0 +1,58 @@
+import re
+
+from django.db import connections
+
+EXPLAIN_PREFIXES = {
+    'sqlite': 'EXPLAIN QUERY PLAN',
+    'mysql': 'EXPLAIN',
+    'postgresql': 'EXPLAIN'
+}
+
+# How each database's plan shows a step that removes duplicate rows
+EXPLAIN_DEDUPLICATION_MARKERS = {
+    'sqlite': 'FOR DISTINCT',
+    'mysql': 'Using temporary',
+    'postgresql': 'Unique'
+}
+
+
+def explain_queryset(queryset):
+    """
+    Returns the database's plan for the queryset as a list of dicts keyed by the EXPLAIN columns.
+    MySQL plans carry row estimates in `rows`, SQLite plans describe each step in `detail`.
+    """
+    connection = connections[queryset.db]
+    sql, params = queryset.query.sql_with_params()
+    cursor = connection.cursor()
+    try:
+        cursor.execute('%s %s' % (EXPLAIN_PREFIXES[connection.vendor], sql), params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def get_plan_text(plan):
+    return '\n'.join([' '.join([unicode(value) for value in step.values()]) for step in plan])
+
+
+def get_plan_row_estimate(plan):
+    """
+    Sum of the estimated rows of each step of the plan (MySQL `rows`, PostgreSQL `rows=`),
+    None if the database doesn't estimate them (SQLite)
+    """
+    estimates = []
+    for step in plan:
+        if step.get('rows', None) is not None:
+            estimates.append(int(step['rows']))
+        else:
+            estimates.extend([int(rows) for rows in re.findall(r'rows=(\d+)', get_plan_text([step]))])
+    return estimates and sum(estimates) or None
+
+
+def plan_removes_duplicates(queryset):
+    """
+    Whether the database's plan for the queryset has a step that removes duplicate rows
+    """
+    marker = EXPLAIN_DEDUPLICATION_MARKERS[connections[queryset.db].vendor]
+    return marker in get_plan_text(explain_queryset(queryset))
@@ -1,6 +1,5 @@
-import requests
-
 from tunga.settings import HUBSPOT_API_KEY
+from tunga_utils.provider_clients import PROVIDER_HUBSPOT, get_provider_session
 
 HUBSPOT_API_BASE_URL = 'https://api.hubapi.com'
 HUBSPOT_ENDPOINT_CREATE_UPDATE_CONTACT = '/contacts/v1/contact/createOrUpdate/email/{contact_email}'
@@ -29,7 +28,7 @@ def create_hubspot_contact(email=None, **kwargs):
                 dict(property=key, value=value)
             )
 
-    r = requests.post(
+    r = get_provider_session(PROVIDER_HUBSPOT).post(
         get_authed_hubspot_endpoint_url(
             HUBSPOT_ENDPOINT_CREATE_UPDATE_CONTACT.format(contact_email=email), HUBSPOT_API_KEY
         ),
@@ -0,0 +1,129 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.aggregates import Sum
+from django.db.models.expressions import Case, When
+from django.db.models.fields import IntegerField
+from django.core.management.base import BaseCommand, CommandError
+
+from tunga_profiles.models import Skill, UserProfile
+from tunga_tasks.models import Task
+from tunga_utils.constants import USER_TYPE_DEVELOPER, USER_TYPE_PROJECT_OWNER
+from tunga_utils.skill_matching import SkillIndex, SKILL_INDEX_LOADERS, SKILL_INDEX_TASKS, SKILL_INDEX_USERS, \
+    annotate_skill_matches
+
+BENCHMARK_PREFIX = 'skillbench'
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, dest='users', default=10000)
+        parser.add_argument('--tasks', type=int, dest='tasks', default=50000)
+        parser.add_argument('--skills', type=int, dest='skills', default=300)
+        parser.add_argument('--skills-per-entity', type=int, dest='skills_per_entity', default=5)
+        parser.add_argument('--samples', type=int, dest='samples', default=20)
+
+    def handle(self, *args, **options):
+        """
+        Compares the skill matching index with the join based ORM ranking on generated data
+        and checks that both return the same top matches.
+        All generated rows are rolled back at the end.
+        """
+        # command to run: python manage.py tunga_benchmark_skill_matching
+
+        with transaction.atomic():
+            sample_skill_sets = self.create_data(options)
+
+            index_timings = dict()
+            indexes = dict()
+            for name in [SKILL_INDEX_TASKS, SKILL_INDEX_USERS]:
+                start = time.time()
+                indexes[name] = SkillIndex(SKILL_INDEX_LOADERS[name]())
+                index_timings[name] = time.time() - start
+                print "%s index: %s entities built in %.3fs" % (name, len(indexes[name]), index_timings[name])
+
+            for name, model, user_lookup, ordering in [
+                (SKILL_INDEX_TASKS, Task, 'skills', ['-created_at']),
+                (SKILL_INDEX_USERS, get_user_model(), 'userprofile__skills', ['first_name', 'last_name'])
+            ]:
+                orm_time = 0
+                index_time = 0
+                for skill_ids in sample_skill_sets:
+                    start = time.time()
+                    list(self.orm_ranking(model, user_lookup, skill_ids, ordering)[:20])
+                    orm_time += time.time() - start
+
+                    start = time.time()
+                    list(annotate_skill_matches(
+                        model.objects.all(), indexes[name].scores(skill_ids)
+                    ).order_by('-matches', *ordering)[:20])
+                    index_time += time.time() - start
+
+                    # Both rankings break ties on the newest id so they must return the same matches
+                    orm_matches = [
+                        (item.id, item.matches) for item in self.orm_ranking(model, user_lookup, skill_ids, ['-id'])[:20]
+                    ]
+                    index_matches = [(item.id, item.matches) for item in annotate_skill_matches(
+                        model.objects.all(), indexes[name].scores(skill_ids)
+                    ).order_by('-matches', '-id')[:20]]
+                    if index_matches != orm_matches:
+                        raise CommandError('%s ranking: index matches %s != orm matches %s' % (
+                            name, index_matches, orm_matches
+                        ))
+
+                print "%s ranking: orm %.1fms, index %.1fms per query, same top matches" % (
+                    name, orm_time * 1000 / len(sample_skill_sets), index_time * 1000 / len(sample_skill_sets)
+                )
+
+            transaction.set_rollback(True)
+
+    def create_data(self, options):
+        # Bulk inserts skip the skill and user signals which would otherwise queue emails for rows that are rolled back
+        Skill.objects.bulk_create([
+            Skill(name='%s-%s' % (BENCHMARK_PREFIX, idx), slug='%s-%s' % (BENCHMARK_PREFIX, idx))
+            for idx in range(options['skills'])
+        ])
+        skill_ids = list(Skill.objects.filter(name__startswith=BENCHMARK_PREFIX).values_list('id', flat=True))
+        per_entity = min(options['skills_per_entity'], len(skill_ids))
+
+        get_user_model().objects.bulk_create([
+            get_user_model()(
+                username='%s%s' % (BENCHMARK_PREFIX, idx), email='%s%s@example.com' % (BENCHMARK_PREFIX, idx),
+                type=idx and USER_TYPE_DEVELOPER or USER_TYPE_PROJECT_OWNER
+            ) for idx in range(options['users'])
+        ])
+        users = get_user_model().objects.filter(username__startswith=BENCHMARK_PREFIX)
+        user_ids = list(users.values_list('id', flat=True))
+
+        UserProfile.objects.bulk_create([UserProfile(user_id=user_id) for user_id in user_ids])
+        profile_skills = UserProfile._meta.get_field('skills').remote_field.through
+        profile_skills.objects.bulk_create([
+            profile_skills(userprofile_id=profile_id, skill_id=skill_id)
+            for profile_id in UserProfile.objects.filter(user__in=users).values_list('id', flat=True)
+            for skill_id in random.sample(skill_ids, per_entity)
+        ])
+
+        owner_id = users.get(type=USER_TYPE_PROJECT_OWNER).id
+        Task.objects.bulk_create([
+            Task(title='%s %s' % (BENCHMARK_PREFIX, idx), user_id=owner_id) for idx in range(options['tasks'])
+        ])
+        task_skills = Task._meta.get_field('skills').remote_field.through
+        task_skills.objects.bulk_create([
+            task_skills(task_id=task_id, skill_id=skill_id)
+            for task_id in Task.objects.filter(title__startswith=BENCHMARK_PREFIX).values_list('id', flat=True)
+            for skill_id in random.sample(skill_ids, per_entity)
+        ])
+
+        return [random.sample(skill_ids, per_entity) for idx in range(options['samples'])]
+
+    def orm_ranking(self, model, lookup, skill_ids, ordering):
+        return model.objects.filter(**{'%s__in' % lookup: skill_ids}).annotate(matches=Sum(
+            Case(
+                *[When(**{lookup: skill_id, 'then': 1}) for skill_id in skill_ids],
+                default=0,
+                output_field=IntegerField()
+            )
+        )).order_by('-matches', *ordering)
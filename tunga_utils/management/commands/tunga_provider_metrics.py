@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from tunga_utils.provider_clients import PROVIDER_CLIENT_SETTINGS, get_provider_metrics
+
+
+class Command(BaseCommand):
+
+    def handle(self, *args, **options):
+        """
+        Prints the request counts, error rates and latency of the payment and CRM provider APIs.
+        """
+        # command to run: python manage.py tunga_provider_metrics
+
+        for provider in sorted(PROVIDER_CLIENT_SETTINGS.keys()):
+            print provider
+            for key, value in sorted(get_provider_metrics(provider).iteritems()):
+                print "  %s: %s" % (key, value)
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tunga_comments.models import Comment
+from tunga_messages.models import Message
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true', dest='all', default=False,
+            help='Re-render every body, not only the ones rendered with other rules'
+        )
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=500)
+
+    def handle(self, *args, **options):
+        """
+        Stores the html, text and excerpt renderings of message and comment bodies.
+        Run after changing the rendering rules (and BODY_RENDER_VERSION).
+        """
+        # command to run: python manage.py tunga_render_bodies
+
+        for model in [Message, Comment]:
+            num_rendered = 0
+            ids = list(model.objects.all().order_by('id').values_list('id', flat=True))
+            for idx in range(0, len(ids), options['batch_size']):
+                with transaction.atomic():
+                    for instance in model.objects.filter(
+                            id__in=ids[idx:idx + options['batch_size']]
+                    ).only('id', 'body', 'body_render_hash'):
+                        if options['all'] or not instance.is_body_rendered:
+                            instance.render_body()
+                            model.objects.filter(id=instance.id).update(
+                                body_html=instance.body_html, body_text=instance.body_text,
+                                body_excerpt=instance.body_excerpt, body_render_hash=instance.body_render_hash
+                            )
+                            num_rendered += 1
+
+            print "%s of %s %s bodies rendered" % (num_rendered, len(ids), model._meta.verbose_name)
@@ -1,29 +1,8 @@
 from apscheduler.schedulers.blocking import BlockingScheduler
-from django.core.management import call_command
 from django.core.management.base import BaseCommand
 
-scheduler = BlockingScheduler()
-
-
-@scheduler.scheduled_job('interval', minutes=5)
-def manage_task_payments_and_progress():
-    # Distribute task payments to participants
-    call_command('tunga_distribute_task_payments')
-
-    # Update periodic task progress events
-    call_command('tunga_manage_task_progress')
-
-
-@scheduler.scheduled_job('interval', minutes=10)
-def send_message_emails():
-    # Send new message emails for conversations
-    call_command('tunga_send_message_emails')
-
-    # Send new activity emails for tasks
-    call_command('tunga_send_task_activity_emails')
-
-    # Send new message emails for customer support conversations
-    call_command('tunga_send_customer_emails')
+from tunga_utils.scheduler import SCHEDULED_JOBS, SCHEDULER_LEADER_RENEW_INTERVAL, get_scheduler_token, \
+    elect_scheduler_leader, resign_scheduler_leader, dispatch_scheduled_job
 
 
 class Command(BaseCommand):
@@ -31,7 +10,22 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         """
         Run tunga periodic (cron) tasks.
+        Any number of instances can run, only the elected leader dispatches the commands to the scheduler queue.
         """
         # command to run: python manage.py tunga_scheduler
-
-        scheduler.start()
+        # workers: python manage.py rqworker scheduler
+
+        token = get_scheduler_token()
+        scheduler = BlockingScheduler()
+
+        elect_scheduler_leader(token)
+        scheduler.add_job(
+            elect_scheduler_leader, 'interval', seconds=SCHEDULER_LEADER_RENEW_INTERVAL, args=[token]
+        )
+        for name, minutes in SCHEDULED_JOBS:
+            scheduler.add_job(dispatch_scheduled_job, 'interval', minutes=minutes, args=[name, token], id=name)
+
+        try:
+            scheduler.start()
+        finally:
+            resign_scheduler_leader(token)
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-17 02:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tunga_tasks', '0082_taskaction'),
+        ('tunga_utils', '0008_auto_20161219_0445'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='root_task',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='root_uploads', to='tunga_tasks.Task'),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='task',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='tunga_tasks.Task'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 
+import hashlib
 import re
 
 from actstream.models import Action
@@ -8,13 +9,16 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
 from django.utils.html import strip_tags
+from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 from dry_rest_permissions.generics import allow_staff_or_superuser
 
 from tunga import settings
 from tunga_utils.constants import USER_TYPE_DEVELOPER, RATING_CRITERIA_CODING, RATING_CRITERIA_COMMUNICATION, \
     RATING_CRITERIA_SPEED, MONTHS, CONTACT_REQUEST_ITEM_ONBOARDING, CONTACT_REQUEST_ITEM_PROJECT, \
-    CONTACT_REQUEST_ITEM_ONBOARDING_SPECIAL, CONTACT_REQUEST_ITEM_DO_IT_YOURSELF
+    CONTACT_REQUEST_ITEM_ONBOARDING_SPECIAL, CONTACT_REQUEST_ITEM_DO_IT_YOURSELF, STATUS_PROCESSING, STATUS_COMPLETED, \
+    STATUS_FAILED
+from tunga_utils.helpers import convert_to_text, convert_to_html
 from tunga_utils.validators import validate_year
 
 
@@ -52,6 +56,62 @@ class AbstractExperience(models.Model):
         return request.user == self.user
 
 
+# Bump when convert_to_html, convert_to_text or the excerpt change so stored renderings are recomputed
+BODY_RENDER_VERSION = 1
+
+
+def get_body_render_hash(body):
+    return hashlib.md5(('%s:%s' % (BODY_RENDER_VERSION, body or '')).encode('utf-8')).hexdigest()
+
+
+class AbstractRenderedBody(models.Model):
+    """
+    Stores the html, text and excerpt renderings of body when it's saved, so reads don't run the regexes.
+    Renderings whose hash doesn't match the body (e.g. after a queryset update) are ignored.
+    """
+    body = models.TextField()
+    body_html = models.TextField(blank=True, null=True, editable=False)
+    body_text = models.TextField(blank=True, null=True, editable=False)
+    body_excerpt = models.TextField(blank=True, null=True, editable=False)
+    body_render_hash = models.CharField(max_length=32, blank=True, null=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self.is_body_rendered:
+            self.render_body()
+        super(AbstractRenderedBody, self).save(*args, **kwargs)
+
+    def render_body(self):
+        self.body_html = convert_to_html(self.body)
+        self.body_text = convert_to_text(self.body)
+        self.body_excerpt = strip_tags(self.body)
+        self.body_render_hash = get_body_render_hash(self.body)
+
+    @property
+    def is_body_rendered(self):
+        return self.body_render_hash == get_body_render_hash(self.body)
+
+    @property
+    def excerpt(self):
+        if self.is_body_rendered:
+            return self.body_excerpt
+        return strip_tags(self.body)
+
+    @property
+    def text_body(self):
+        if self.is_body_rendered:
+            return self.body_text
+        return convert_to_text(self.body)
+
+    @property
+    def html_body(self):
+        if self.is_body_rendered:
+            return mark_safe(self.body_html)
+        return convert_to_html(self.body)
+
+
 class GenericUpload(models.Model):
     file = models.FileField(verbose_name='Upload', upload_to='uploads/%Y/%m/%d')
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, verbose_name=_('content type'))
@@ -69,6 +129,15 @@ class GenericUpload(models.Model):
 
 class Upload(GenericUpload):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # Denormalized task the upload belongs to (directly, through a comment or through a progress report)
+    # and its root i.e the task itself or its parent
+    task = models.ForeignKey(
+        'tunga_tasks.Task', on_delete=models.SET_NULL, related_name='+', blank=True, null=True, editable=False
+    )
+    root_task = models.ForeignKey(
+        'tunga_tasks.Task', on_delete=models.SET_NULL, related_name='root_uploads', blank=True, null=True,
+        editable=False
+    )
 
     activity_objects = GenericRelation(
         Action,
@@ -136,3 +205,29 @@ def generate_excerpt(source):
         return strip_tags(re.sub(r'<br\s*/>', '\n', source)).strip()
     except:
         return None
+
+
+SCHEDULED_JOB_STATUS_CHOICES = (
+    (STATUS_PROCESSING, 'Processing'),
+    (STATUS_COMPLETED, 'Completed'),
+    (STATUS_FAILED, 'Failed'),
+)
+
+
+class ScheduledJobRun(models.Model):
+    """
+    A run of a periodic command dispatched by the scheduler, see tunga_utils.scheduler
+    """
+    name = models.CharField(max_length=100)
+    status = models.CharField(max_length=20, choices=SCHEDULED_JOB_STATUS_CHOICES, default=STATUS_PROCESSING)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    duration = models.FloatField(blank=True, null=True, help_text='Seconds')
+    error = models.TextField(blank=True, null=True)
+
+    def __unicode__(self):
+        return '%s on %s - %s' % (self.name, self.started_at, self.get_status_display())
+
+    class Meta:
+        ordering = ['-started_at']
+        index_together = [('name', 'started_at')]
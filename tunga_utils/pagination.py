@@ -1,4 +1,7 @@
-from rest_framework.pagination import PageNumberPagination
+from collections import OrderedDict
+
+from rest_framework.pagination import PageNumberPagination, CursorPagination, _positive_int
+from rest_framework.response import Response
 
 
 class DefaultPagination(PageNumberPagination):
@@ -12,3 +15,98 @@ class LargeResultsSetPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 1000
 
+
+class KeysetPagination(CursorPagination):
+    """
+    Keyset (cursor) pagination.
+
+    Pages are fetched with a range filter on the ordering instead of COUNT(*) and OFFSET,
+    so each page costs the same regardless of how deep it is.
+    Views can override the ordering with a `keyset_ordering` attribute.
+    A bounded count of up to `max_count` rows is included when `?count=1` is passed.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = '-id'
+    count_query_param = 'count'
+    max_count = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.approximate_count = None
+        if request.query_params.get(self.count_query_param, None):
+            self.approximate_count = queryset.order_by()[:self.max_count].count()
+        return super(KeysetPagination, self).paginate_queryset(queryset, request, view=view)
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param], strict=True, cutoff=self.max_page_size
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'keyset_ordering', None)
+        if ordering:
+            if isinstance(ordering, basestring):
+                return (ordering,)
+            return tuple(ordering)
+        return super(KeysetPagination, self).get_ordering(request, queryset, view)
+
+    def get_paginated_response(self, data):
+        response_data = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link())
+        ])
+        if self.approximate_count is not None:
+            response_data['count'] = self.approximate_count
+            response_data['count_is_capped'] = self.approximate_count >= self.max_count
+        response_data['results'] = data
+        return Response(response_data)
+
+
+class OptionalKeysetPagination(DefaultPagination):
+    """
+    Page number pagination unless the client opts into keyset pagination
+    with `?pagination=keyset` (or by following a keyset `cursor` link)
+    """
+    pagination_query_param = 'pagination'
+    keyset_pagination_class = KeysetPagination
+
+    def __init__(self):
+        self.keyset_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get(self.pagination_query_param, None) == 'keyset' or \
+                self.keyset_pagination_class.cursor_query_param in request.query_params:
+            self.keyset_paginator = self.keyset_pagination_class()
+            return self.keyset_paginator.paginate_queryset(queryset, request, view=view)
+        return super(OptionalKeysetPagination, self).paginate_queryset(queryset, request, view=view)
+
+    def get_paginated_response(self, data):
+        if self.keyset_paginator:
+            return self.keyset_paginator.get_paginated_response(data)
+        return super(OptionalKeysetPagination, self).get_paginated_response(data)
+
+    def get_html_context(self):
+        if self.keyset_paginator:
+            return self.keyset_paginator.get_html_context()
+        return super(OptionalKeysetPagination, self).get_html_context()
+
+    def to_html(self):
+        if self.keyset_paginator:
+            return self.keyset_paginator.to_html()
+        return super(OptionalKeysetPagination, self).to_html()
+
+    @property
+    def display_page_controls(self):
+        if self.keyset_paginator:
+            return self.keyset_paginator.display_page_controls
+        return getattr(self, '_display_page_controls', False)
+
+    @display_page_controls.setter
+    def display_page_controls(self, value):
+        self._display_page_controls = value
@@ -0,0 +1,116 @@
+import os
+import time
+
+import requests
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from requests.adapters import HTTPAdapter
+
+PROVIDER_COINBASE = 'coinbase'
+PROVIDER_BITPESA = 'bitpesa'
+PROVIDER_HUBSPOT = 'hubspot'
+
+PROVIDER_METRICS_KEY = 'tunga:providers:metrics:%s'
+
+# Pool size bounds the connections kept alive per host, timeouts are (connect, read) in seconds
+PROVIDER_CLIENT_SETTINGS = {
+    PROVIDER_COINBASE: dict(pool_size=10, timeout=(5, 30)),
+    PROVIDER_BITPESA: dict(pool_size=10, timeout=(5, 30)),
+    PROVIDER_HUBSPOT: dict(pool_size=4, timeout=(5, 15)),
+}
+
+DEFAULT_PROVIDER_CLIENT_SETTINGS = dict(pool_size=4, timeout=(5, 30))
+
+# Provider objects (e.g accounts) that rarely change are reused for this long
+PROVIDER_CACHE_TIMEOUT = 5 * 60
+
+_registry = dict(pid=None, sessions=dict(), objects=dict())
+
+
+class ProviderSession(requests.Session):
+    """
+    A keep-alive session for a provider's API with default timeouts and latency and error metrics
+    """
+
+    def __init__(self, provider):
+        super(ProviderSession, self).__init__()
+        self.provider = provider
+        settings = PROVIDER_CLIENT_SETTINGS.get(provider, DEFAULT_PROVIDER_CLIENT_SETTINGS)
+        self.timeout = settings['timeout']
+        adapter = HTTPAdapter(pool_connections=settings['pool_size'], pool_maxsize=settings['pool_size'])
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        started_at = time.time()
+        error = True
+        try:
+            response = super(ProviderSession, self).request(method, url, **kwargs)
+            error = response.status_code >= 500
+            return response
+        finally:
+            record_provider_request(self.provider, started_at, error=error)
+
+
+def _get_registry():
+    # Forked processes (e.g RQ work horses) don't share the parent's connections
+    if _registry['pid'] != os.getpid():
+        _registry.update(pid=os.getpid(), sessions=dict(), objects=dict())
+    return _registry
+
+
+def get_provider_session(provider):
+    """
+    The process' pooled session for the provider
+    """
+    sessions = _get_registry()['sessions']
+    if provider not in sessions:
+        sessions[provider] = ProviderSession(provider)
+    return sessions[provider]
+
+
+def get_provider_object(provider, key, loader, timeout=PROVIDER_CACHE_TIMEOUT):
+    """
+    Returns a cached provider object, loader is only called when the cached one is missing or expired.
+    Objects cached with a None timeout are kept for the life of the process.
+    """
+    objects = _get_registry()['objects']
+    cached = objects.get((provider, key), None)
+    if cached and (timeout is None or time.time() - cached[1] < timeout):
+        return cached[0]
+    value = loader()
+    objects[(provider, key)] = (value, time.time())
+    return value
+
+
+def clear_provider_object(provider, key):
+    _get_registry()['objects'].pop((provider, key), None)
+
+
+def record_provider_request(provider, started_at, error=False):
+    try:
+        pipeline = get_redis_connection('default').pipeline(transaction=False)
+        key = PROVIDER_METRICS_KEY % provider
+        pipeline.hincrby(key, 'request_count', 1)
+        pipeline.hincrbyfloat(key, 'request_total_ms', (time.time() - started_at) * 1000)
+        if error:
+            pipeline.hincrby(key, 'error_count', 1)
+        pipeline.execute()
+    except RedisError:
+        # Metrics are best effort
+        pass
+
+
+def get_provider_metrics(provider):
+    """
+    Request count, error count and average latency of the provider's API calls
+    """
+    metrics = dict([
+        (key, float(value)) for key, value in
+        get_redis_connection('default').hgetall(PROVIDER_METRICS_KEY % provider).iteritems()
+    ])
+    request_count = metrics.get('request_count', 0)
+    metrics['request_avg_ms'] = request_count and metrics.get('request_total_ms', 0) / request_count or 0
+    metrics['error_rate'] = request_count and metrics.get('error_count', 0) / request_count or 0
+    return metrics
@@ -0,0 +1,127 @@
+import datetime
+import logging
+import time
+import traceback
+import uuid
+
+from django.core.management import call_command
+from django_redis import get_redis_connection
+from django_rq.decorators import job
+
+from tunga_utils.constants import STATUS_COMPLETED, STATUS_FAILED
+from tunga_utils.models import ScheduledJobRun
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_QUEUE = 'scheduler'
+
+SCHEDULER_LEADER_KEY = 'tunga:scheduler:leader'
+SCHEDULED_JOB_LOCK_KEY = 'tunga:scheduler:lock:%s'
+SCHEDULED_JOB_PENDING_KEY = 'tunga:scheduler:pending:%s'
+
+# The leader renews its lease well within the timeout, another instance takes over once a lease expires
+SCHEDULER_LEADER_TIMEOUT = 60
+SCHEDULER_LEADER_RENEW_INTERVAL = 20
+
+# RQ kills runs after this long so the non-overlap lock never outlives its run
+SCHEDULED_JOB_TIMEOUT = 30 * 60
+
+# Each command runs as its own job, a slow command doesn't delay the others
+SCHEDULED_JOBS = (
+    # (command, interval in minutes)
+    ('tunga_distribute_task_payments', 5),  # Distribute task payments to participants
+    ('tunga_manage_task_progress', 5),  # Update periodic task progress events
+    ('tunga_send_message_emails', 10),  # Send new message emails for conversations
+    ('tunga_send_task_activity_emails', 10),  # Send new activity emails for tasks
+    ('tunga_send_customer_emails', 10),  # Send new message emails for customer support conversations
+    ('tunga_ingest_slack_replies', 5),  # Ingest Slack customer replies left queued
+)
+
+# Expire or delete a lock only if it's still held with the given token
+RENEW_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def acquire_lock(key, token, timeout):
+    return bool(get_redis_connection('default').set(key, token, ex=timeout, nx=True))
+
+
+def renew_lock(key, token, timeout):
+    return bool(get_redis_connection('default').eval(RENEW_LOCK_SCRIPT, 1, key, token, timeout))
+
+
+def release_lock(key, token):
+    return bool(get_redis_connection('default').eval(RELEASE_LOCK_SCRIPT, 1, key, token))
+
+
+def get_scheduler_token():
+    return uuid.uuid4().hex
+
+
+def elect_scheduler_leader(token):
+    """
+    Renews the instance's leadership or takes it over if no instance holds it.
+    Returns True if the instance leads.
+    """
+    return renew_lock(SCHEDULER_LEADER_KEY, token, SCHEDULER_LEADER_TIMEOUT) or \
+        acquire_lock(SCHEDULER_LEADER_KEY, token, SCHEDULER_LEADER_TIMEOUT)
+
+
+def resign_scheduler_leader(token):
+    release_lock(SCHEDULER_LEADER_KEY, token)
+
+
+def dispatch_scheduled_job(name, token):
+    """
+    Enqueues a run of the command if the instance leads and no run of it is waiting in the queue.
+    Returns True if a run was enqueued.
+    """
+    if get_redis_connection('default').get(SCHEDULER_LEADER_KEY) != token:
+        return False
+    if not acquire_lock(SCHEDULED_JOB_PENDING_KEY % name, token, SCHEDULED_JOB_TIMEOUT):
+        # e.g the workers are down or busy, don't pile up runs
+        return False
+    run_scheduled_job.delay(name)
+    return True
+
+
+@job(SCHEDULER_QUEUE, timeout=SCHEDULED_JOB_TIMEOUT)
+def run_scheduled_job(name):
+    """
+    Runs the command unless a run of it is still in progress and records the run.
+    Failures are recorded and re-raised so they also land in RQ's failed queue.
+    """
+    get_redis_connection('default').delete(SCHEDULED_JOB_PENDING_KEY % name)
+
+    token = get_scheduler_token()
+    lock_key = SCHEDULED_JOB_LOCK_KEY % name
+    if not acquire_lock(lock_key, token, SCHEDULED_JOB_TIMEOUT):
+        logger.info('Skipped %s, the previous run is still in progress', name)
+        return False
+
+    run = ScheduledJobRun.objects.create(name=name)
+    started_at = time.time()
+    try:
+        call_command(name)
+        run.status = STATUS_COMPLETED
+    except Exception:
+        run.status = STATUS_FAILED
+        run.error = traceback.format_exc()
+        raise
+    finally:
+        run.finished_at = datetime.datetime.utcnow()
+        run.duration = time.time() - started_at
+        run.save()
+        release_lock(lock_key, token)
+    return True
@@ -3,6 +3,7 @@ from django.contrib.contenttypes.models import ContentType
 from django_countries.serializer_fields import CountryField
 from rest_framework import serializers
 from rest_framework.fields import SkipField
+from rest_framework.permissions import SAFE_METHODS
 
 from tunga_profiles.models import Skill, City, UserProfile, Education, Work, Connection, BTCWallet
 from tunga_profiles.utils import profile_check
@@ -25,6 +26,50 @@ class CreateOnlyCurrentUserDefault(serializers.CurrentUserDefault):
         return None
 
 
+class SparseFieldsetsSerializerMixin(object):
+    """
+    Lets clients choose the fields to render on reads.
+    `?fields=a,b` renders only those fields (plus any in `?expand=`).
+    `?expand=c,d` on its own renders all fields except the Meta.expandable_fields that are not listed.
+    Fields that are left out are dropped from the serializer and never computed.
+    """
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+
+    def get_fields(self):
+        fields = super(SparseFieldsetsSerializerMixin, self).get_fields()
+        field_names = self.get_sparse_field_names(fields.keys())
+        if field_names is not None:
+            for name in fields.keys():
+                if name not in field_names:
+                    fields.pop(name)
+        return fields
+
+    def get_sparse_field_names(self, all_field_names):
+        # Only the top level serializer (or list item serializer) of a read is sparse
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        request = self.context.get('request', None)
+        if parent is not None or request is None or request.method not in SAFE_METHODS:
+            return None
+
+        query_params = getattr(request, 'query_params', request.GET)
+        fields = self.split_query_param(query_params.get(self.fields_query_param, None))
+        expand = self.split_query_param(query_params.get(self.expand_query_param, None))
+        if fields is None and expand is None:
+            return None
+        if fields is None:
+            expandable_fields = getattr(self.Meta, 'expandable_fields', ())
+            fields = [name for name in all_field_names if name not in expandable_fields]
+        return set(fields) | set(expand or [])
+
+    def split_query_param(self, value):
+        if value is None:
+            return None
+        return [name.strip() for name in value.split(',') if name.strip()]
+
+
 class ContentTypeAnnotatedModelSerializer(serializers.ModelSerializer):
     content_type = serializers.SerializerMethodField(read_only=True, required=False)
 
@@ -1,13 +1,15 @@
 from actstream.signals import action
 from django.contrib.admin.options import get_content_type_for_model
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch.dispatcher import receiver
 
 from tunga_activity import verbs
 from tunga_messages.models import Channel
+from tunga_profiles.models import UserProfile
 from tunga_tasks.models import Task
 from tunga_utils.emails import send_contact_request_email
 from tunga_utils.models import ContactRequest, Upload
+from tunga_utils.skill_matching import update_skill_index, SKILL_INDEX_TASKS, SKILL_INDEX_USERS
 
 
 @receiver(post_save, sender=ContactRequest)
@@ -21,3 +23,25 @@ def activity_handler_new_upload(sender, instance, created, **kwargs):
     t = get_content_type_for_model(Task)
     if created and instance.content_type in [get_content_type_for_model(Channel), get_content_type_for_model(Task)]:
         action.send(instance.user, verb=verbs.UPLOAD, action_object=instance, target=instance.content_object)
+
+
+@receiver(m2m_changed, sender=Task.skills.through)
+@receiver(m2m_changed, sender=UserProfile.skills.through)
+def activity_handler_skills_changed(sender, instance, action, reverse, **kwargs):
+    if action in ['post_add', 'post_remove', 'post_clear']:
+        name = sender == Task.skills.through and SKILL_INDEX_TASKS or SKILL_INDEX_USERS
+        if reverse:
+            # Changed from the skill's side, a clear doesn't say which entities it affected
+            update_skill_index(name)
+        else:
+            update_skill_index(name, [name == SKILL_INDEX_TASKS and instance.id or instance.user_id])
+
+
+@receiver(post_delete, sender=Task)
+def activity_handler_task_skills_deleted(sender, instance, **kwargs):
+    update_skill_index(SKILL_INDEX_TASKS, [instance.id])
+
+
+@receiver(post_delete, sender=UserProfile)
+def activity_handler_user_skills_deleted(sender, instance, **kwargs):
+    update_skill_index(SKILL_INDEX_USERS, [instance.user_id])
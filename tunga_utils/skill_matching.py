@@ -0,0 +1,233 @@
+import heapq
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models.expressions import Case, When, Value
+from django.db.models.fields import IntegerField
+from django_redis import get_redis_connection
+
+from tunga_profiles.models import UserProfile
+from tunga_tasks.models import Task
+
+SKILL_INDEX_TASKS = 'tasks'
+SKILL_INDEX_USERS = 'users'
+
+SKILL_INDEX_VERSION_KEY = 'tunga:skill_index:%s:version'
+SKILL_INDEX_CHANGES_KEY = 'tunga:skill_index:%s:changes'
+
+# Change entry that makes every process rebuild its index
+SKILL_INDEX_RESET = 'reset'
+
+# Changes kept for processes to catch up with, processes further behind rebuild their index
+SKILL_INDEX_MAX_CHANGES = 10000
+
+# Maximum number of matches passed back to the database as ids.
+# Each id is a query parameter and excluding unmatched entities repeats the CASE in the WHERE clause,
+# so this keeps the query well under sqlite's limit of 999 parameters
+SKILL_MATCH_LIMIT = 300
+
+# Bumps the version and logs the changed entities at that version in one step,
+# so readers never see a version without its changes
+RECORD_SKILL_INDEX_CHANGES_SCRIPT = """
+local version = redis.call('incr', KEYS[1])
+for i, entity_id in ipairs(ARGV) do
+    if i > 1 then
+        redis.call('zadd', KEYS[2], version, entity_id)
+    end
+end
+redis.call('zremrangebyscore', KEYS[2], '-inf', version - tonumber(ARGV[1]))
+return version
+"""
+
+_skill_indexes = dict()
+
+
+class SkillIndex(object):
+    """
+    Inverted index of skill ids to entity (task or user) ids plus each entity's skill vector.
+    Overlap scores are computed by walking the posting lists of the requested skills,
+    so the cost depends on how many entities share those skills rather than on a SQL join fan-out.
+    """
+
+    def __init__(self, entity_skills=None):
+        self.skill_entities = defaultdict(set)
+        self.entity_skills = defaultdict(set)
+        for entity_id, skill_id in entity_skills or []:
+            self.add(entity_id, skill_id)
+
+    def __len__(self):
+        return len(self.entity_skills)
+
+    def add(self, entity_id, skill_id):
+        self.skill_entities[skill_id].add(entity_id)
+        self.entity_skills[entity_id].add(skill_id)
+
+    def remove(self, entity_id):
+        for skill_id in self.entity_skills.pop(entity_id, ()):
+            self.skill_entities[skill_id].discard(entity_id)
+
+    def get_skill_ids(self, entity_id):
+        return frozenset(self.entity_skills.get(entity_id, ()))
+
+    def scores(self, skill_ids, entity_ids=None):
+        """
+        Number of shared skills for every entity that has at least one of the skills
+        """
+        scores = defaultdict(int)
+        for skill_id in set(skill_ids):
+            for entity_id in self.skill_entities.get(skill_id, ()):
+                scores[entity_id] += 1
+        if entity_ids is not None:
+            entity_ids = set(entity_ids)
+            return dict([(entity_id, score) for entity_id, score in scores.iteritems() if entity_id in entity_ids])
+        return dict(scores)
+
+    def top(self, skill_ids, limit, entity_ids=None):
+        """
+        Top matches as (entity_id, score) tuples, ties go to the higher (newer) id
+        """
+        return get_top_scores(self.scores(skill_ids, entity_ids=entity_ids), limit)
+
+
+def get_score_key(item):
+    return -item[1], -item[0]
+
+
+def get_top_scores(scores, limit):
+    return heapq.nsmallest(limit, scores.iteritems(), key=get_score_key)
+
+
+def get_queryset_top_scores(queryset, scores, limit):
+    """
+    Top matches of the entities in the queryset as (entity_id, score) tuples.
+    Matches are checked against the queryset in ranked batches of `limit` ids until enough are found,
+    so the ids in the queryset are never all loaded.
+    """
+    ranked_scores = sorted(scores.iteritems(), key=get_score_key)
+    top_scores = []
+    for idx in range(0, len(ranked_scores), limit):
+        batch = ranked_scores[idx:idx + limit]
+        queryset_ids = set(queryset.filter(
+            id__in=[entity_id for entity_id, score in batch]
+        ).values_list('id', flat=True))
+        top_scores.extend([item for item in batch if item[0] in queryset_ids])
+        if len(top_scores) >= limit:
+            break
+    return top_scores[:limit]
+
+
+def _load_task_skills(task_ids=None):
+    queryset = Task._meta.get_field('skills').remote_field.through.objects.all()
+    if task_ids is not None:
+        queryset = queryset.filter(task_id__in=task_ids)
+    return queryset.values_list('task_id', 'skill_id')
+
+
+def _load_user_skills(user_ids=None):
+    queryset = UserProfile._meta.get_field('skills').remote_field.through.objects.all()
+    if user_ids is not None:
+        queryset = queryset.filter(userprofile__user_id__in=user_ids)
+    return queryset.values_list('userprofile__user_id', 'skill_id')
+
+
+SKILL_INDEX_LOADERS = {
+    SKILL_INDEX_TASKS: _load_task_skills,
+    SKILL_INDEX_USERS: _load_user_skills
+}
+
+
+def _record_skill_index_changes(name, entity_ids):
+    get_redis_connection('default').eval(
+        RECORD_SKILL_INDEX_CHANGES_SCRIPT, 2, SKILL_INDEX_VERSION_KEY % name, SKILL_INDEX_CHANGES_KEY % name,
+        SKILL_INDEX_MAX_CHANGES, *entity_ids
+    )
+
+
+def update_skill_index(name, entity_ids=None):
+    """
+    Logs the entities (task or user ids) whose skills changed so every process reloads just those entities.
+    Without entity ids, every process rebuilds its index.
+    """
+    entity_ids = entity_ids is None and [SKILL_INDEX_RESET] or list(entity_ids)
+    _record_skill_index_changes(name, entity_ids)
+    # Other processes could reload uncommitted data in between, so log the changes again after the commit
+    transaction.on_commit(lambda: _record_skill_index_changes(name, entity_ids))
+
+
+def get_skill_index_changes(name, since_version):
+    """
+    Returns the current version and the entities changed since the given version
+    """
+    pipe = get_redis_connection('default').pipeline(transaction=True)
+    pipe.get(SKILL_INDEX_VERSION_KEY % name)
+    pipe.zrangebyscore(SKILL_INDEX_CHANGES_KEY % name, '(%s' % since_version, '+inf')
+    version, entity_ids = pipe.execute()
+    return int(version or 0), entity_ids
+
+
+def get_skill_index(name):
+    """
+    Returns the process local index, reloading only the entities other processes have changed since it was built.
+    The whole index is only rebuilt when it is too far behind the change log.
+    """
+    version_and_index = _skill_indexes.get(name, None)
+    local_version = version_and_index and version_and_index[0] or 0
+    version, changes = get_skill_index_changes(name, local_version)
+
+    if version_and_index and version == local_version:
+        return version_and_index[1]
+
+    if not version_and_index or version - local_version > SKILL_INDEX_MAX_CHANGES or \
+            version < local_version or SKILL_INDEX_RESET in changes:
+        index = SkillIndex(SKILL_INDEX_LOADERS[name]())
+    else:
+        index = version_and_index[1]
+        entity_ids = [int(entity_id) for entity_id in changes]
+        for entity_id in entity_ids:
+            index.remove(entity_id)
+        for entity_id, skill_id in SKILL_INDEX_LOADERS[name](entity_ids):
+            index.add(entity_id, skill_id)
+    _skill_indexes[name] = (version, index)
+    return index
+
+
+def get_user_skill_ids(user):
+    return get_skill_index(SKILL_INDEX_USERS).get_skill_ids(getattr(user, 'id', user))
+
+
+def get_task_skill_ids(task):
+    return get_skill_index(SKILL_INDEX_TASKS).get_skill_ids(getattr(task, 'id', task))
+
+
+def match_tasks(skill_ids, task_ids=None):
+    return get_skill_index(SKILL_INDEX_TASKS).scores(skill_ids, entity_ids=task_ids)
+
+
+def match_users(skill_ids, user_ids=None):
+    return get_skill_index(SKILL_INDEX_USERS).scores(skill_ids, entity_ids=user_ids)
+
+
+def annotate_skill_matches(queryset, scores, name='matches', exclude_unmatched=True, limit=SKILL_MATCH_LIMIT):
+    """
+    Annotates the queryset with precomputed match scores.
+    Ids are grouped by score so the CASE has one branch per distinct score instead of one per skill.
+    Only the top `limit` matches of the entities left in the queryset are kept to bound the size of the query,
+    so the queryset should already be filtered.
+    """
+    if limit and len(scores) > limit:
+        scores = dict(get_queryset_top_scores(queryset, scores, limit))
+
+    ids_by_score = defaultdict(list)
+    for entity_id, score in scores.iteritems():
+        ids_by_score[score].append(entity_id)
+
+    queryset = queryset.annotate(**{
+        name: Case(
+            *[When(id__in=entity_ids, then=Value(score)) for score, entity_ids in ids_by_score.iteritems()],
+            default=Value(0),
+            output_field=IntegerField()
+        )
+    })
+    if exclude_unmatched:
+        queryset = queryset.filter(**{'%s__gt' % name: 0})
+    return queryset
@@ -1,3 +1,208 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.management.base import CommandError
+from django_redis import get_redis_connection
+from django_rq.queues import get_queue
+from requests.exceptions import ConnectionError
+from rest_framework.request import Request
+from rest_framework.test import APITestCase, APIRequestFactory
 
-# Create your tests here.
+from tunga_tasks.models import Task
+from tunga_utils.constants import STATUS_COMPLETED, STATUS_FAILED
+from tunga_utils.models import ScheduledJobRun
+from tunga_utils.pagination import KeysetPagination, OptionalKeysetPagination
+from tunga_utils.provider_clients import PROVIDER_METRICS_KEY, get_provider_session, get_provider_object, \
+    get_provider_metrics
+from tunga_utils.scheduler import SCHEDULER_LEADER_KEY, SCHEDULED_JOB_LOCK_KEY, SCHEDULED_JOB_PENDING_KEY, \
+    SCHEDULER_QUEUE, elect_scheduler_leader, resign_scheduler_leader, dispatch_scheduled_job, run_scheduled_job
+from tunga_utils.skill_matching import SkillIndex, annotate_skill_matches, match_tasks, get_task_skill_ids, \
+    get_skill_index, SKILL_INDEX_TASKS, SKILL_MATCH_LIMIT
+
+
+class PaginationTestCase(APITestCase):
+
+    def setUp(self):
+        for idx in range(7):
+            get_user_model().objects.create_user('user%s' % idx, 'user%s@example.com' % idx, 'secret')
+        self.factory = APIRequestFactory()
+
+    def __paginate(self, paginator, url):
+        request = Request(self.factory.get(url))
+        page = paginator.paginate_queryset(get_user_model().objects.all(), request)
+        return page, paginator.get_paginated_response([user.id for user in page]).data
+
+    def test_keyset_pagination(self):
+        """
+        Keyset pages follow the cursor without overlapping and cover the whole queryset
+        """
+        all_ids = list(get_user_model().objects.order_by('-id').values_list('id', flat=True))
+
+        seen_ids = []
+        url = '/?page_size=3&count=1'
+        while url:
+            page, data = self.__paginate(KeysetPagination(), url)
+            self.assertEqual(data['count'], len(all_ids))
+            self.assertFalse(data['count_is_capped'])
+            seen_ids.extend(data['results'])
+            url = data['next']
+        self.assertEqual(seen_ids, all_ids)
+
+    def test_optional_keyset_pagination(self):
+        """
+        Page number pagination is used unless keyset pagination is requested
+        """
+        page, data = self.__paginate(OptionalKeysetPagination(), '/?page_size=3')
+        self.assertEqual(data['count'], 7)
+        self.assertEqual(len(data['results']), 3)
+
+        page, data = self.__paginate(OptionalKeysetPagination(), '/?page_size=3&pagination=keyset')
+        self.assertNotIn('count', data)
+        self.assertEqual(len(data['results']), 3)
+        self.assertIn('cursor=', data['next'])
+
+        page, data = self.__paginate(OptionalKeysetPagination(), data['next'])
+        self.assertEqual(len(data['results']), 3)
+
+
+class SkillMatchingTestCase(APITestCase):
+
+    def test_skill_index(self):
+        """
+        Entities are scored by the number of skills they share with the query
+        """
+        index = SkillIndex([(1, 10), (1, 11), (2, 11), (3, 12), (4, 10), (4, 11)])
+        self.assertEqual(index.scores([10, 11]), {1: 2, 2: 1, 4: 2})
+        self.assertEqual(index.scores([10, 11], entity_ids=[2, 4]), {2: 1, 4: 2})
+        self.assertEqual(index.top([10, 11, 12], 3), [(4, 2), (1, 2), (3, 1)])
+        self.assertEqual(index.get_skill_ids(4), frozenset([10, 11]))
+
+    def test_task_matches(self):
+        """
+        The task index follows skill changes and ranks tasks in the database
+        """
+        user = get_user_model().objects.create_user('user', 'user@example.com', 'secret')
+        django_task = Task.objects.create(title='Django', skills='Django', fee=15, user=user)
+        react_task = Task.objects.create(title='React', skills='React.js', fee=15, user=user)
+        full_stack_task = Task.objects.create(title='Full stack', skills='Django, React.js', fee=15, user=user)
+
+        skill_ids = get_task_skill_ids(full_stack_task)
+        self.assertEqual(len(skill_ids), 2)
+        ranked_tasks = annotate_skill_matches(Task.objects.all(), match_tasks(skill_ids)).order_by('-matches', 'id')
+        self.assertEqual(
+            [(task.id, task.matches) for task in ranked_tasks],
+            [(full_stack_task.id, 2), (django_task.id, 1), (react_task.id, 1)]
+        )
+
+        # The cap applies to the filtered queryset and ties go to the newest task
+        self.assertEqual(
+            [task.id for task in annotate_skill_matches(
+                Task.objects.exclude(id=full_stack_task.id), match_tasks(skill_ids), limit=1
+            )],
+            [react_task.id]
+        )
+
+        # Large match sets are capped within sqlite's parameter limit
+        Task.objects.bulk_create([Task(title='Task %s' % idx, fee=15, user=user) for idx in range(600)])
+        scores = dict([(task_id, 1) for task_id in Task.objects.values_list('id', flat=True)])
+        self.assertEqual(
+            [task.matches for task in annotate_skill_matches(Task.objects.all(), scores)], [1] * SKILL_MATCH_LIMIT
+        )
+
+        # Changes are applied to the existing index instead of rebuilding it
+        index = get_skill_index(SKILL_INDEX_TASKS)
+        react_task.skills = 'Angular'
+        react_task.save()
+        self.assertEqual(match_tasks(skill_ids), {full_stack_task.id: 2, django_task.id: 1})
+        self.assertIs(get_skill_index(SKILL_INDEX_TASKS), index)
+
+        django_task.delete()
+        self.assertEqual(match_tasks(skill_ids), {full_stack_task.id: 2})
+        self.assertIs(get_skill_index(SKILL_INDEX_TASKS), index)
+
+
+class SchedulerTestCase(APITestCase):
+
+    def setUp(self):
+        self.command = 'tunga_slack_reply_metrics'
+        get_redis_connection('default').delete(
+            SCHEDULER_LEADER_KEY, SCHEDULED_JOB_LOCK_KEY % self.command, SCHEDULED_JOB_PENDING_KEY % self.command
+        )
+        get_queue(SCHEDULER_QUEUE).empty()
+
+    def tearDown(self):
+        self.setUp()
+
+    def test_scheduler_leader(self):
+        """
+        Only the leader dispatches commands and a command is only queued once until it starts
+        """
+        self.assertTrue(elect_scheduler_leader('first'))
+        self.assertFalse(elect_scheduler_leader('second'))
+        self.assertTrue(elect_scheduler_leader('first'))
+
+        self.assertFalse(dispatch_scheduled_job(self.command, 'second'))
+        self.assertTrue(dispatch_scheduled_job(self.command, 'first'))
+        self.assertFalse(dispatch_scheduled_job(self.command, 'first'))
+        self.assertEqual(get_queue(SCHEDULER_QUEUE).count, 1)
+
+        resign_scheduler_leader('second')
+        self.assertFalse(elect_scheduler_leader('second'))
+        resign_scheduler_leader('first')
+        self.assertTrue(elect_scheduler_leader('second'))
+
+    def test_scheduled_job_runs(self):
+        """
+        Runs are recorded with their outcome and skipped while a previous run holds the lock
+        """
+        self.assertTrue(run_scheduled_job(self.command))
+        run = ScheduledJobRun.objects.get(name=self.command)
+        self.assertEqual(run.status, STATUS_COMPLETED)
+        self.assertIsNotNone(run.duration)
+
+        get_redis_connection('default').set(SCHEDULED_JOB_LOCK_KEY % self.command, 'running')
+        self.assertFalse(run_scheduled_job(self.command))
+        self.assertEqual(ScheduledJobRun.objects.filter(name=self.command).count(), 1)
+
+        with self.assertRaises(CommandError):
+            run_scheduled_job('tunga_unknown_command')
+        run = ScheduledJobRun.objects.get(name='tunga_unknown_command')
+        self.assertEqual(run.status, STATUS_FAILED)
+        self.assertIn('CommandError', run.error)
+
+
+class ProviderClientsTestCase(APITestCase):
+
+    def setUp(self):
+        self.provider = 'tunga_test'
+        get_redis_connection('default').delete(PROVIDER_METRICS_KEY % self.provider)
+
+    def tearDown(self):
+        self.setUp()
+
+    def test_provider_sessions(self):
+        """
+        Provider sessions are reused, have timeouts and record their requests and errors
+        """
+        session = get_provider_session(self.provider)
+        self.assertIs(get_provider_session(self.provider), session)
+        self.assertTrue(session.timeout)
+
+        with self.assertRaises(ConnectionError):
+            session.get('http://127.0.0.1:1/')
+        metrics = get_provider_metrics(self.provider)
+        self.assertEqual(metrics['request_count'], 1)
+        self.assertEqual(metrics['error_rate'], 1)
+
+    def test_provider_objects(self):
+        """
+        Provider objects are only reloaded once they expire
+        """
+        loads = []
+
+        def load():
+            loads.append(True)
+            return len(loads)
+
+        self.assertEqual(get_provider_object(self.provider, 'account', load), 1)
+        self.assertEqual(get_provider_object(self.provider, 'account', load), 1)
+        self.assertEqual(get_provider_object(self.provider, 'account', load, timeout=0), 2)
+        self.assertEqual(get_provider_object(self.provider, 'account', load, timeout=None), 2)